@@ -0,0 +1,89 @@
+'''Tick-to-bar aggregation: a pandas loop per security (resample + groupby,
+as one would write over get_Ticks frames) against blpaggregate's segment
+reductions, on synthetic ticks for many securities.
+
+    python benchmarks/bench_aggregate.py [ticks] [securities]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+
+import blpaggregate
+
+
+def synthetic(ticks, secs):
+    # one day of trades per security, times sorted, back to back
+    rng = np.random.default_rng(0)
+    counts = np.full(secs, ticks // secs)
+    counts[:ticks % secs] += 1
+    owner = np.repeat(np.arange(secs), counts)
+    day = np.int64(6 * 3600 * 10 ** 6)
+    t = np.datetime64('2016-04-11T00:00:00', 'us') + np.sort(
+        owner * day * 2 + rng.integers(0, day, ticks)).astype('timedelta64[us]')
+    t -= (owner * day * 2).astype('timedelta64[us]')
+    price = 100 * np.exp(np.cumsum(rng.normal(0, 1e-4, ticks)))
+    size = rng.integers(1, 50, ticks) * 100
+    return blpaggregate.Segments(['%d JT Equity' % (1000 + i) for i in range(secs)],
+                                 np.concatenate([[0], np.cumsum(counts)]), t, price, size)
+
+
+def pandas_time_bars(seg, seconds):
+    out = {}
+    rule = '%ds' % seconds
+    for i, key in enumerate(seg.keys):
+        lo, hi = seg.offsets[i], seg.offsets[i + 1]
+        df = pd.DataFrame({'price': seg.price[lo:hi], 'size': seg.size[lo:hi]},
+                          index=pd.DatetimeIndex(seg.time[lo:hi]))
+        df['value'] = df['price'] * df['size']
+        bars = df['price'].resample(rule).ohlc()
+        sums = df[['size', 'value']].resample(rule).sum()
+        bars['VOLUME'] = sums['size']
+        bars['VWAP'] = sums['value'] / sums['size']
+        out[key] = bars.dropna(subset=['open'])
+    return out
+
+
+def pandas_volume_bars(seg, volume):
+    out = {}
+    for i, key in enumerate(seg.keys):
+        lo, hi = seg.offsets[i], seg.offsets[i + 1]
+        df = pd.DataFrame({'price': seg.price[lo:hi], 'size': seg.size[lo:hi]})
+        bar = (df['size'].cumsum() - df['size']) // volume
+        df['value'] = df['price'] * df['size']
+        g = df.groupby(bar)
+        out[key] = pd.DataFrame({'open': g['price'].first(), 'high': g['price'].max(),
+                                 'low': g['price'].min(), 'close': g['price'].last(),
+                                 'VOLUME': g['size'].sum(), 'VWAP': g['value'].sum() / g['size'].sum()})
+    return out
+
+
+def timed(fn, *args):
+    t0 = time.time()
+    out = fn(*args)
+    return time.time() - t0, sum(len(v) if hasattr(v, 'index') else v.n for v in out.values())
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    secs = int(sys.argv[2]) if len(sys.argv) > 2 else 225
+    seg = synthetic(ticks, secs)
+    print("%d ticks, %d securities" % (len(seg), secs))
+    print("%-18s %10s %10s %10s %8s" % ('bars', 'pandas s', 'segments s', 'bars', 'speedup'))
+    for name, slow, fast, arg in [('10 second', pandas_time_bars, blpaggregate.time_bars, 10),
+                                  ('1 minute', pandas_time_bars, blpaggregate.time_bars, 60),
+                                  ('50k shares', pandas_volume_bars, blpaggregate.volume_bars, 50000)]:
+        t_slow, n_slow = timed(slow, seg, arg)
+        t_fast, n_fast = timed(fast, seg, arg)
+        assert n_slow == n_fast, (name, n_slow, n_fast)
+        print("%-18s %10.2f %10.2f %10d %7.1fx" % (name, t_slow, t_fast, n_fast, t_slow / t_fast))
+    t_fast, n_fast = timed(blpaggregate.tick_bars, seg, 500)
+    print("%-18s %10s %10.2f %10d" % ('500 ticks', '-', t_fast, n_fast))
+
+
+if __name__ == '__main__':
+    main()
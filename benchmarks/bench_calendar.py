@@ -0,0 +1,69 @@
+'''Localizing timestamps: per-tick datetime arithmetic (the old UTC_OFFSET
+loops), pandas tz_convert, and blpcalendar's cached offset table, for a
+New York name over a range that crosses both DST changes.  Also times the
+business-day calendar, built afresh versus served from the cache.
+
+    python benchmarks/bench_calendar.py [rows]
+'''
+import datetime as dt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+
+import blpcalendar
+
+UTC_OFFSET = dt.timedelta(hours=5)
+
+
+def per_tick(times):
+    return [t - UTC_OFFSET for t in times.astype(dt.datetime)]
+
+
+def tz_convert(times):
+    return pd.DatetimeIndex(times).tz_localize('UTC').tz_convert('America/New_York').tz_localize(None)
+
+
+def table(times):
+    return blpcalendar.for_security('IBM US Equity').to_local(times)
+
+
+def timed(fn, *args):
+    best = None
+    for _ in range(3):
+        t0 = time.time()
+        fn(*args)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    start, end = np.datetime64('2016-01-01', 'us'), np.datetime64('2017-01-01', 'us')
+    times = start + np.sort(np.random.randint(0, int((end - start).astype(np.int64)), rows)).astype('timedelta64[us]')
+    ny = blpcalendar.for_security('IBM US Equity')
+    assert (table(times) == tz_convert(times).values.astype('datetime64[us]')).all()
+    print("%-22s %9s %14s" % ('localize', 'seconds', 'rows/s'))
+    for name, fn, n in [('per-tick datetime', per_tick, min(rows, 200000)),
+                        ('pandas tz_convert', tz_convert, rows), ('blpcalendar table', table, rows)]:
+        elapsed = timed(fn, times[:n])
+        print("%-22s %9.3f %14.0f" % (name, elapsed, n / elapsed))
+    print("NY offset changes in 2016: %d" % (np.diff(ny.to_local(times) - times).astype(bool).sum()))
+
+    tokyo = blpcalendar.EXCHANGES['JT']
+    t0 = time.time()
+    blpcalendar.Exchange('JT', 'Asia/Tokyo', blpcalendar.TOKYO, blpcalendar._jp_holidays).calendar([2015, 2016])
+    built = time.time() - t0
+    tokyo.calendar([2015, 2016])
+    t0 = time.time()
+    tokyo.calendar([2015, 2016])
+    print("JP calendar: built %.1f ms, cached %.3f ms" % (built * 1000, (time.time() - t0) * 1000))
+
+
+if __name__ == '__main__':
+    main()
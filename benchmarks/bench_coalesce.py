@@ -0,0 +1,64 @@
+'''Coalescing: N threads asking for the same get_Hist / get_Bars at once, with
+blpfunctions.coalescer on and off.  Prints wall time, requests sent to the
+(fake) terminal and the hit/miss/coalesced counters.
+
+    python benchmarks/bench_coalesce.py [threads]
+'''
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import blpbackend
+blpbackend.use('fake')
+
+import fakeblpapi
+import blpfunctions
+from blpcache import Coalescer
+from blpmetrics import metrics
+
+SECS = ['%d JT Equity' % c for c in range(2000, 2050)]
+
+
+def hist():
+    blpfunctions.get_Hist(SECS, ['PX_LAST', 'PX_VOLUME'], '20150101', '20160415')
+
+
+def bars():
+    blpfunctions.get_Bars_many(SECS[:10], ['TRADE'], '2016-04-11T09:00:00', '2016-04-15T15:00:00', 5, ['VOLUME'])
+
+
+def burst(fn, threads):
+    # every thread calls fn at the same moment; returns the wall time
+    start = threading.Barrier(threads + 1)
+    workers = [threading.Thread(target=lambda: (start.wait(), fn())) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    t0 = time.time()
+    start.wait()
+    for worker in workers:
+        worker.join()
+    return time.time() - t0
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    fakeblpapi.LATENCY.update(start=0, openService=0, request=0.05)
+    blpfunctions.disk_cache = None
+    blpfunctions.get_index('NKY Index')     # start the session before timing
+    print("%-5s %-9s %8s %9s %6s %7s %10s" % ('case', 'coalescer', 'wall s', 'requests',
+                                             'hits', 'misses', 'coalesced'))
+    for name, fn in [('hist', hist), ('bars', bars)]:
+        for coalescer in (None, Coalescer()):
+            blpfunctions.coalescer = coalescer
+            metrics.reset()
+            wall = burst(fn, threads)
+            count = lambda counter: sum(v for (c, _), v in metrics.counters.items() if c == counter)
+            print("%-5s %-9s %8.2f %9d %6d %7d %10d" % (name, 'on' if coalescer else 'off', wall, count('requests'),
+                                                       count('hits'), count('misses'), count('coalesced')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''Decode speed: per-tick list appends (the old get_Ticks/get_Bars loops) vs blpdecode,
+and decoding every bar field vs only VOLUME (what bbg_volcurve asks for).
+
+Messages are synthetic fakeblpapi responses built up front, so only the
+decode and DataFrame build are timed.
+
+    python benchmarks/bench_decode.py [minutes]
+'''
+import datetime as dt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakeblpapi
+sys.modules['blpapi'] = fakeblpapi
+
+import pandas as pd
+import blpcalendar
+import blpdecode
+from blpdecode import TIME, TYPE, VALUE, TICK_SIZE, OPEN, HIGH, LOW, CLOSE, VOLUME, NUM_EVENTS
+
+UTC_OFFSET = dt.timedelta(hours=-9)
+TOKYO = blpcalendar.EXCHANGES['JT']
+
+
+def messages(op, minutes):
+    start = dt.datetime(2016, 4, 11, 0, 0)
+    params = {'security': '6758 JT Equity', 'eventTypes': ['TRADE'], 'interval': 1,
+              'startDateTime': start, 'endDateTime': start + dt.timedelta(minutes=minutes)}
+    return list(fakeblpapi.RESPONDERS[op](params, None))
+
+
+def ticks_lists(msgs):
+    indexlist, typelist, pricelist, sizelist = [], [], [], []
+    for msg in msgs:
+        for item in msg.getElement("tickData").getElement("tickData").values():
+            time = item.getElementAsDatetime(TIME) - UTC_OFFSET
+            timeString = item.getElementAsString(TIME)
+            indexlist.append(timeString)
+            typelist.append(item.getElementAsString(TYPE))
+            pricelist.append(item.getElementAsFloat(VALUE))
+            sizelist.append(item.getElementAsInteger(TICK_SIZE))
+    return pd.DataFrame({'size': sizelist, 'price': pricelist, 'type': typelist}, index=indexlist)
+
+
+def ticks_columnar(msgs):
+    cols = blpdecode.Columns(blpdecode.TICK_COLUMNS)
+    for msg in msgs:
+        blpdecode.decode_ticks(msg.getElement("tickData").getElement("tickData"), cols)
+    return cols.frame(exchange=TOKYO)
+
+
+def bars_lists(msgs):
+    lists = dict((name, []) for name in ['index', 'OPEN', 'HIGH', 'LOW', 'CLOSE',
+                                         'numEvents', 'VOLUME', 'VALUE'])
+    for msg in msgs:
+        for bar in msg.getElement("barData").getElement("barTickData").values():
+            time = bar.getElementAsDatetime(TIME) - UTC_OFFSET
+            timeString = bar.getElementAsString(TIME)
+            lists['index'].append(time)
+            lists['OPEN'].append(bar.getElementAsFloat(OPEN))
+            lists['HIGH'].append(bar.getElementAsFloat(HIGH))
+            lists['LOW'].append(bar.getElementAsFloat(LOW))
+            lists['CLOSE'].append(bar.getElementAsFloat(CLOSE))
+            lists['numEvents'].append(bar.getElementAsInteger(NUM_EVENTS))
+            lists['VOLUME'].append(bar.getElementAsInteger(VOLUME))
+            lists['VALUE'].append(bar.getElementAsFloat(VALUE))
+    index = lists.pop('index')
+    return pd.DataFrame(lists, index=index)
+
+
+def bars_columnar(msgs):
+    cols = blpdecode.Columns(blpdecode.BAR_COLUMNS)
+    for msg in msgs:
+        blpdecode.decode_bars(msg.getElement("barData").getElement("barTickData"), cols)
+    return cols.frame(exchange=TOKYO)
+
+
+def bars_projected(msgs, fields=('VOLUME',)):
+    cols = blpdecode.Columns(blpdecode.bar_columns(fields))
+    for msg in msgs:
+        blpdecode.decode_bars(msg.getElement("barData").getElement("barTickData"), cols)
+    return cols.frame(fields, TOKYO)
+
+
+def timed(fn, msgs, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        out = fn(msgs)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(out)
+
+
+def main():
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 2 * 360
+    for op, old, new in [('IntradayTickRequest', ticks_lists, ticks_columnar),
+                         ('IntradayBarRequest', bars_lists, bars_columnar)]:
+        msgs = messages(op, minutes)
+        t_old, rows = timed(old, msgs)
+        t_new, _ = timed(new, msgs)
+        print("%-20s %8d rows  lists %7.3fs (%9.0f rows/s)  columnar %7.3fs (%9.0f rows/s)  %.2fx"
+              % (op, rows, t_old, rows / t_old, t_new, rows / t_new, t_old / t_new))
+    msgs = messages('IntradayBarRequest', minutes)
+    t_all, rows = timed(bars_columnar, msgs)
+    t_one, _ = timed(bars_projected, msgs)
+    print("%-20s %8d rows  all fields %7.3fs (%9.0f rows/s)  VOLUME only %7.3fs (%9.0f rows/s)  %.2fx"
+          % ('projection', rows, t_all, rows / t_all, t_one, rows / t_one, t_all / t_one))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''Import time: `import blpfunctions` in a fresh interpreter, against importing
+what it used to load eagerly (blpapi, numpy, pandas and its offsets,
+holidays_jp), and against the first call that does need them.
+
+Every case runs in a new process, best of `repeats`.  Uses BLP_BACKEND
+(fake by default), so no terminal is needed.
+
+    python benchmarks/bench_import.py [repeats]
+'''
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ENV = dict(os.environ)
+ENV.setdefault('BLP_BACKEND', 'fake')
+ENV['PYTHONPATH'] = ROOT + os.pathsep + ENV.get('PYTHONPATH', '')
+
+CASES = [('import blpfunctions', "import blpfunctions"),
+         ('  + options, Names', "import blpfunctions; blpfunctions.options; blpfunctions.SECURITY_DATA"),
+         ('  + first get_Bars', "import blpfunctions; blpfunctions.disk_cache = None; "
+                                "blpfunctions.get_Bars('6758 JT Equity', ['TRADE'], "
+                                "'2016-04-11T09:00:00', '2016-04-11T09:05:00', 1)"),
+         ('eager dependencies', "import blpbackend, blpapi, numpy, pandas, holidays_jp; "
+                                "from pandas.tseries.offsets import *")]
+
+
+def timed(code):
+    # seconds spent in `code`, measured inside the child so interpreter start-up is excluded
+    script = "import time; t0 = time.time(); %s; print(time.time() - t0)" % code
+    out = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT, env=ENV)
+    return float(out.decode().split()[-1])
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    timed("import blpfunctions")        # write .pyc files first
+    for name, code in CASES:
+        best = min(timed(code) for _ in range(repeats))
+        print("%-20s %8.1f ms" % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
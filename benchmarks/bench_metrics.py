@@ -0,0 +1,58 @@
+'''Instrumentation overhead: cost of a single observation, and get_Bars_many
+end to end with blpmetrics recording on and off.
+
+    python benchmarks/bench_metrics.py [num_secs] [repeats]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakeblpapi
+sys.modules['blpapi'] = fakeblpapi
+
+import blpfunctions
+from blpmetrics import metrics
+
+
+def per_call(fn, n=200000):
+    t0 = time.time()
+    for i in range(n):
+        fn()
+    return (time.time() - t0) / n
+
+
+def fetch(secs):
+    t0 = time.time()
+    blpfunctions.get_Bars_many(secs, ['TRADE'], '2016-04-11T09:00:00', '2016-04-15T15:00:00', 1,
+                               use_cache=False)
+    return time.time() - t0
+
+
+def main():
+    nsecs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    fakeblpapi.LATENCY['request'] = 0
+    blpfunctions.coalescer = None      # every fetch goes to the (fake) terminal
+    secs = ['%d JT Equity' % (1300 + i) for i in range(nsecs)]
+
+    print("observe()  : %6.2f us" % (per_call(lambda: metrics.observe('decode', 'IntradayBarRequest', 0.001)) * 1e6))
+    print("incr()     : %6.2f us" % (per_call(lambda: metrics.incr('messages', 'IntradayBarRequest')) * 1e6))
+    metrics.enabled = False
+    print("disabled   : %6.2f us" % (per_call(lambda: metrics.observe('decode', 'IntradayBarRequest', 0.001)) * 1e6))
+
+    metrics.reset()
+    fetch(secs)     # start the session before timing
+    timings = {}
+    for enabled in (False, True, False, True) * repeats:
+        metrics.enabled = enabled
+        timings.setdefault(enabled, []).append(fetch(secs))
+    off, on = min(timings[False]), min(timings[True])
+    print("get_Bars_many %d secs x 5 days: off %.3fs  on %.3fs  (%+.1f%%)" % (nsecs, off, on, (on / off - 1) * 100))
+    print("recorded %d messages, %d rows" % (metrics.counters.get(('messages', 'IntradayBarRequest'), 0),
+                                            metrics.counters.get(('rows', 'IntradayBarRequest'), 0)))
+
+
+if __name__ == '__main__':
+    main()
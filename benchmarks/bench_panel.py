@@ -0,0 +1,63 @@
+'''Aligning many securities' bars: the per-security DataFrame join loop
+(as in the notes at the bottom of blpfunctions) against blppanel.Panel,
+on synthetic 1-minute bars with random gaps.
+
+    python benchmarks/bench_panel.py [securities] [days]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+
+import blpdecode
+import blppanel
+
+
+def synthetic(secs, days):
+    rng = np.random.default_rng(0)
+    minutes = (np.datetime64('2016-04-11T00:00', 'us') + np.arange(days * 360).astype('timedelta64[m]')
+               + (np.arange(days * 360) // 360 * 1080).astype('timedelta64[m]'))
+    bars = {}
+    for i in range(secs):
+        t = minutes[rng.random(len(minutes)) < 0.9]
+        arrays = dict((name, rng.random(len(t)) * 100 if dtype == 'float64' else rng.integers(0, 1000, len(t)))
+                      for name, dtype in blpdecode.BAR_COLUMNS)
+        bars['%d JT Equity' % (1000 + i)] = blpdecode.Columns.from_arrays(blpdecode.BAR_COLUMNS, t, arrays)
+    return bars
+
+
+def joined(bars):
+    # one frame per security, joined pairwise into a wide CLOSE frame
+    close = pd.DataFrame()
+    for sec, cols in bars.items():
+        close = close.join(cols.frame(['CLOSE']).rename(columns={'CLOSE': sec}), how='outer')
+    return close
+
+
+def panel(bars):
+    return blppanel.Panel.from_columns(bars).frame('CLOSE')
+
+
+def timed(fn, *args):
+    t0 = time.time()
+    out = fn(*args)
+    return time.time() - t0, out
+
+
+def main():
+    secs = int(sys.argv[1]) if len(sys.argv) > 1 else 225
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bars = synthetic(secs, days)
+    t_join, a = timed(joined, bars)
+    t_panel, b = timed(panel, bars)
+    assert np.allclose(a.values, b.values, equal_nan=True)
+    print("%d securities x %d bars" % (secs, len(b)))
+    print("join loop %8.2f s   panel %8.2f s   %6.1fx" % (t_join, t_panel, t_join / t_panel))
+
+
+if __name__ == '__main__':
+    main()
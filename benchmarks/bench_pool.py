@@ -0,0 +1,53 @@
+'''Process-pool scaling: get_Bars_many on one process vs get_Bars_parallel
+on 1, 2, 4, ... workers (up to the number of cores).
+
+The fake backend decodes in-process, so the work per security is CPU-bound
+as with a local terminal; the disk cache is off so every run decodes.
+
+    python benchmarks/bench_pool.py [num_secs] [days]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import blpbackend
+blpbackend.use(os.environ.get(blpbackend.ENV, 'fake'))
+
+import fakeblpapi
+import blpfunctions
+import blppool
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.time()
+    fn(*args, **kwargs)
+    return time.time() - t0
+
+
+def main():
+    nsecs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    fakeblpapi.LATENCY.update(start=0, openService=0, request=0)
+    fakeblpapi.CONFIG['hours'] = (0, 6)
+    blpfunctions.disk_cache = None
+    blpfunctions.coalescer = None
+    secs = ['%d JT Equity' % (1300 + i) for i in range(nsecs)]
+    args = (secs, ['TRADE'], '2016-04-11T09:00:00', '2016-04-%02dT15:00:00' % (10 + days), 1)
+
+    serial = timed(blpfunctions.get_Bars_many, *args)
+    print("%d securities x %d days of 1-minute bars" % (nsecs, days))
+    print("  get_Bars_many            : %6.2fs" % serial)
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        blppool.pool(workers)
+        blppool.get_Bars_parallel(secs[:workers], *args[1:], processes=workers)     # start sessions
+        elapsed = timed(blppool.get_Bars_parallel, *args, processes=workers)
+        print("  get_Bars_parallel x %-4d : %6.2fs  (%.1fx)" % (workers, elapsed, serial / elapsed))
+        workers *= 2
+    blppool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+'''Scheduling under load, against fakeblpapi with throttling injected.
+
+A bulk thread pulls 5-minute bars for many securities (as bbg_volcurve
+does) while the main thread times small get_Hist lookups.  The fake
+terminal rejects requests beyond THROTTLE's rate and concurrency limits with
+LIMIT responseErrors, which the old loops silently dropped.  Three runs:
+
+    unscheduled   no priority, no rate limit, no retries (the old behaviour)
+    retries only  transient errors retried with backoff, no priority
+    scheduled     rate limit and concurrency cap under the terminal's,
+                  BULK for the bars, retries
+
+Prints lookup latency, bars lost and throttled responses per run.
+
+    python benchmarks/bench_scheduler.py [securities]
+'''
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['BLP_BACKEND'] = 'fake'
+
+import fakeblpapi
+import blpfunctions
+import blpscheduler
+from blpmetrics import metrics
+
+START, END = '2016-03-17T09:00:00', '2016-03-24T15:00:00'
+
+
+def run(secs, settings, bulk_priority):
+    fakeblpapi.STATS.clear()
+    metrics.reset()
+    blpscheduler.scheduler = blpscheduler.Scheduler(backoff=0.05, max_backoff=1.0, **settings)
+    bars = {}
+
+    def bulk():
+        with blpscheduler.priority(bulk_priority):
+            bars.update(blpfunctions.get_Bars_many(secs, ['TRADE'], START, END, 5, use_cache=False))
+
+    thread = threading.Thread(target=bulk)
+    thread.start()
+    time.sleep(0.2)
+    latency = []
+    while thread.is_alive():
+        t0 = time.time()
+        blpfunctions.get_Hist([secs[len(latency) % len(secs)]], ['PX_LAST'], '20160101', '20160301',
+                              use_cache=False)
+        latency.append(time.time() - t0)
+    thread.join()
+    latency.sort()
+    return (latency[len(latency) // 2], latency[-1], len(latency),
+            sum(len(frame) for frame in bars.values()), fakeblpapi.STATS['throttled'])
+
+
+def main():
+    secs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    secs = ['%d JT Equity' % (1300 + i) for i in range(secs)]
+    blpfunctions.disk_cache = None
+    blpfunctions.coalescer = None
+    blpfunctions.session_manager.size = 2
+    fakeblpapi.LATENCY['request'] = 0.02
+    fakeblpapi.THROTTLE.update(rate=100, burst=10, max_in_flight=6)
+    print("%d securities; terminal throttles above 100 req/s or 6 outstanding" % len(secs))
+    print("%-14s %12s %12s %8s %10s %10s" % ('', 'lookup p50', 'lookup max', 'lookups', 'bar rows', 'throttled'))
+    for name, settings, level in [('unscheduled', {'retries': 0}, blpscheduler.NORMAL),
+                                  ('retries only', {'retries': 5}, blpscheduler.NORMAL),
+                                  ('scheduled', {'retries': 5, 'rate': 80, 'burst': 8, 'max_concurrent': 5},
+                                   blpscheduler.BULK)]:
+        p50, worst, n, rows, throttled = run(secs, settings, level)
+        print("%-14s %10.1f ms %10.1f ms %8d %10d %10d" % (name, p50 * 1000, worst * 1000, n, rows, throttled))
+    wait = metrics.percentiles('queue_wait', 'interactive')
+    print("scheduled queue wait, interactive: p50 %.1f ms  p99 %.1f ms" % (wait[50] * 1000, wait[99] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+'''Session handshake cost: one blpapi.Session per call vs the shared SessionManager.
+
+Runs against fakeblpapi, so no terminal is needed.  The fake's simulated
+start/openService latencies (fakeblpapi.LATENCY) stand in for the real
+handshake; adjust them to match what you measure on a terminal.
+
+    python benchmarks/bench_session.py [num_requests]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakeblpapi
+sys.modules['blpapi'] = fakeblpapi
+
+import blpapi
+from blpsession import SessionManager
+
+
+def build_request(service, sec):
+    request = service.createRequest("ReferenceDataRequest")
+    request.append("securities", sec)
+    request.append("fields", "PX_LAST")
+    return request
+
+
+def drain(session):
+    while True:
+        ev = session.nextEvent(500)
+        if ev.eventType() == blpapi.Event.RESPONSE:
+            return
+
+
+def per_call(options, secs):
+    for sec in secs:
+        session = blpapi.Session(options)
+        session.start()
+        session.openService('//blp/refdata')
+        try:
+            session.sendRequest(build_request(session.getService("//blp/refdata"), sec))
+            drain(session)
+        finally:
+            session.stop()
+
+
+def shared(options, secs):
+    manager = SessionManager(options)
+    for sec in secs:
+        with manager.borrow() as session:
+            session.sendRequest(build_request(session.getService("//blp/refdata"), sec))
+            drain(session)
+    manager.stop()
+    return manager.stats
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    secs = ['%d JT Equity' % (1300 + i) for i in range(n)]
+    options = blpapi.SessionOptions()
+
+    t0 = time.time()
+    per_call(options, secs)
+    t_per_call = time.time() - t0
+
+    t0 = time.time()
+    stats = shared(options, secs)
+    t_shared = time.time() - t0
+
+    print("%d requests" % n)
+    print("  session per call : %8.3fs  (%.2f ms/request)" % (t_per_call, 1000 * t_per_call / n))
+    print("  shared manager   : %8.3fs  (%.2f ms/request)" % (t_shared, 1000 * t_shared / n))
+    print("  speedup          : %8.1fx" % (t_per_call / t_shared))
+    print("  manager stats    : %s" % stats)
+
+
+if __name__ == '__main__':
+    main()
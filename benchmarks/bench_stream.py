@@ -0,0 +1,64 @@
+'''Subscription throughput: updates/sec through MarketData's dispatcher into
+the ring buffers, with reader threads polling snapshot/last/bars throughout.
+
+The fake event source publishes fakeblpapi.CONFIG['mktdata_burst'] updates
+per security as fast as the dispatcher drains them.
+
+    python benchmarks/bench_stream.py [num_secs] [updates_per_sec] [readers]
+'''
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakeblpapi
+sys.modules['blpapi'] = fakeblpapi
+
+from blpstream import MarketData
+
+
+def reader(md, secs, stop, counts):
+    n = 0
+    while not stop.is_set():
+        sec = secs[n % len(secs)]
+        md.snapshot()
+        md.last(sec, 100)
+        md.bars(sec, 10)
+        n += 1
+    counts.append(n)
+
+
+def main():
+    nsecs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    nreaders = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    fakeblpapi.LATENCY['start'] = 0
+    fakeblpapi.CONFIG['mktdata_burst'] = burst
+    secs = ['%d JT Equity' % (1300 + i) for i in range(nsecs)]
+    expected = nsecs * burst
+
+    md = MarketData(capacity=4096).start()
+    stop, counts = threading.Event(), []
+    readers = [threading.Thread(target=reader, args=(md, secs, stop, counts)) for _ in range(nreaders)]
+
+    t0 = time.time()
+    md.subscribe(secs)
+    for t in readers:
+        t.start()
+    while md.stats['messages'] < expected and time.time() - t0 < 120:
+        time.sleep(0.01)
+    elapsed = time.time() - t0
+    stop.set()
+    for t in readers:
+        t.join()
+    md.stop()
+
+    print("%d securities x %d updates = %d messages in %.2fs" % (nsecs, burst, md.stats['messages'], elapsed))
+    print("  dispatcher throughput : %10.0f updates/s" % (md.stats['messages'] / elapsed))
+    print("  reader polls          : %10d  (%d readers, snapshot+last+bars each)" % (sum(counts), nreaders))
+
+
+if __name__ == '__main__':
+    main()
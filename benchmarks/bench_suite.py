@@ -0,0 +1,88 @@
+'''Rows/sec for get_Ticks, get_Bars, get_Hist and bbg_volcurve at realistic
+sizes, offline.
+
+Runs against BLP_BACKEND (fake by default; replay:<dir> to time recorded
+sessions).  The disk caches are switched off so every run decodes.  For
+each case the wall time covers the whole call; the decode column comes
+from blpmetrics, i.e. the time spent turning messages into Columns, which
+is what regressions in blpdecode show up in.
+
+    python benchmarks/bench_suite.py [case ...]
+    BLP_BACKEND=replay:/data/blp python benchmarks/bench_suite.py bars
+
+benchmarks/test_suite.py runs the same cases, smaller, under
+pytest-benchmark, along with checks that equivalent calls agree.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import blpbackend
+blpbackend.use(os.environ.get(blpbackend.ENV, 'fake'))
+
+import fakeblpapi
+import blpfunctions
+from blpmetrics import metrics
+
+NKY = ['%d JT Equity' % c for c in range(1301, 1526)]
+
+
+def ticks():
+    # a busy name: 5 sessions of ticks
+    return blpfunctions.get_Ticks_many(NKY[:2], ['TRADE'], '2016-04-11T09:00:00', '2016-04-15T15:00:00')
+
+
+def bars():
+    # index members, 1-minute bars, a week
+    return blpfunctions.get_Bars_many(NKY[:50], ['TRADE'], '2016-04-11T09:00:00', '2016-04-15T15:00:00', 1)
+
+
+def hist():
+    # 500 names x 3 fields x 2 years
+    return blpfunctions.get_Hist(['%d JT Equity' % c for c in range(2000, 2500)],
+                                 ['PX_LAST', 'PX_VOLUME', 'PX_OPEN'], '20140101', '20151231')
+
+
+def volcurve():
+    # the production volume curve: full index, 20 days of 1-minute bars
+    return blpfunctions.bbg_volcurve('NKY Index', ['TRADE'], '2016-04-15T15:00:00', 20, 1, {})
+
+
+CASES = [('ticks', ticks, 'IntradayTickRequest'),
+         ('bars', bars, 'IntradayBarRequest'),
+         ('hist', hist, 'HistoricalDataRequest'),
+         ('volcurve', volcurve, 'IntradayBarRequest')]
+
+
+def configure():
+    '''No simulated latency, one Tokyo session per day, no caches.'''
+    fakeblpapi.LATENCY.update(start=0, openService=0, request=0)
+    fakeblpapi.CONFIG['hours'] = (0, 6)
+    blpfunctions.disk_cache = None
+    blpfunctions.index_cache = None
+    blpfunctions.coalescer = None
+
+
+def main():
+    wanted = sys.argv[1:] or [name for name, _, _ in CASES]
+    configure()
+    blpfunctions.get_index('NKY Index')     # start the session before timing
+
+    print("%-9s %10s %9s %12s %9s %12s" % ('case', 'rows', 'wall s', 'rows/s', 'decode s', 'decode rows/s'))
+    for name, fn, kind in CASES:
+        if name not in wanted:
+            continue
+        metrics.reset()
+        t0 = time.time()
+        fn()
+        wall = time.time() - t0
+        rows = metrics.counters.get(('rows', kind), 0)
+        decode = metrics.histograms[('decode', kind)].sum if ('decode', kind) in metrics.histograms else 0
+        print("%-9s %10d %9.2f %12.0f %9.2f %12.0f" % (name, rows, wall, rows / wall,
+                                                       decode, rows / decode if decode else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+'''pytest version of bench_suite: equivalent calls must agree on the fake
+backend, and the get_* paths are timed with pytest-benchmark, so that both
+wrong results and slowdowns show up in a run.
+
+    python -m pytest benchmarks/test_suite.py
+    python -m pytest benchmarks/test_suite.py --benchmark-compare   # against a saved run
+'''
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+
+import bench_suite
+import fakeblpapi
+import blpasync
+import blpbars
+import blpcache
+import blpcalendar
+import blpfunctions
+import blpscheduler
+from blpmetrics import metrics
+
+SECS = bench_suite.NKY[:3]
+START, END = '2016-04-11T09:00:00', '2016-04-13T15:00:00'
+
+
+@pytest.fixture(autouse=True)
+def fake(monkeypatch):
+    bench_suite.configure()
+    monkeypatch.setattr(blpscheduler, 'scheduler', blpscheduler.Scheduler(backoff=0.001, max_backoff=0.01))
+    for name in ('SPLIT_SESSIONS', 'HIST_BATCH'):
+        monkeypatch.setattr(blpfunctions, name, getattr(blpfunctions, name))
+    monkeypatch.setattr(fakeblpapi, 'THROTTLE', dict(fakeblpapi.THROTTLE))
+
+
+def assert_frames(a, b):
+    assert sorted(a) == sorted(b)
+    for key in a:
+        assert a[key].equals(b[key]), key
+
+
+def test_bars_many_matches_single():
+    many = blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 5)
+    assert_frames(many, dict((s, blpfunctions.get_Bars(s, ['TRADE'], START, END, 5)) for s in SECS))
+    assert all(len(frame) for frame in many.values())
+
+
+def test_split_sessions_match_one_request(monkeypatch):
+    split = blpfunctions.get_Ticks_many(SECS, ['TRADE', 'BID'], START, END)
+    monkeypatch.setattr(blpfunctions, 'SPLIT_SESSIONS', False)
+    assert_frames(split, blpfunctions.get_Ticks_many(SECS, ['TRADE', 'BID'], START, END))
+
+
+def test_hist_batches_and_layouts_agree(monkeypatch):
+    secs = bench_suite.NKY[:7]
+    wide = blpfunctions.get_Hist(secs, ['PX_LAST', 'PX_VOLUME'], '20150101', '20150630')
+    monkeypatch.setattr(blpfunctions, 'HIST_BATCH', 2)
+    assert wide.equals(blpfunctions.get_Hist(secs, ['PX_LAST', 'PX_VOLUME'], '20150101', '20150630'))
+    long = blpfunctions.get_Hist(secs, ['PX_LAST', 'PX_VOLUME'], '20150101', '20150630', long=True)
+    pivot = long.pivot_table(index='date', columns=['security', 'field'], values='value')
+    assert pivot.reindex(columns=wide.columns).equals(wide.rename_axis('date'))
+
+
+def test_disk_cache_serves_what_was_fetched(monkeypatch, tmp_path):
+    direct = blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231')
+    bars = blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1)
+    monkeypatch.setattr(blpfunctions, 'disk_cache', blpcache.DiskCache(str(tmp_path)))
+    # first half, then the whole range: the second call fetches only the gap
+    blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20150630')
+    assert blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231').equals(direct)
+    assert blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231').equals(direct)
+    for _ in range(2):
+        assert_frames(blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1), bars)
+
+
+def test_disk_cache_refetches_failed_requests(monkeypatch, tmp_path):
+    direct = blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231')
+    bars = blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1)
+    monkeypatch.setattr(blpfunctions, 'disk_cache', blpcache.DiskCache(str(tmp_path)))
+    blpscheduler.scheduler.configure(retries=0)
+    fakeblpapi.THROTTLE.update(errors=1.0)
+    assert blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231').isna().all().all()
+    assert not any(len(frame) for frame in blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1).values())
+    # some of the days fail: only those are fetched again
+    fakeblpapi.THROTTLE.update(errors=0.5)
+    blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1)
+    fakeblpapi.THROTTLE.update(errors=0.0)
+    assert blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20151231').equals(direct)
+    assert_frames(blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1), bars)
+
+
+def test_async_matches_blocking():
+    hist, ticks = asyncio.run(_async_calls())
+    assert hist.equals(blpfunctions.get_Hist(SECS, ['PX_LAST'], '20150101', '20150630'))
+    assert ticks.equals(blpfunctions.get_Ticks(SECS[0], ['TRADE'], START, START[:11] + '10:00:00'))
+
+
+async def _async_calls():
+    return await asyncio.gather(blpasync.get_Hist(SECS, ['PX_LAST'], '20150101', '20150630'),
+                                blpasync.get_Ticks(SECS[0], ['TRADE'], START, START[:11] + '10:00:00'))
+
+
+def test_volcurve_state_matches_volcurve():
+    adv, sums, curves = blpfunctions.bbg_volcurve('NKY Index', ['TRADE'], '2016-04-15T15:00:00', 2, 5, {})
+    state = blpfunctions.bbg_volcurve_state('NKY Index', ['TRADE'], '2016-04-15T15:00:00', 2, 5, {})
+    adv2, sums2, curves2 = state.result()
+    assert (adv.values == adv2.values).all()
+    assert (sums.values == sums2.values).all()
+
+
+def test_retries_recover_throttled_requests():
+    clean = blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1)
+    fakeblpapi.THROTTLE.update(max_in_flight=2, errors=0.2)
+    blpscheduler.scheduler.configure(retries=20)
+    throttled = fakeblpapi.STATS['throttled']
+    assert_frames(blpfunctions.get_Bars_many(SECS, ['TRADE'], START, END, 1), clean)
+    assert fakeblpapi.STATS['throttled'] > throttled
+    assert blpscheduler.scheduler.in_flight == 0
+
+
+def test_requests_inside_iter_loop_under_cap():
+    # iter_Ticks keeps its slot while suspended; the get_Bars inside must not wait on it
+    blpscheduler.scheduler.configure(max_concurrent=1)
+    rows = []
+
+    def loop():
+        for frame in blpfunctions.iter_Ticks(SECS[0], ['TRADE'], START, END):
+            rows.append(len(blpfunctions.get_Bars(SECS[1], ['TRADE'], START, END, 1)))
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive()
+    assert rows and all(rows)
+    assert blpscheduler.scheduler.in_flight == 0
+
+
+def test_leaving_iter_loop_keeps_session():
+    bars = blpfunctions.get_Bars(SECS[0], ['TRADE'], START, END, 1)
+    starts = blpfunctions.session_manager.stats['starts']
+    for _ in range(3):
+        for frame in blpfunctions.iter_Ticks(SECS[0], ['TRADE'], START, END):
+            break
+    assert blpfunctions.get_Bars(SECS[0], ['TRADE'], START, END, 1).equals(bars)
+    assert blpfunctions.session_manager.stats['starts'] == starts
+    assert blpscheduler.scheduler.in_flight == 0
+
+
+def test_buckets_follow_tokyo_close():
+    for day, counts in (('2016-04-11', [30, 30]), ('2025-03-10', [60])):
+        local = np.arange(np.datetime64(day + 'T14:30'), np.datetime64(day + 'T15:30'),
+                          np.timedelta64(1, 'm')).astype('datetime64[us]')
+        start, key = blpbars.buckets(local, 60, blpcalendar.EXCHANGES['JT'].sessions)
+        assert list(np.unique(key, return_counts=True)[1]) == counts
+
+
+# smaller versions of the bench_suite cases
+CASES = [('ticks', lambda: blpfunctions.get_Ticks_many(bench_suite.NKY[:2], ['TRADE'], START, END),
+          'IntradayTickRequest'),
+         ('bars', lambda: blpfunctions.get_Bars_many(bench_suite.NKY[:20], ['TRADE'], START, END, 1),
+          'IntradayBarRequest'),
+         ('hist', lambda: blpfunctions.get_Hist(bench_suite.NKY[:100], ['PX_LAST', 'PX_VOLUME'],
+                                                '20150101', '20151231'),
+          'HistoricalDataRequest'),
+         ('volcurve', lambda: blpfunctions.bbg_volcurve('NKY Index', ['TRADE'], '2016-04-15T15:00:00', 1, 1, {}),
+          'IntradayBarRequest')]
+
+
+@pytest.mark.parametrize('name,fn,kind', CASES, ids=[case[0] for case in CASES])
+def test_benchmark(benchmark, name, fn, kind):
+    fn()    # start the session and build the calendars outside the timing
+    metrics.reset()
+    benchmark.pedantic(fn, rounds=3, iterations=1)
+    rows = metrics.counters.get(('rows', kind), 0)
+    assert rows
+    benchmark.extra_info['rows'] = rows // 3
@@ -0,0 +1,206 @@
+'''Bars built locally from ticks: time, volume and tick bars with VWAP, TWAP
+and participation, for many securities at once.
+
+The ticks of every security are laid back to back in flat arrays
+(Segments), and each kind of bar comes down to an integer bar number per
+tick.  A new bar starts wherever that number or the security changes, and
+each output column is one reduceat over the flat arrays.  There is no loop
+per security or per bar, so 10M ticks across a whole index take about as
+long as 10M ticks of one name:
+
+    ticks = blpfunctions.get_Ticks_many(secs, ['TRADE', 'BID', 'ASK'], sd, ed, store=True)
+    seg = Segments.from_ticks(ticks, types=['TRADE'])
+    ten_second = time_bars(seg, 10)                 # {security: blpdecode.Columns}
+    by_volume = volume_bars(seg, 50000)             # or one threshold per security
+    by_count = tick_bars(seg, 200)
+
+Rows can be filtered first with seg.select(mask), for instance on size or
+on condition codes held alongside.  Bars are stamped with their start:
+the bucket start for time bars, the first tick otherwise.  Times are UTC;
+frames(bars) gives DataFrames in each security's exchange time.
+'''
+import blpcalendar
+import blplazy
+import blpdecode
+
+np = blplazy.module('numpy')
+
+'''Output column -> dtype, in output order'''
+COLUMNS = [('OPEN', 'float64'),
+           ('HIGH', 'float64'),
+           ('LOW', 'float64'),
+           ('CLOSE', 'float64'),
+           ('numEvents', 'int64'),
+           ('VOLUME', 'int64'),
+           ('VALUE', 'float64'),
+           ('VWAP', 'float64'),
+           ('TWAP', 'float64'),
+           ('PARTICIPATION', 'float64'),
+           ('END', 'datetime64[us]')]
+
+
+class Segments(object):
+    '''Ticks of many securities in flat arrays: keys[i] owns rows
+    offsets[i]:offsets[i + 1], in time order.  time is datetime64[us] UTC,
+    price float64, size int64; type holds each row's event type (strings).'''
+
+    def __init__(self, keys, offsets, time, price, size, type=None):
+        self.keys = list(keys)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.time = np.asarray(time, dtype='datetime64[us]')
+        self.price = np.asarray(price, dtype=np.float64)
+        self.size = np.asarray(size, dtype=np.int64)
+        self.type = type
+
+    @classmethod
+    def from_ticks(cls, ticks, types=None):
+        '''Build from {security: blpticks.TickStore or blpdecode.Columns of
+        TICK_COLUMNS} (UTC times), keeping only the event types in `types`
+        (all when None).'''
+        keys = list(ticks)
+        times, prices, sizes, names = [], [], [], []
+        for key in keys:
+            t, p, s, n = _arrays(ticks[key], types)
+            times.append(t)
+            prices.append(p)
+            sizes.append(s)
+            names.append(n)
+        offsets = np.concatenate([[0], np.cumsum([len(t) for t in times], dtype=np.int64)])
+        if not keys:
+            return cls(keys, offsets, np.empty(0, 'datetime64[us]'), np.empty(0), np.empty(0, np.int64))
+        return cls(keys, offsets, np.concatenate(times), np.concatenate(prices), np.concatenate(sizes),
+                   np.concatenate(names))
+
+    def __len__(self):
+        return len(self.time)
+
+    def owner(self):
+        '''Index into keys of every row.'''
+        return np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+
+    def select(self, mask):
+        '''Segments of the rows where the boolean `mask` is set.'''
+        mask = np.asarray(mask, dtype=bool)
+        counts = np.bincount(self.owner()[mask], minlength=len(self.keys))
+        return Segments(self.keys, np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]),
+                        self.time[mask], self.price[mask], self.size[mask],
+                        None if self.type is None else self.type[mask])
+
+
+def _arrays(ticks, types):
+    # (time us, price, size, type) of one security, filtered to `types`
+    if hasattr(ticks, 'of_type'):
+        parts = [ticks] if types is None else [ticks.of_type(t) for t in types]
+        time = np.concatenate([p.time for p in parts]) // 1000
+        names = np.concatenate([np.asarray(p.types, dtype=object)[p.type] for p in parts])
+        order = np.argsort(time, kind='mergesort')
+        return (time[order].astype('datetime64[us]'), np.concatenate([p.price for p in parts])[order],
+                np.concatenate([p.size for p in parts])[order], names[order])
+    time, price, size, names = ticks.times(), ticks.column('price'), ticks.column('size'), ticks.column('type')
+    if types is not None:
+        keep = np.zeros(len(time), dtype=bool)
+        for t in types:
+            keep |= names == t
+        time, price, size, names = time[keep], price[keep], size[keep], names[keep]
+    return time, price, size, names
+
+
+def _segments(ticks, types):
+    return ticks if isinstance(ticks, Segments) else Segments.from_ticks(ticks, types)
+
+
+def time_bars(ticks, seconds, types=('TRADE',)):
+    '''Bars of `seconds` each (may be fractional), aligned to multiples of
+    `seconds` since the epoch, so also to the local clock when they divide
+    15 minutes.  ticks is Segments or what Segments.from_ticks takes;
+    returns {security: blpdecode.Columns of COLUMNS}.'''
+    seg = _segments(ticks, types)
+    step = int(round(seconds * 1e6))
+    if step <= 0:
+        raise ValueError("Bar length must be positive: %r" % (seconds,))
+    bar = seg.time.astype(np.int64) // step
+    return _reduce(seg, bar, lambda first: (bar[first] * step).astype('datetime64[us]'),
+                   lambda last: ((bar[last] + 1) * step).astype('datetime64[us]'))
+
+
+def volume_bars(ticks, volume, types=('TRADE',)):
+    '''Bars of about `volume` shares each: a bar closes with the tick that
+    takes its volume to `volume` or beyond, and ticks are not split.
+    `volume` is one threshold or one per security.'''
+    seg = _segments(ticks, types)
+    volume = np.broadcast_to(np.asarray(volume, dtype=np.int64), (len(seg.keys),))
+    if (volume <= 0).any():
+        raise ValueError("Bar volume must be positive")
+    owner = seg.owner()
+    # volume traded earlier in the same security
+    before = np.cumsum(seg.size) - seg.size
+    if len(seg):
+        # securities without rows own no rows, so clipping their offset is harmless
+        before -= before[np.minimum(seg.offsets[:-1], len(seg) - 1)][owner]
+    return _reduce(seg, before // volume[owner], lambda first: seg.time[first], owner=owner)
+
+
+def tick_bars(ticks, count, types=('TRADE',)):
+    '''Bars of `count` ticks each (the last bar of a security may be short).'''
+    seg = _segments(ticks, types)
+    if count <= 0:
+        raise ValueError("Bar tick count must be positive: %r" % (count,))
+    owner = seg.owner()
+    return _reduce(seg, (np.arange(len(seg)) - seg.offsets[:-1][owner]) // count,
+                   lambda first: seg.time[first], owner=owner)
+
+
+def _reduce(seg, bar, start, end=None, owner=None):
+    # One bar per run of equal (owner, bar) rows.  start(first) gives bar
+    # times from the first row of each bar; end(last), when given, the bar
+    # end used to weight the last tick of a bar in TWAP.
+    n, k = len(seg), len(seg.keys)
+    if not n:
+        return dict((key, blpdecode.Columns(COLUMNS)) for key in seg.keys)
+    owner = seg.owner() if owner is None else owner
+    new = np.empty(n, dtype=bool)
+    new[0] = True
+    new[1:] = (bar[1:] != bar[:-1]) | (owner[1:] != owner[:-1])
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], n] - 1
+    price, size = seg.price, seg.size
+    t = seg.time.astype(np.int64)
+    arrays = {'OPEN': price[first],
+              'HIGH': np.maximum.reduceat(price, first),
+              'LOW': np.minimum.reduceat(price, first),
+              'CLOSE': price[last],
+              'numEvents': np.diff(np.r_[first, n]),
+              'VOLUME': np.add.reduceat(size, first),
+              'VALUE': np.add.reduceat(price * size, first),
+              'END': seg.time[last]}
+    # each price holds until the next tick of its bar, the last one until
+    # the bar end (time bars) or not at all
+    held = np.empty(n, dtype=np.int64)
+    held[:-1] = t[1:] - t[:-1]
+    held[last] = end(last).astype(np.int64) - t[last] if end is not None else 0
+    weight = np.add.reduceat(held, first)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        arrays['VWAP'] = arrays['VALUE'] / arrays['VOLUME']
+        arrays['TWAP'] = np.where(weight > 0, np.add.reduceat(price * held, first) / weight,
+                                  np.add.reduceat(price, first) / arrays['numEvents'])
+        bar_owner = owner[first]
+        total = np.bincount(bar_owner, weights=arrays['VOLUME'], minlength=k)
+        arrays['PARTICIPATION'] = arrays['VOLUME'] / total[bar_owner]
+    times = start(first)
+    bounds = np.searchsorted(bar_owner, np.arange(k + 1))
+    return dict((key, blpdecode.Columns.from_arrays(COLUMNS, times[bounds[i]:bounds[i + 1]],
+                                                    dict((name, a[bounds[i]:bounds[i + 1]])
+                                                         for name, a in arrays.items())))
+                for i, key in enumerate(seg.keys))
+
+
+def frames(bars):
+    '''{security: DataFrame} of `bars`, with the index and END in the
+    security's exchange time (blpcalendar).'''
+    output = {}
+    for sec, cols in bars.items():
+        exchange = blpcalendar.for_security(sec)
+        frame = cols.frame(exchange=exchange)
+        frame['END'] = exchange.to_local(cols.column('END'))
+        output[sec] = frame
+    return output
@@ -0,0 +1,320 @@
+'''asyncio versions of get_Hist, get_Ticks, get_Bars and get_index.
+
+An AsyncSession owns one asynchronous blpapi session.  Its event handler
+runs on the API's dispatcher thread, decodes each response message straight
+into the request's Columns and, on the final RESPONSE, resolves the asyncio
+future registered under the message's correlation id.  Many requests can
+therefore be awaited together with asyncio.gather on one session, without a
+thread or a blocking nextEvent loop per call:
+
+    async def main():
+        bars, ticks = await asyncio.gather(
+            get_Bars('6758 JT Equity', ['TRADE'], '2016-03-01T09:00:00', '2016-03-01T15:00:00', 1),
+            get_Ticks('7203 JT Equity', ['TRADE'], '2016-03-01T09:00:00', '2016-03-01T10:00:00'))
+    asyncio.run(main())
+
+These calls do not read or fill the disk cache.  Like the blocking ones,
+every request first takes a blpscheduler slot (waiting for it off the event
+loop) and transient responseErrors are retried after a backoff.
+Python 3 only.
+'''
+import asyncio
+import datetime as dt
+import itertools
+import threading
+import weakref
+
+import blpbackend
+import blpapi
+
+import blpcalendar
+import blpdecode
+import blpfunctions
+import blplazy
+import blpscheduler
+from blpfunctions import (SECURITY_DATA, SECURITY, FIELD_DATA, TICK_DATA, BAR_DATA,
+                          BAR_TICK_DATA, RESPONSE_ERROR, HIST_BATCH,
+                          _hist_request, _tick_request, _bar_request, _index_request,
+                          _decode_index, _asof, _utc, _hist_items, _hist_frame, _error_message,
+                          _index_result)
+from blpmetrics import request_type
+from blpsession import MAX_IN_FLIGHT, SessionTerminatedError
+
+SESSION_STARTED = blpapi.Name("SessionStarted")
+SESSION_TERMINATED = blpapi.Name("SessionTerminated")
+SESSION_STARTUP_FAILURE = blpapi.Name("SessionStartupFailure")
+
+# resolves a request whose only answer was a transient responseError
+_RETRY = object()
+
+
+def _resolve(future, result=None, error=None):
+    # runs on the event loop; a caller may have cancelled or timed out meanwhile
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class AsyncSession(object):
+    '''One asynchronous blpapi session shared by every coroutine on a loop.
+
+    request(request, on_message) sends `request` and returns a future that
+    completes once its final response has arrived; `on_message(msg)` is
+    called on the dispatcher thread for every response message.  At most
+    max_in_flight requests are outstanding at once.  on_message does not
+    see a response that is retried.'''
+
+    def __init__(self, options=None, max_in_flight=MAX_IN_FLIGHT):
+        self.options = options if options is not None else blpfunctions.options
+        self.max_in_flight = max_in_flight
+        self.session = None
+        self.loop = None
+        self.services = {}          # name -> future of the opened service
+        self.stats = {'requests': 0, 'messages': 0, 'failures': 0}
+        self._pending = {}          # correlation id value -> [future, on_message, messages seen, request type, attempt]
+        self._lock = threading.Lock()
+        self._cids = itertools.count(1)
+        self._started = None
+        self._slots = None
+
+    async def start(self, timeout=10):
+        self.loop = asyncio.get_running_loop()
+        blplazy.resolve()
+        self._started = self.loop.create_future()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.session = blpapi.Session(self.options, self._handle)
+        self.session.startAsync()
+        try:
+            await asyncio.wait_for(self._started, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Failed to start session.")
+        return self
+
+    def stop(self):
+        if self.session is not None:
+            self.session.stop()
+            self.session = None
+        self.services.clear()
+        self._fail_all(SessionTerminatedError("Session stopped"))
+
+    async def getService(self, name):
+        # openService blocks until the service is open, so keep it off the
+        # loop; concurrent callers share the one open
+        if name not in self.services:
+            self.services[name] = asyncio.ensure_future(self._open(name))
+        try:
+            return await asyncio.shield(self.services[name])
+        except Exception:
+            self.services.pop(name, None)
+            raise
+
+    async def _open(self, name):
+        session = self.session
+        if session is None:
+            raise SessionTerminatedError("Session terminated")
+        if not await self.loop.run_in_executor(None, session.openService, name):
+            raise RuntimeError("Failed to open %s" % name)
+        if session is not self.session:
+            raise SessionTerminatedError("Session terminated")
+        return session.getService(name)
+
+    async def request(self, request, on_message=None, priority=None):
+        scheduler = blpscheduler.scheduler
+        kind = request_type(request)
+        level = blpscheduler.current(kind) if priority is None else priority
+        attempt = 0
+        async with self._slots:
+            while True:
+                if not scheduler.acquire(level, block=False):
+                    waiting = self.loop.run_in_executor(None, scheduler.acquire, level)
+                    try:
+                        await asyncio.shield(waiting)
+                    except asyncio.CancelledError:
+                        # the slot still arrives; hand it straight back
+                        waiting.add_done_callback(lambda _: scheduler.release())
+                        raise
+                cid = blpapi.CorrelationId(next(self._cids))
+                future = self.loop.create_future()
+                with self._lock:
+                    self._pending[cid.value()] = [future, on_message, False, kind, attempt]
+                self.stats['requests'] += 1
+                try:
+                    if self.session is None:
+                        raise SessionTerminatedError("Session terminated")
+                    self.session.sendRequest(request, correlationId=cid)
+                    result = await future
+                finally:
+                    scheduler.release()
+                    with self._lock:
+                        self._pending.pop(cid.value(), None)
+                if result is not _RETRY:
+                    scheduler.succeeded()
+                    return result
+                scheduler.retried(kind)
+                await asyncio.sleep(scheduler.backoff_delay(attempt))
+                attempt += 1
+
+    def _handle(self, event, session):
+        # Runs on the dispatcher thread.
+        evtype = event.eventType()
+        if evtype in (blpapi.Event.PARTIAL_RESPONSE, blpapi.Event.RESPONSE,
+                      blpapi.Event.REQUEST_STATUS):
+            for msg in event:
+                key = msg.correlationIds()[0].value()
+                with self._lock:
+                    entry = self._pending.get(key)
+                if entry is None:
+                    continue
+                future, on_message, seen, kind, attempt = entry
+                if evtype == blpapi.Event.RESPONSE and not seen and attempt < blpscheduler.scheduler.retries:
+                    # nothing but a transient error: request() sends it again
+                    category = blpscheduler.error_category(msg)
+                    if blpscheduler.transient(category):
+                        if category[0] == 'LIMIT':
+                            blpscheduler.scheduler.throttled(kind)
+                        with self._lock:
+                            self._pending.pop(key, None)
+                        self.loop.call_soon_threadsafe(_resolve, future, _RETRY)
+                        continue
+                entry[2] = True
+                error = None
+                if evtype != blpapi.Event.REQUEST_STATUS:
+                    self.stats['messages'] += 1
+                    try:
+                        if on_message is not None:
+                            on_message(msg)
+                    except Exception as e:
+                        error = e
+                elif msg.messageType() == blpapi.Name("RequestFailure"):
+                    self.stats['failures'] += 1
+                if error is not None or evtype != blpapi.Event.PARTIAL_RESPONSE:
+                    with self._lock:
+                        self._pending.pop(key, None)
+                    self.loop.call_soon_threadsafe(_resolve, future, None, error)
+        elif evtype == blpapi.Event.SESSION_STATUS:
+            for msg in event:
+                if msg.messageType() == SESSION_STARTED:
+                    self.loop.call_soon_threadsafe(_resolve, self._started, True)
+                elif msg.messageType() == SESSION_STARTUP_FAILURE:
+                    self._dead()
+                    self.loop.call_soon_threadsafe(_resolve, self._started, None,
+                                                   RuntimeError("Failed to start session."))
+                elif msg.messageType() == SESSION_TERMINATED:
+                    self._dead()
+                    self._fail_all(SessionTerminatedError(str(msg)))
+
+    def _dead(self):
+        # forget a terminated session so that session() starts a new one
+        self.session = None
+        self.services.clear()
+
+    def _fail_all(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for entry in pending.values():
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(_resolve, entry[0], None, error)
+
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+async def session():
+    '''The shared AsyncSession of the running event loop, started on first use.'''
+    loop = asyncio.get_running_loop()
+    current = _sessions.get(loop)
+    if current is None or current.session is None:
+        current = _sessions[loop] = AsyncSession()
+        try:
+            await current.start()
+        except BaseException:
+            _sessions.pop(loop, None)
+            raise
+    elif not current._started.done():
+        # another coroutine is starting it
+        await asyncio.shield(current._started)
+    return current
+
+
+async def get_Hist(sec_list, fld_list, start_date, end_date, long=False):
+    '''Coroutine version of blpfunctions.get_Hist (without the disk cache).'''
+    start = dt.datetime.strptime(start_date, "%Y%m%d")
+    end = dt.datetime.strptime(end_date, "%Y%m%d")
+    fields = [(f, blpapi.Name(f)) for f in fld_list]
+    response = dict((s, blpdecode.Columns([(f, 'float64') for f in fld_list], capacity=256))
+                    for s in sec_list)
+
+    def on_message(msg):
+        if msg.hasElement(RESPONSE_ERROR):
+            return
+        securityData = msg.getElement(SECURITY_DATA)
+        secName = securityData.getElementAsString(SECURITY)
+        if secName in response and securityData.hasElement(FIELD_DATA):
+            blpdecode.decode_hist(securityData.getElement(FIELD_DATA), response[secName], fields)
+
+    bs = await session()
+    refDataService = await bs.getService("//blp/refdata")
+    await asyncio.gather(*[bs.request(_hist_request(refDataService, sec_list[i:i + HIST_BATCH],
+                                                    fld_list, start, end), on_message)
+                           for i in range(0, len(sec_list), HIST_BATCH)])
+
+    items = [(s, f) for s in sec_list for f in fld_list]
+    return _hist_frame(items, _hist_items(items, response), long)
+
+
+async def get_Ticks(s, event_list, sdtime, edtime):
+    '''Coroutine version of blpfunctions.get_Ticks (without the disk cache).'''
+    ticks = blpdecode.Columns(blpdecode.TICK_COLUMNS)
+
+    def on_message(msg):
+        if not msg.hasElement(RESPONSE_ERROR):
+            blpdecode.decode_ticks(msg.getElement(TICK_DATA).getElement(TICK_DATA), ticks)
+
+    bs = await session()
+    refDataService = await bs.getService("//blp/refdata")
+    exchange = blpcalendar.for_security(s)
+    await bs.request(_tick_request(refDataService, s, event_list, _utc(sdtime, exchange), _utc(edtime, exchange)),
+                     on_message)
+    return ticks.frame(exchange=exchange)
+
+
+async def get_Bars(sec, event_list, sdtime, edtime, barinterval, fld_list={}):
+    '''Coroutine version of blpfunctions.get_Bars (without the disk cache).'''
+    bars = blpdecode.Columns(blpdecode.bar_columns(fld_list))
+
+    def on_message(msg):
+        if not msg.hasElement(RESPONSE_ERROR):
+            blpdecode.decode_bars(msg.getElement(BAR_DATA).getElement(BAR_TICK_DATA), bars)
+
+    bs = await session()
+    refDataService = await bs.getService("//blp/refdata")
+    exchange = blpcalendar.for_security(sec)
+    await bs.request(_bar_request(refDataService, sec, event_list, _utc(sdtime, exchange), _utc(edtime, exchange),
+                                  barinterval), on_message)
+    return bars.frame(fld_list, exchange)
+
+
+async def get_index(index, asof=None, use_cache=True, refresh=False):
+    '''Coroutine version of blpfunctions.get_index, sharing its index_cache.'''
+    key = _asof(asof)
+    index_cache = blpfunctions.index_cache
+    if use_cache and index_cache is not None and not refresh:
+        members = index_cache.get(index, key)
+        if members is not None:
+            return members
+    response, error = [[]], [None]
+
+    def on_message(msg):
+        if msg.hasElement(RESPONSE_ERROR):
+            error[0] = _error_message(msg)
+        else:
+            response[0] = _decode_index(msg, response[0])
+
+    bs = await session()
+    refDataService = await bs.getService("//blp/refdata")
+    await bs.request(_index_request(refDataService, index, None if asof is None else key), on_message)
+    return _index_result(index, key, response[0], error[0], use_cache)
+
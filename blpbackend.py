@@ -0,0 +1,74 @@
+'''Choose the blpapi implementation the blp modules talk to.
+
+Every module does `import blpapi`; importing this module first (they all
+do) installs the backend named by the BLP_BACKEND environment variable:
+
+    (unset) / blpapi    the Bloomberg API
+    fake                fakeblpapi's synthetic, deterministic responses
+    replay:<dir>        fakeblpapi answering from files recorded with record:
+    record:<dir>        the Bloomberg API, with every request and response
+                        saved to <dir> (see blprecord)
+
+or call use().  The blp modules bind blpapi through blplazy: imported
+before any backend is installed, they pick up whichever one is installed
+when the first session starts or a Name constant is first read, so use()
+works until then.  A module imported after a backend was installed keeps
+that one.
+'''
+import importlib
+import os
+import sys
+
+ENV = 'BLP_BACKEND'
+
+# kind of the installed backend ('blpapi', 'fake', 'replay' or 'record'); see blpcache.cache_dir
+BACKEND = 'blpapi'
+
+# the module use() last installed as blpapi, and the Bloomberg API itself once seen
+_installed = None
+_blpapi = None
+
+
+def _real():
+    # the Bloomberg API, not whatever backend sys.modules['blpapi'] holds now
+    global _blpapi
+    if _blpapi is None:
+        installed = sys.modules.get('blpapi')
+        if installed is not None and installed is _installed:
+            del sys.modules['blpapi']
+        try:
+            _blpapi = importlib.import_module('blpapi')
+        finally:
+            if installed is not None:
+                sys.modules['blpapi'] = installed
+    return _blpapi
+
+
+def use(spec):
+    '''Install the backend described by `spec` as the `blpapi` module and
+    return it.  'blpapi' and 'record:' always get the Bloomberg API, even
+    after another backend was installed.'''
+    global BACKEND, _installed, _blpapi
+    kind, _, arg = spec.partition(':')
+    previous = sys.modules.get('blpapi')
+    if previous is not None and previous is not _installed and _blpapi is None:
+        _blpapi = previous     # imported before any use()
+    if kind == 'blpapi':
+        backend = _real()
+    elif kind == 'fake':
+        backend = importlib.import_module('fakeblpapi')
+    elif kind == 'replay':
+        backend = importlib.import_module('fakeblpapi')
+        backend.REPLAY = arg
+    elif kind == 'record':
+        import blprecord
+        backend = blprecord.module(_real(), arg)
+    else:
+        raise ValueError("Unknown %s %r" % (ENV, spec))
+    sys.modules['blpapi'] = _installed = backend
+    BACKEND = kind
+    return backend
+
+
+if os.environ.get(ENV):
+    use(os.environ[ENV])
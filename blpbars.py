@@ -0,0 +1,103 @@
+'''Coarser intraday bars derived locally from 1-minute bars.
+
+get_Bars_many fetches and caches only BASE_INTERVAL bars and builds any
+multiple of it here, so asking for 1, 5 and 30 minute bars over the same
+range costs one download.  The day is cut at every session open and
+close, and bars are grouped into buckets of `interval` minutes counted from
+the start of their piece, in the exchange's local time (blpcalendar), so no
+bar spans the Tokyo lunch break:
+
+    Tokyo sessions [(540, 690), (750, 900)]     # 09:00-11:30, 12:30-15:00
+    30 minute bars start at 09:00 ... 11:00, 12:30 ... 14:30
+
+Sessions are taken per day from the exchange's schedule, so days after
+Tokyo's close moved to 15:30 are cut at 15:30 instead.
+
+Bars outside the sessions (pre-open, lunch, after the close) are bucketed
+the same way from the start of their gap.  Each bucket is one reduceat per column
+over the sorted input: OPEN of the first bar, CLOSE of the last, HIGH/LOW
+the max/min, numEvents/VOLUME/VALUE the sums.  A bar is stamped with the
+start of its bucket, like a Bloomberg bar.
+'''
+import blpcalendar
+import blpdecode
+import blplazy
+
+np = blplazy.module('numpy')
+
+'''Interval (minutes) of the bars actually fetched and cached'''
+BASE_INTERVAL = 1
+
+_FIRST = ['OPEN']
+_LAST = ['CLOSE']
+_MAX = ['HIGH']
+_MIN = ['LOW']
+
+
+def buckets(local, interval, sessions=None):
+    '''(bucket start, group key) for datetime64 local bar times: the start of
+    each bar's `interval`-minute bucket, and an increasing integer key equal
+    for bars of the same bucket.  sessions is a list of (open, close) or a
+    blpcalendar.schedule(), resolved per day.'''
+    entries = blpcalendar.schedule(blpcalendar.DEFAULT.sessions if sessions is None else sessions)
+    days = local.astype('datetime64[D]')
+    minute = (local - days).astype('timedelta64[m]').astype(np.int64)
+    firsts = np.array([first for first, _ in entries])
+    entry = np.maximum(np.searchsorted(firsts, days, 'right') - 1, 0)
+    origin = np.empty_like(minute)
+    for n in np.unique(entry):
+        cuts = np.unique([0] + [m for session in entries[n][1] for m in session])
+        rows = entry == n
+        origin[rows] = cuts[np.searchsorted(cuts, minute[rows], 'right') - 1]
+    bucket = origin + (minute - origin) // interval * interval
+
+    return days + bucket.astype('timedelta64[m]'), days.astype(np.int64) * 1440 + bucket
+
+
+def resample(cols, interval, exchange=None):
+    '''Columns of BAR_COLUMNS bars (UTC times, sorted, BASE_INTERVAL apart)
+    -> Columns of `interval`-minute bars, bucketed in the local time and
+    sessions of `exchange` (a blpcalendar.Exchange, DEFAULT when None).'''
+    exchange = blpcalendar.DEFAULT if exchange is None else exchange
+    return _resample(cols, interval, exchange.sessions, exchange)
+
+
+def _resample(cols, interval, sessions, exchange=None):
+    # times are UTC and bucketed in exchange's local time, or already local
+    # when exchange is None
+    if interval % BASE_INTERVAL:
+        raise ValueError("Bar interval %s is not a multiple of %s" % (interval, BASE_INTERVAL))
+    if interval == BASE_INTERVAL or not cols.n:
+        return cols
+    times = cols.times()
+    start, key = buckets(times if exchange is None else exchange.to_local(times), interval, sessions)
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    last = np.r_[first[1:], cols.n] - 1
+    arrays = {}
+    for name in cols.names:
+        column = cols.column(name)
+        if name in _FIRST:
+            arrays[name] = column[first]
+        elif name in _LAST:
+            arrays[name] = column[last]
+        elif name in _MAX:
+            arrays[name] = np.maximum.reduceat(column, first)
+        elif name in _MIN:
+            arrays[name] = np.minimum.reduceat(column, first)
+        else:
+            arrays[name] = np.add.reduceat(column, first)
+    start = start[first]
+    if exchange is not None:
+        start = exchange.to_utc(start)
+    columns = [(name, cols.arrays[name].dtype) for name in cols.names]
+    return blpdecode.Columns.from_arrays(columns, start, arrays)
+
+
+def resample_frame(df, interval, sessions=None):
+    '''resample for a get_Bars DataFrame (local times); returns a DataFrame
+    with the same columns.  sessions default to blpcalendar.DEFAULT's.'''
+    names = list(df.columns)
+    columns = [(name, df[name].dtype) for name in names]
+    cols = blpdecode.Columns.from_arrays(columns, df.index.values,
+                                         dict((name, df[name].values) for name in names))
+    return _resample(cols, interval, sessions).frame(names)
@@ -0,0 +1,411 @@
+'''Persistent on-disk cache for historical, bar and tick data.
+
+Data is keyed by (request type, security, field/event, interval) and stored
+as one directory per partition (a UTC day for intraday data, a year for
+daily history) holding a .npy file per column, so reads can memory-map
+just the partitions they need.  A manifest per key records which time
+ranges have been fetched and the partition unit they were stored in (a key
+stored in another unit counts as empty); gaps() tells the caller what is
+still missing and write() fills it in.  When the cache grows past max_bytes the least recently
+used keys are removed.
+
+Index memberships are small and keyed by (index, as-of date) rather than by
+time range, so IndexCache keeps them separately: in memory, and as one JSON
+file per snapshot under the same root.  MemoCache is a plain in-memory
+store with a time-to-live for results such as reference data fields.
+Coalescer sits in front of all of these: identical calls made at the same
+time share one request, and its result is reused for a few seconds.
+'''
+import json
+import os
+import shutil
+import threading
+import time
+
+import blpbackend
+import blplazy
+from blpdecode import Columns
+from blpmetrics import metrics
+
+np = blplazy.module('numpy')
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.blpcache')
+MAX_BYTES = 2 * 1024 ** 3
+
+# refresh a key's LRU timestamp on read at most this often (seconds)
+TOUCH_INTERVAL = 60
+
+# membership snapshots taken on or before their as-of date expire after this (seconds)
+INDEX_TTL = 24 * 3600
+
+# reference data fields are static enough to reuse for this long (seconds)
+REF_TTL = 24 * 3600
+
+# results of identical calls are shared for this long after they finish (seconds)
+COALESCE_TTL = 5
+
+
+def cache_dir():
+    '''Cache root for the installed backend: CACHE_DIR for the Bloomberg API
+    (recorded or not), a sibling such as ~/.blpcache-fake otherwise, so
+    synthetic or replayed data never reaches runs against the terminal.'''
+    if blpbackend.BACKEND in ('blpapi', 'record'):
+        return CACHE_DIR
+    return '%s-%s' % (CACHE_DIR, blpbackend.BACKEND)
+
+
+def _us(t):
+    '''datetime / datetime64 -> int64 microseconds since the epoch'''
+    return np.datetime64(t, 'us').astype(np.int64)
+
+
+def _escape(part):
+    return ''.join(c if c.isalnum() or c in '-.' else '%%%02X' % ord(c) for c in str(part))
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class DiskCache(object):
+    '''Column partitions under `root`, by default cache_dir() of the backend
+    installed when the cache is first used.'''
+
+    def __init__(self, root=None, max_bytes=MAX_BYTES):
+        self._root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = cache_dir()
+        return self._root
+
+    def _dir(self, key):
+        return os.path.join(self.root, *[_escape(k) for k in key])
+
+    def _load_manifest(self, path):
+        try:
+            with open(os.path.join(path, 'manifest.json')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'coverage': [], 'bytes': 0, 'used': 0}
+
+    def _save_manifest(self, path, manifest):
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    def gaps(self, key, start, end, partition='D'):
+        '''Sub-ranges of [start, end) not yet in the cache, as datetime64[us].'''
+        lo, hi = _us(start), _us(end)
+        with self._lock:
+            manifest = self._load_manifest(self._dir(key))
+        coverage = manifest['coverage'] if _unit(manifest) == partition else []
+        missing = []
+        for cstart, cend in coverage:
+            if cend <= lo or cstart >= hi:
+                continue
+            if cstart > lo:
+                missing.append((lo, cstart))
+            lo = max(lo, cend)
+        if lo < hi:
+            missing.append((lo, hi))
+        return [(np.datetime64(int(a), 'us'), np.datetime64(int(b), 'us')) for a, b in missing]
+
+    def read(self, key, start, end, columns, partition='D'):
+        '''Rows in [start, end) as a blpdecode.Columns built from `columns`.'''
+        lo, hi = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+        path = self._dir(key)
+        times, arrays = [], dict((name, []) for name, _ in columns)
+        with self._lock:
+            manifest = self._load_manifest(path)
+            if _unit(manifest) != partition:
+                return Columns(columns, capacity=1)
+            for part, plo, phi in _partitions(path, lo, hi, partition):
+                if not os.path.isdir(part):
+                    continue
+                t = np.load(os.path.join(part, 'time.npy'), mmap_mode='r')
+                a, b = np.searchsorted(t, [lo, hi])
+                if a == b:
+                    continue
+                times.append(np.array(t[a:b]))
+                for name, _ in columns:
+                    arrays[name].append(np.load(os.path.join(part, name + '.npy'), mmap_mode='r')[a:b])
+            if manifest['coverage'] and time.time() - manifest['used'] > TOUCH_INTERVAL:
+                manifest['used'] = time.time()
+                self._save_manifest(path, manifest)
+        if not times:
+            return Columns(columns, capacity=1)
+        return Columns.from_arrays(columns, np.concatenate(times),
+                                   dict((name, np.concatenate(arrays[name])) for name, _ in columns))
+
+    def write(self, key, start, end, times, arrays, covered=None, partition='D'):
+        '''Store rows for [start, end), replacing whatever was cached there,
+        and mark [start, covered or end) as fetched.'''
+        lo, hi = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+        times = np.asarray(times, dtype='datetime64[us]')
+        keep = (times >= lo) & (times < hi)
+        times = times[keep]
+        arrays = dict((name, np.asarray(a)[keep]) for name, a in arrays.items())
+        path = self._dir(key)
+        with self._lock:
+            manifest = self._load_manifest(path)
+            if manifest['coverage'] and _unit(manifest) != partition:
+                # stored in another layout: start the key afresh
+                shutil.rmtree(path, ignore_errors=True)
+                manifest = {'coverage': [], 'bytes': 0, 'used': 0}
+            manifest['partition'] = partition
+            for part, dlo, dhi in _partitions(path, lo, hi, partition):
+                new = (times >= dlo) & (times < dhi)
+                if os.path.isdir(part):
+                    old_t = np.load(os.path.join(part, 'time.npy'))
+                    old = (old_t < dlo) | (old_t >= dhi)
+                    merged_t = np.concatenate([old_t[old], times[new]])
+                    order = np.argsort(merged_t, kind='mergesort')
+                    merged = {}
+                    for name in arrays:
+                        old_a = np.load(os.path.join(part, name + '.npy'))
+                        merged[name] = np.concatenate([old_a[old], _storable(arrays[name][new])])[order]
+                    merged_t = merged_t[order]
+                elif new.any():
+                    merged_t = times[new]
+                    merged = dict((name, _storable(a[new])) for name, a in arrays.items())
+                else:
+                    continue
+                manifest['bytes'] -= _du(part)
+                if not os.path.isdir(part):
+                    os.makedirs(part)
+                np.save(os.path.join(part, 'time.npy'), merged_t)
+                for name, a in merged.items():
+                    np.save(os.path.join(part, name + '.npy'), a)
+                manifest['bytes'] += _du(part)
+            covered = hi if covered is None else min(hi, np.datetime64(covered, 'us'))
+            if covered > lo:
+                manifest['coverage'] = _merge(manifest['coverage'] + [[int(_us(lo)), int(_us(covered))]])
+            manifest['used'] = time.time()
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._save_manifest(path, manifest)
+
+    def _manifests(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if 'manifest.json' in filenames:
+                dirnames[:] = []
+                yield dirpath, self._load_manifest(dirpath)
+
+    def size(self):
+        return sum(m['bytes'] for _, m in self._manifests())
+
+    def evict(self):
+        '''Remove least recently used keys until the cache fits in max_bytes.'''
+        with self._lock:
+            entries = sorted(self._manifests(), key=lambda e: e[1]['used'])
+            total = sum(m['bytes'] for _, m in entries)
+            for path, manifest in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= manifest['bytes']
+
+    def clear(self, key=None):
+        with self._lock:
+            shutil.rmtree(self.root if key is None else self._dir(key), ignore_errors=True)
+
+
+class IndexCache(object):
+    '''Index members per (index, as-of date 'YYYYMMDD').
+
+    A snapshot fetched after its as-of date is final and never expires; one
+    fetched on the day itself (the current membership) is refetched after
+    `ttl` seconds.'''
+
+    def __init__(self, root=None, ttl=INDEX_TTL):
+        self._root = root
+        self.ttl = ttl
+        self._memo = {}
+        self._lock = threading.RLock()
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = cache_dir()
+        return self._root
+
+    def _path(self, index, asof):
+        return os.path.join(self.root, 'IndexMembers', _escape(index), asof + '.json')
+
+    def _fresh(self, entry, asof):
+        fetched = entry['fetched']
+        if time.strftime('%Y%m%d', time.localtime(fetched)) > asof:
+            return True
+        return time.time() - fetched < self.ttl
+
+    def get(self, index, asof):
+        '''Cached members, or None when missing or expired.'''
+        with self._lock:
+            entry = self._memo.get((index, asof))
+            if entry is None:
+                try:
+                    with open(self._path(index, asof)) as f:
+                        entry = json.load(f)
+                except (IOError, OSError, ValueError):
+                    return None
+                self._memo[(index, asof)] = entry
+            if not self._fresh(entry, asof):
+                return None
+            return list(entry['members'])
+
+    def put(self, index, asof, members):
+        entry = {'members': list(members), 'fetched': time.time()}
+        path = self._path(index, asof)
+        with self._lock:
+            self._memo[(index, asof)] = entry
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                json.dump(entry, f)
+
+    def clear(self, index=None):
+        with self._lock:
+            if index is None:
+                self._memo.clear()
+                shutil.rmtree(os.path.join(self.root, 'IndexMembers'), ignore_errors=True)
+            else:
+                for key in [k for k in self._memo if k[0] == index]:
+                    del self._memo[key]
+                shutil.rmtree(os.path.dirname(self._path(index, '')), ignore_errors=True)
+
+
+class MemoCache(object):
+    '''Values by key, kept in memory for `ttl` seconds.'''
+
+    def __init__(self, ttl=REF_TTL):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._items.get(key)
+        if entry is None or time.time() - entry[0] >= self.ttl:
+            return default
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time(), value)
+
+    def purge(self):
+        '''Drop expired values.'''
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (t, _) in self._items.items() if now - t >= self.ttl]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_MISSING = object()
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    '''Runs one call for any number of identical concurrent callers.
+
+    call(key, fetch) returns fetch().  A caller whose key is being fetched
+    already waits for that fetch (coalesced); one whose key finished less
+    than `ttl` seconds ago gets the same result again (hit); anyone else runs
+    fetch (miss).  Errors reach every waiting caller and are not kept.
+    Counts go to blpmetrics as hits/misses/coalesced, with key[0] as the
+    request type, and to `stats`.'''
+
+    def __init__(self, ttl=COALESCE_TTL):
+        self.results = MemoCache(ttl)
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, key):
+        self.stats[name] += 1
+        metrics.incr(name, key[0])
+
+    def call(self, key, fetch, refresh=False):
+        '''fetch() for `key`; refresh=True neither reuses a result nor joins
+        a fetch in flight, but later callers share its result.'''
+        with self._lock:
+            result = _MISSING if refresh else self.results.get(key, _MISSING)
+            if result is not _MISSING:
+                self._count('hits', key)
+                return result
+            call = None if refresh else self._calls.get(key)
+            owner = call is None
+            if owner:
+                self._count('misses', key)
+                call = self._calls[key] = _Call()
+            else:
+                self._count('coalesced', key)
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fetch()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if call.error is None:
+                    self.results.put(key, call.result)
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+            self.results.purge()
+        return call.result
+
+    def clear(self):
+        self.results.clear()
+
+
+def _unit(manifest):
+    # partition unit of a key's files; manifests from before it was recorded are daily
+    return manifest.get('partition', 'D')
+
+
+def _partitions(path, lo, hi, unit):
+    # (directory, start, end) of every `unit` ('D', 'M', 'Y') partition overlapping [lo, hi)
+    period = lo.astype('datetime64[%s]' % unit)
+    while period.astype('datetime64[us]') < hi:
+        plo = max(lo, period.astype('datetime64[us]'))
+        phi = min(hi, (period + 1).astype('datetime64[us]'))
+        yield os.path.join(path, str(period).replace('-', '')), plo, phi
+        period += 1
+
+
+def _storable(array):
+    # object columns (tick types) are kept as fixed-width unicode so they load without pickle
+    if array.dtype == object:
+        return array.astype('U') if len(array) else np.empty(0, dtype='U1')
+    return array
+
+
+def _du(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
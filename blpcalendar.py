@@ -0,0 +1,228 @@
+'''Exchange time zones, trading sessions and business-day calendars.
+
+Every security maps to an Exchange through the exchange code in its ticker
+("6758 JT Equity" -> JT).  An Exchange converts whole datetime64 arrays
+between UTC and its local time with one searchsorted into a table of its
+zone's UTC offsets.  The table is built once for a range of years and then
+kept, so the conversion is right on both sides of a DST change.  The
+Exchange also keeps one CustomBusinessDay per set of years:
+
+    tokyo = for_security('6758 JT Equity')
+    local = tokyo.to_local(times)                   # UTC datetime64 -> local
+    start = tokyo.to_utc(np.datetime64('2016-04-11T09:00:00'))
+    days = tokyo.days(start_local, end_local)       # business days, holidays left out
+
+A code not in EXCHANGES (an index, say) gets DEFAULT: this machine's zone,
+the Tokyo sessions and the JP holidays, which is how every time was
+converted before.  Only JP holidays are known.  Other exchanges are closed
+on weekends only, unless register() is given a holidays function.
+'''
+import threading
+from collections import OrderedDict
+
+import blplazy
+
+np = blplazy.module('numpy')
+pd = blplazy.module('pandas')
+
+# resolution of the offset tables in minutes; zones change offset on a quarter hour
+STEP = 15
+
+
+def _jp_holidays(years):
+    from holidays_jp import CountryHolidays
+    return [day for year in years for day, name in CountryHolidays.get('JP', year)]
+
+
+def _year(us):
+    # calendar year of int64 microseconds since the epoch
+    return int(np.datetime64(int(us), 'us').astype('datetime64[Y]').astype(np.int64)) + 1970
+
+
+class Exchange(object):
+    '''Time zone, sessions and holidays of one exchange.
+
+    tz is an IANA zone name, or None for this machine's zone.  sessions are
+    (open, close) minutes after local midnight, or for hours that changed
+    a schedule of (first day, sessions) entries (see schedule()), which is
+    what the `sessions` attribute always holds.  holidays(years) lists the
+    weekdays the exchange is closed; None means weekends only.'''
+
+    def __init__(self, code, tz, sessions, holidays=None):
+        self.code = code
+        self.tz = tz
+        self.sessions = schedule(sessions)
+        self.holidays = holidays
+        self._years = None
+        self._transitions = self._offsets = None
+        self._calendars = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Exchange(%r, %r)" % (self.code, self.tz)
+
+    def _zone(self):
+        if self.tz is None:
+            from dateutil.tz import tzlocal
+            return tzlocal()
+        return self.tz
+
+    def offsets(self, lo, hi):
+        '''(transitions, offsets) as int64 microseconds: the zone's offset
+        from UTC is offsets[i] from the UTC instant transitions[i] until the
+        next transition.  The table covers the years from UTC microseconds lo to
+        hi, with a year of margin on each side, and grows when asked for more.'''
+        first, last = _year(lo) - 1, _year(hi) + 1
+        with self._lock:
+            if self._years is None or first < self._years[0] or last > self._years[1]:
+                if self._years is not None:
+                    first, last = min(first, self._years[0]), max(last, self._years[1])
+                grid = pd.date_range('%d-01-01' % first, '%d-01-01' % (last + 1), freq='%dmin' % STEP, tz='UTC')
+                utc = grid.tz_localize(None).values.astype('datetime64[us]')
+                local = grid.tz_convert(self._zone()).tz_localize(None).values.astype('datetime64[us]')
+                offsets = (local - utc).astype(np.int64)
+                change = np.r_[True, offsets[1:] != offsets[:-1]]
+                self._transitions, self._offsets = utc.astype(np.int64)[change], offsets[change]
+                self._years = (first, last)
+            return self._transitions, self._offsets
+
+    def _offset(self, us):
+        # offset in force at each of the int64 UTC microseconds `us`
+        transitions, offsets = self.offsets(us.min(), us.max())
+        return offsets[np.searchsorted(transitions, us, 'right') - 1]
+
+    def to_local(self, utc):
+        '''Naive local times of UTC datetime64 times (an array or a scalar).'''
+        utc = np.asarray(utc, dtype='datetime64[us]')
+        if not utc.size:
+            return utc
+        return utc + self._offset(utc.astype(np.int64)).astype('timedelta64[us]')
+
+    def to_utc(self, local):
+        '''UTC times of naive local datetime64 times.  A time repeated when
+        clocks go back is read in the earlier offset, and a time skipped
+        when they go forward is moved back by the gap.'''
+        local = np.asarray(local, dtype='datetime64[us]')
+        if not local.size:
+            return local
+        us = local.astype(np.int64)
+        guess = us - self._offset(us)
+        return (us - self._offset(guess)).astype('datetime64[us]')
+
+    def calendar(self, years):
+        '''CustomBusinessDay over the holidays of `years`, built once per set of years.'''
+        years = tuple(sorted(set(years)))
+        if years not in self._calendars:
+            from pandas.tseries.offsets import CustomBusinessDay
+            holidays = self.holidays(years) if self.holidays is not None else []
+            self._calendars[years] = CustomBusinessDay(holidays=holidays)
+        return self._calendars[years]
+
+    def days(self, lo, hi, calendar=None):
+        '''Local midnights (datetime64[us]) of the business days from local
+        time lo to hi; `calendar` replaces the exchange's own.'''
+        lo, hi = pd.Timestamp(lo), pd.Timestamp(hi)
+        if calendar is None:
+            calendar = self.calendar(range(lo.year, hi.year + 1))
+        return pd.date_range(lo.normalize(), hi, freq=calendar).values.astype('datetime64[us]')
+
+    def windows(self, start, end, calendar=None):
+        '''Split UTC [start, end) into one (start, end) range per local
+        business day, in order; closed days are left out.'''
+        start, end = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+        lo, hi = self.to_local(np.array([start, end]))
+        days = self.days(lo, hi, calendar)
+        bounds = self.to_utc(np.concatenate([days, days + np.timedelta64(1, 'D')]))
+        wlo, whi = np.maximum(bounds[:len(days)], start), np.minimum(bounds[len(days):], end)
+        return [(a, b) for a, b in zip(wlo, whi) if a < b]
+
+
+def schedule(sessions):
+    '''[(first day as datetime64[D], [(open, close), ...])], earliest first,
+    of a schedule of ('YYYY-MM-DD', sessions) entries, or of one list of
+    (open, close) sessions kept for every day.  The first entry also holds
+    for the days before it.'''
+    sessions = list(sessions)
+    if sessions and not isinstance(sessions[0][1], (list, tuple)):
+        sessions = [('1970-01-01', sessions)]
+    return sorted((np.datetime64(first, 'D'), list(table)) for first, table in sessions)
+
+
+def sessions_on(sessions, day):
+    '''The (open, close) sessions in force on `day` (a date or datetime64),
+    from a schedule or a single list of sessions.'''
+    entries = schedule(sessions)
+    firsts = np.array([first for first, _ in entries])
+    return entries[max(0, np.searchsorted(firsts, np.datetime64(day, 'D'), 'right') - 1)][1]
+
+
+'''Exchanges by Bloomberg exchange code'''
+EXCHANGES = {}
+
+
+def register(codes, tz, sessions, holidays=None):
+    '''Add an Exchange under every code in `codes`, replacing any there; returns it.'''
+    exchange = Exchange(codes[0], tz, sessions, holidays)
+    for code in codes:
+        EXCHANGES[code] = exchange
+    return exchange
+
+
+def _hours(*sessions):
+    # ('09:00', '11:30'), ... -> [(540, 690), ...]
+    minutes = lambda hhmm: int(hhmm[:2]) * 60 + int(hhmm[3:])
+    return [(minutes(start), minutes(end)) for start, end in sessions]
+
+
+# Tokyo closed at 15:00 until the extension to 15:30 on 2024-11-05
+TOKYO = [('1970-01-01', _hours(('09:00', '11:30'), ('12:30', '15:00'))),
+         ('2024-11-05', _hours(('09:00', '11:30'), ('12:30', '15:30')))]
+
+
+register(['JT', 'JP'], 'Asia/Tokyo', TOKYO, _jp_holidays)
+register(['US', 'UN', 'UW', 'UQ', 'UA', 'UP'], 'America/New_York', _hours(('09:30', '16:00')))
+register(['CT', 'CN'], 'America/Toronto', _hours(('09:30', '16:00')))
+register(['LN'], 'Europe/London', _hours(('08:00', '16:30')))
+register(['GY', 'GR'], 'Europe/Berlin', _hours(('09:00', '17:30')))
+register(['FP'], 'Europe/Paris', _hours(('09:00', '17:30')))
+register(['HK'], 'Asia/Hong_Kong', _hours(('09:30', '12:00'), ('13:00', '16:00')))
+register(['KS'], 'Asia/Seoul', _hours(('09:00', '15:30')))
+register(['SP'], 'Asia/Singapore', _hours(('09:00', '12:00'), ('13:00', '17:00')))
+register(['AU', 'AT'], 'Australia/Sydney', _hours(('10:00', '16:00')))
+
+'''Exchange of securities whose code is not in EXCHANGES'''
+DEFAULT = Exchange(None, None, TOKYO, _jp_holidays)
+
+
+def for_security(sec):
+    '''Exchange of a Bloomberg ticker ("6758 JT Equity"), DEFAULT when its
+    exchange code is not in EXCHANGES.'''
+    parts = sec.split()
+    if len(parts) > 1 and parts[1] in EXCHANGES:
+        return EXCHANGES[parts[1]]
+    return DEFAULT
+
+
+def group(secs):
+    '''[(Exchange, [securities])] in order of first appearance.'''
+    groups = OrderedDict()
+    for s in secs:
+        groups.setdefault(for_security(s), []).append(s)
+    return list(groups.items())
+
+
+def localize(times, secs, counts):
+    '''Local times of UTC `times` holding the rows of every security in
+    `secs` back to back, counts[i] rows for secs[i]: one to_local per
+    exchange rather than one per security.'''
+    times = np.asarray(times, dtype='datetime64[us]')
+    exchanges = [for_security(s) for s in secs]
+    distinct = list(OrderedDict.fromkeys(exchanges))
+    if len(distinct) < 2:
+        return distinct[0].to_local(times) if distinct else times
+    owner = np.repeat(np.array([distinct.index(e) for e in exchanges], dtype=np.intp), counts)
+    local = np.empty_like(times)
+    for n, exchange in enumerate(distinct):
+        rows = owner == n
+        local[rows] = exchange.to_local(times[rows])
+    return local
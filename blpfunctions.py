@@ -1,333 +1,770 @@
-import blpapi
-import pandas as pd
+import blpbackend
+import blplazy
 import datetime as dt
-from pandas.tseries.offsets import *
-from holidays_jp import CountryHolidays
+from collections import OrderedDict
+from blpsession import SessionManager, MAX_IN_FLIGHT, default_options
+import blpdecode
+import blpvolcurve
+import blpticks
+import blpaggregate
+import blpbars
+import blpcalendar
+import blppanel
+import blpscheduler
+from blpcache import DiskCache, IndexCache, MemoCache, Coalescer
+from blpmetrics import metrics, clock
+
+# blpapi, numpy and pandas are imported on first use, not with this module
+blpapi = blplazy.module('blpapi')
+np = blplazy.module('numpy')
+pd = blplazy.module('pandas')
 
 '''Session Options + Globals'''
-options = blpapi.SessionOptions()
-options.setServerHost('localhost')
-options.setServerPort(8194)
-
-TIME = blpapi.Name("time")
+# `options` (localhost:8194) is blpsession.default_options(), built on first
+# use; see __getattr__ below
+
+# Sessions are started on first use and shared by every get_* call
+session_manager = SessionManager()
+
+# Every request waits for a slot of blpscheduler.scheduler (priority classes,
+# rate limit, concurrency cap, retries of transient errors); configure it
+# with blpscheduler.scheduler.configure(rate=..., max_concurrent=...)
+
+# get_Hist/get_Ticks/get_Bars serve repeated ranges from here; set to None to disable
+disk_cache = DiskCache()
+
+# get_index memoizes memberships per (index, as-of date) here; set to None to disable
+index_cache = IndexCache()
+
+# get_Ref memoizes every (security, field, overrides) value here for ref_cache.ttl seconds
+ref_cache = MemoCache()
+
+# identical get_Hist/get_Ticks/get_Bars calls running at the same time share one
+# request, and their result is reused for coalescer.results.ttl seconds;
+# set to None to disable
+coalescer = Coalescer()
+
+# blpapi.Name constants, created when the first session starts
+_names = blplazy.Names(globals(),
+    TIME="time",
+
+    # Historical Data
+    SECURITY_DATA="securityData",
+    DATE="date",
+    SECURITY="security",
+    FIELD_DATA="fieldData",
+    START_DT="startDate",
+    END_DT="endDate",
+    PERIODICITY="periodicitySelection",
+    SECURITY_DES="Security Description",
+
+    # Intraday Tick Data
+    TICK_DATA="tickData",
+    COND_CODE="conditionCodes",
+    TICK_SIZE="size",
+    TYPE="type",
+    VALUE="value",
+    RESPONSE_ERROR="responseError",
+    CATEGORY="category",
+    MESSAGE="message",
+
+    # Index Membership
+    INDEX_MEMBER="Index Member",
+    INDX_MWEIGHT_HIST="INDX_MWEIGHT_HIST",
+    SESSION_TERMINATED="SessionTerminated",
+
+    # Intraday Bars Data
+    BAR_DATA="barData",
+    BAR_TICK_DATA="barTickData",
+    OPEN="open",
+    HIGH="high",
+    LOW="low",
+    CLOSE="close",
+    VOLUME="volume",
+    NUM_EVENTS="numEvents",
+
+    # Chain
+    FIELD_ID="fieldId")
+
+def __getattr__(name):
+    # blpfunctions.options and the Name constants above, created on first use
+    if name == 'options':
+        return default_options()
+    return _names.getattr(name)
 
 '''Historical Data Globals'''
-SECURITY_DATA = blpapi.Name("securityData")
-DATE = blpapi.Name("date")
-SECURITY = blpapi.Name("security")
-FIELD_DATA = blpapi.Name("fieldData")
-START_DT = blpapi.Name("startDate")
-END_DT = blpapi.Name("endDate")
-PERIODICITY = blpapi.Name("periodicitySelection")
-SECURITY_DES = blpapi.Name("Security Description")
-
-'''Intraday Tick Data Globals'''
-TICK_DATA = blpapi.Name("tickData")
-COND_CODE = blpapi.Name("conditionCodes")
-TICK_SIZE = blpapi.Name("size")
-TYPE = blpapi.Name("type")
-VALUE = blpapi.Name("value")
-RESPONSE_ERROR = blpapi.Name("responseError")
-CATEGORY = blpapi.Name("category")
-MESSAGE = blpapi.Name("message")
-SESSION_TERMINATED = blpapi.Name("SessionTerminated")
-
-'''Intraday Bars Data Globals'''
-BAR_DATA = blpapi.Name("barData")
-BAR_TICK_DATA = blpapi.Name("barTickData")
-OPEN = blpapi.Name("open")
-HIGH = blpapi.Name("high")
-LOW = blpapi.Name("low")
-CLOSE = blpapi.Name("close")
-VOLUME = blpapi.Name("volume")
-VALUE = blpapi.Name("value")
-NUM_EVENTS = blpapi.Name("numEvents")
-
-'''Chain Globals'''
-FIELD_ID = blpapi.Name("fieldId")
-
-UTC_OFFSET = dt.datetime.utcnow() - dt.datetime.now()
-
-def get_Hist (sec_list, fld_list, start_date, end_date):
-    global options
-    session = blpapi.Session(options)
-    session.start()
-    session.openService('//blp/refdata')
-    refDataService = session.getService("//blp/refdata")
-    request = refDataService.createRequest("HistoricalDataRequest")
+HIST_COLUMNS = [('value', 'float64')]
+HIST_BATCH = 100   # securities per HistoricalDataRequest
+
+'''Reference Data Globals'''
+REF_CELLS = 2000   # securities x fields per ReferenceDataRequest
+
+'''Intraday Request Planning Globals'''
+# get_Ticks/get_Bars send one sub-request per exchange session day, all
+# pipelined on one session; set to False to send each range as one request
+SPLIT_SESSIONS = True
+# a CustomBusinessDay used for every exchange; None means each exchange's
+# own cached calendar (blpcalendar)
+SESSION_CALENDAR = None
+# get_Bars fetches and caches only blpbars.BASE_INTERVAL bars and builds
+# coarser ones locally, aligned to each exchange's sessions (blpcalendar);
+# set to False to request every interval from Bloomberg
+RESAMPLE_BARS = True
+# ticks this recent may still arrive late or be corrected, so fetched
+# intraday data is only marked as cached up to this long before now (and
+# bars only up to the start of the bar still forming, before that)
+SETTLE = dt.timedelta(minutes=1)
+
+def _cached(secs, key, columns, start, end, fetch, use_cache, refresh, covered=None, partition='D'):
+    '''{security: Columns} for [start, end), serving what disk_cache already
+    holds and calling fetch(secs, gap_start, gap_end, answered) only for the
+    gaps.  fetch fills answered with {security: [(start, end), ...]}, the
+    ranges its requests got a response for; only those are written, so a
+    range whose request failed (throttled, out of capacity) stays a gap.'''
+    if not use_cache or disk_cache is None:
+        return fetch(secs, start, end)
+    plan = {}
+    for s in secs:
+        gaps = [(start, end)] if refresh else disk_cache.gaps(key(s), start, end, partition)
+        for gap in gaps:
+            plan.setdefault(gap, []).append(s)
+    for (gstart, gend), gsecs in sorted(plan.items()):
+        answered = {}
+        fetched = fetch(gsecs, gstart, gend, answered)
+        for s in gsecs:
+            cols = fetched[s]
+            arrays = dict((n, cols.column(n)) for n in cols.names)
+            for alo, ahi in answered.get(s, ()):
+                disk_cache.write(key(s), alo, ahi, cols.times(), arrays, covered, partition)
+    if plan:
+        disk_cache.evict()
+    return dict((s, disk_cache.read(key(s), start, end, columns, partition)) for s in secs)
+
+def _answered(start, end, failed):
+    # [start, end) less the failed (start, end) windows (in order), as ranges
+    ranges, lo = [], start
+    for wlo, whi in failed:
+        if lo < wlo:
+            ranges.append((lo, wlo))
+        lo = whi
+    if lo < end:
+        ranges.append((lo, end))
+    return ranges
+
+def _settled(barinterval=0):
+    # UTC time before which fetched ticks, or bars of barinterval minutes, are final
+    return dt.datetime.utcnow() - SETTLE - dt.timedelta(minutes=barinterval)
+
+def _coalesced(key, fetch, refresh):
+    # fetch() through the coalescer; callers share the Columns it returns
+    if coalescer is None:
+        return fetch()
+    return coalescer.call(key, fetch, refresh)
+
+def _timed_decode(kind, decode, data, cols, *args):
+    # decode into `cols`, recording decode time and rows/elements/bytes added
+    n, start = cols.n, clock()
+    decode(data, cols, *args)
+    rows = cols.n - n
+    metrics.decoded(kind, clock() - start, rows, rows * len(cols.names), rows * cols.row_bytes())
+
+def _hist_request(service, sec_list, fld_list, start, end):
+    request = service.createRequest("HistoricalDataRequest")
     for s in sec_list:
         request.append("securities",s)
     for f in fld_list:
         request.append("fields",f)
-    request.set("startDate", start_date)
-    request.set("endDate", end_date)
+    request.set("startDate", start.strftime("%Y%m%d"))
+    request.set("endDate", end.strftime("%Y%m%d"))
     request.set("periodicitySelection", "DAILY");
-    session.sendRequest(request)
-    try:
-        response = {}
-        # Process received events
-        while(True):
-            # We provide timeout to give the chance to Ctrl+C handling:
-            ev = session.nextEvent(500)
-            for msg in ev:
-                if ev.eventType() == blpapi.Event.RESPONSE or ev.eventType() == blpapi.Event.PARTIAL_RESPONSE:                    
-                    securityData = msg.getElement(SECURITY_DATA)
-                    secName = securityData.getElementAsString(SECURITY)
-                    
-                    fieldDataArray = securityData.getElement(FIELD_DATA)
-                    response[secName] = {}
-                    for num in range(fieldDataArray.numValues()):
-                        tradedate = fieldDataArray.getValue(num).getElement(DATE).getValue()
-                        close_px = fieldDataArray.getValue(num).getElement("PX_LAST").getValue()
-                        response[secName][tradedate] = close_px
-                                      
-            # Response completely received, so we could exit
-            
-            if ev.eventType() == blpapi.Event.RESPONSE:
-                break
-    finally:
-        # Stop the session
-        session.stop()
-        
+    return request
+
+def _fetch_hist(items, gstart, gend, max_in_flight, answered=None):
+    # items are (security, field) pairs; every field is fetched for every
+    # security, in sub-requests of HIST_BATCH securities sent concurrently.
+    # answered (see _cached) gets [(gstart, gend)] for the items of every
+    # sub-request that did not fail.
+    sec_list = list(OrderedDict.fromkeys(s for s, f in items))
+    fld_list = list(OrderedDict.fromkeys(f for s, f in items))
+    start = pd.Timestamp(gstart).to_pydatetime()
+    end = pd.Timestamp(gend).to_pydatetime() - dt.timedelta(days=1)
+    fields = [(f, blpapi.Name(f)) for f in fld_list]
+    response = dict((s, blpdecode.Columns([(f, 'float64') for f in fld_list], capacity=256))
+                    for s in sec_list)
+    ok = set()
+    with session_manager.borrow() as session:
+        refDataService = session.getService("//blp/refdata")
+        requests = [(i, _hist_request(refDataService, sec_list[i:i + HIST_BATCH], fld_list, start, end))
+                    for i in range(0, len(sec_list), HIST_BATCH)]
+        for key, msg, done in session.pipeline(requests, max_in_flight):
+            if msg.hasElement(RESPONSE_ERROR):
+                continue
+            if done:
+                ok.update(sec_list[key:key + HIST_BATCH])
+            securityData = msg.getElement(SECURITY_DATA)
+            secName = securityData.getElementAsString(SECURITY)
+            if secName not in response or not securityData.hasElement(FIELD_DATA):
+                continue
+            _timed_decode("HistoricalDataRequest", blpdecode.decode_hist,
+                          securityData.getElement(FIELD_DATA), response[secName], fields)
+    if answered is not None:
+        answered.update((item, [(gstart, gend)]) for item in items if item[0] in ok)
+    return _hist_items(items, response)
+
+def _hist_items(items, response):
+    # {(security, field): Columns of HIST_COLUMNS} from {security: Columns, one column per field}
+    output = {}
+    for s, f in items:
+        cols = response[s]
+        output[(s, f)] = blpdecode.Columns.from_arrays(HIST_COLUMNS, cols.times(), {'value': cols.column(f)})
+    return output
+
+def get_Hist (sec_list, fld_list, start_date, end_date, use_cache=True, refresh=False, long=False,
+              max_in_flight=MAX_IN_FLIGHT):
+    '''Daily history for every (security, field).  Returns a frame indexed by
+    date with (security, field) MultiIndex columns, or with long=True a
+    long-format frame of date/security/field/value rows.  Security lists
+    longer than HIST_BATCH are split into concurrent sub-requests.'''
+    items = [(s, f) for s in sec_list for f in fld_list]
+    response = _hist_columns(items, start_date, end_date, use_cache, refresh, max_in_flight)
+    with metrics.timer('frame', "HistoricalDataRequest"):
+        return _hist_frame(items, response, long)
+
+def _hist_columns(items, start_date, end_date, use_cache, refresh, max_in_flight):
+    # {(security, field): Columns} of get_Hist, before any DataFrame is built
+    start = dt.datetime.strptime(start_date, "%Y%m%d")
+    end = dt.datetime.strptime(end_date, "%Y%m%d") + dt.timedelta(days=1)
+    # today's close is not final yet, so only earlier days count as cached
+    today = dt.datetime.combine(dt.date.today(), dt.time())
+    key = lambda item: ('HistoricalDataRequest', item[0], item[1], 'DAILY')
+    fetch = lambda items, gstart, gend, answered=None: _fetch_hist(items, gstart, gend, max_in_flight, answered)
+    return _coalesced(('HistoricalDataRequest', tuple(items), start, end),
+                      lambda: _cached(items, key, HIST_COLUMNS, start, end, fetch, use_cache, refresh, today, 'Y'),
+                      refresh)
+
+def _hist_frame(items, response, long):
+    if long:
+        sizes = [response[item].n for item in items]
+        return pd.DataFrame({'date': np.concatenate([response[item].times() for item in items]),
+                             'security': np.repeat([s for s, f in items], sizes),
+                             'field': np.repeat([f for s, f in items], sizes),
+                             'value': np.concatenate([response[item].column('value') for item in items])},
+                            columns=['date', 'security', 'field', 'value'])
+
     tempdict = {}
-    for r in response:
-        tempdict[r] = pd.Series(response[r])
+    for item in items:
+        cols = response[item]
+        tempdict[item] = pd.Series(cols.column('value'), index=pd.DatetimeIndex(cols.times()))
         
-    data = pd.DataFrame(tempdict)
+    data = pd.DataFrame(tempdict, columns=pd.MultiIndex.from_tuples(items, names=['security', 'field']))
     return data
     
 
-def get_Ticks(s, event_list, sdtime, edtime):
-    global options 
-    session = blpapi.Session(options)
-    session.start()
-    session.openService('//blp/refdata')
-    refDataService = session.getService("//blp/refdata")
-    request = refDataService.createRequest("IntradayTickRequest")
-    
-    #for s in sec_list:
+def _utc(dtime, exchange):
+    # Local 'YYYY-MM-DDTHH:MM:SS' (or datetime) of the exchange -> UTC datetime64
+    return exchange.to_utc(np.datetime64(dtime, 'us'))
+
+def _by_exchange(secs, sdtime, edtime, fetch):
+    '''{security: ...} merged from fetch(group, start, end, exchange) for the
+    securities of each exchange, with the local sdtime-edtime range
+    converted to UTC in that exchange's zone.'''
+    output = {}
+    for exchange, group in blpcalendar.group(secs):
+        output.update(fetch(group, _utc(sdtime, exchange), _utc(edtime, exchange), exchange))
+    return output
+
+def _tick_request(service, s, event_list, startDateTime, endDateTime):
+    request = service.createRequest("IntradayTickRequest")
     request.set("security", s)
     for ev in event_list:
         request.append("eventTypes",ev)  
-    
-    # Convert DateTimeString to UTC datetime object
-    fmt = "%Y-%m-%d" + 'T' + "%H:%M:%S"  #Assumes no milliseconds
-    startDateTime = dt.datetime.strptime(sdtime, fmt) + UTC_OFFSET
-    endDateTime = dt.datetime.strptime(edtime, fmt) + UTC_OFFSET
-        
-    request.set("startDateTime", startDateTime)
-    request.set("endDateTime", endDateTime)
+    request.set("startDateTime", pd.Timestamp(startDateTime).to_pydatetime())
+    request.set("endDateTime", pd.Timestamp(endDateTime).to_pydatetime())
+    return request
 
-    #print "Sending Request:", request
-    session.sendRequest(request)
-    
-    try:
-        # Process received events
-        while(True):
-            # We provide timeout to give the chance to Ctrl+C handling:
-            ev = session.nextEvent(500)
-            indexlist = []
-            typelist = []
-            pricelist = []
-            sizelist = []             
-            for msg in ev:
-                if ev.eventType() == blpapi.Event.RESPONSE or ev.eventType() == blpapi.Event.PARTIAL_RESPONSE:                    
-                   
-                    data = msg.getElement(TICK_DATA).getElement(TICK_DATA)
-                    secName = s
-                    for item in data.values():
-                        time = item.getElementAsDatetime(TIME)
-                        time = time - UTC_OFFSET
-                        timeString = item.getElementAsString(TIME)
-                        type = item.getElementAsString(TYPE)
-                        value = item.getElementAsFloat(VALUE)
-                        size = item.getElementAsInteger(TICK_SIZE)
-                        
-                        indexlist.append(timeString)
-                        typelist.append(type)
-                        pricelist.append(value)
-                        sizelist.append(size)
-                        
-            # Response completely received, so we could exit
-            
-            if ev.eventType() == blpapi.Event.RESPONSE:
-                break
-    finally:
-        # Stop the session
-        session.stop()
-    
-    output = pd.DataFrame({'size': sizelist,
-                               'price': pricelist,
-                               'type': typelist, }, index=indexlist)
-    #output = pd.DataFrame({s[:4]: pricelist}, index=indexlist)
-    
-    return output
-    
-def get_Bars(sec, event_list, sdtime, edtime, barinterval, fld_list={}):
-    global options  
-    session = blpapi.Session(options)
-    session.start()
-    session.openService('//blp/refdata')
-    refDataService = session.getService("//blp/refdata")
-    request = refDataService.createRequest("IntradayBarRequest")  
+def _bar_request(service, sec, event_list, startDateTime, endDateTime, barinterval):
+    request = service.createRequest("IntradayBarRequest")  
     request.set("security", sec)       
-    
     for e in event_list:
         request.set("eventType", e)  
-    
-    # Convert DateTimeString to UTC datetime object
-    fmt = "%Y-%m-%d" + 'T' + "%H:%M:%S"  #Assumes no milliseconds
-    startDateTime = dt.datetime.strptime(sdtime, fmt) + UTC_OFFSET
-    endDateTime = dt.datetime.strptime(edtime, fmt) + UTC_OFFSET
-        
-    request.set("startDateTime", startDateTime)
-    request.set("endDateTime", endDateTime)
+    request.set("startDateTime", pd.Timestamp(startDateTime).to_pydatetime())
+    request.set("endDateTime", pd.Timestamp(endDateTime).to_pydatetime())
     request.set("interval", barinterval) 
+    return request
+
+def _session_windows(start, end, exchange):
+    '''Split the UTC range [start, end) into one sub-range per local
+    business day of the exchange (or SESSION_CALENDAR), in order.  Days the
+    exchange is closed are left out.'''
+    if not SPLIT_SESSIONS:
+        return [(start, end)]
+    return exchange.windows(start, end, SESSION_CALENDAR)
+
+def _fetch_split(kind, secs, build, decode, columns, data, start, end, max_in_flight, exchange, answered=None):
+    # One request per (security, session day), up to max_in_flight at once;
+    # each security's days are stitched back in order, rows on a boundary
+    # kept only in the later day.  Every security trades on `exchange`.
+    # answered (see _cached) gets [start, end) less the days whose request failed.
+    windows = _session_windows(start, end, exchange)
+    parts = {}
+    ok = set()
+    with session_manager.borrow() as session:
+        refDataService = session.getService("//blp/refdata")
+        requests = [((s, n), build(refDataService, s, wlo, whi))
+                    for s in secs for n, (wlo, whi) in enumerate(windows)]
+        for key, msg, done in session.pipeline(requests, max_in_flight):
+            if msg.hasElement(RESPONSE_ERROR):
+                continue
+            if done:
+                ok.add(key)
+            if key not in parts:
+                parts[key] = blpdecode.Columns(columns)
+            _timed_decode(kind, decode, data(msg), parts[key])
+    output = {}
+    for s in secs:
+        if answered is not None:
+            answered[s] = _answered(start, end, [w for n, w in enumerate(windows) if (s, n) not in ok])
+        times, arrays = [], dict((name, []) for name, _ in columns)
+        for n, (wlo, whi) in enumerate(windows):
+            cols = parts.get((s, n))
+            if cols is None:
+                continue
+            t = cols.times()
+            keep = np.ones(len(t), dtype=bool)
+            if n:
+                keep &= t >= wlo
+            if n < len(windows) - 1:
+                keep &= t < whi
+            times.append(t[keep])
+            for name, _ in columns:
+                arrays[name].append(cols.column(name)[keep])
+        if times:
+            output[s] = blpdecode.Columns.from_arrays(columns, np.concatenate(times),
+                                                      dict((name, np.concatenate(a)) for name, a in arrays.items()))
+        else:
+            output[s] = blpdecode.Columns(columns)
+    return output
 
-    #print "Sending Request:", request
-    session.sendRequest(request)    
-    
-    try:
-        # Process received events
-        while(True):
-            # We provide timeout to give the chance to Ctrl+C handling:
-            ev = session.nextEvent(500)
-            indexlist = []
-            openlist = []
-            highlist = []
-            lowlist = []
-            closelist = []
-            numEventslist = []
-            volumelist = []
-            valuelist = []           
+def _tick_data(msg):
+    return msg.getElement(TICK_DATA).getElement(TICK_DATA)
+
+def _bar_data(msg):
+    return msg.getElement(BAR_DATA).getElement(BAR_TICK_DATA)
+
+def _fetch_ticks(secs, event_list, start, end, max_in_flight, exchange, answered=None):
+    build = lambda service, s, wlo, whi: _tick_request(service, s, event_list, wlo, whi)
+    return _fetch_split("IntradayTickRequest", secs, build, blpdecode.decode_ticks, blpdecode.TICK_COLUMNS,
+                        _tick_data, start, end, max_in_flight, exchange, answered)
+
+def get_Ticks_many(secs, event_list, sdtime, edtime, max_in_flight=MAX_IN_FLIGHT,
+                   use_cache=True, refresh=False, store=False, panel=False):
+    '''get_Ticks for many securities on one session.  sdtime and edtime are
+    in each security's exchange time (blpcalendar), as are the returned
+    times.  Every security's range is split into one request per session
+    day, and up to max_in_flight requests are outstanding at once; returns
+    {security: DataFrame}, with store=True {security: blpticks.TickStore}
+    or with panel=True a blppanel.Panel (UTC times for both).'''
+    columns = blpticks.CACHE_COLUMNS if store else blpdecode.TICK_COLUMNS
+    ticks = _tick_columns(secs, event_list, sdtime, edtime, max_in_flight, use_cache, refresh, columns)
+    with metrics.timer('frame', "IntradayTickRequest"):
+        if panel:
+            return blppanel.Panel.from_columns(ticks, OrderedDict.fromkeys(secs))
+        if store:
+            return dict((s, blpticks.TickStore.from_columns(ticks[s])) for s in secs)
+        return dict((s, ticks[s].frame(exchange=blpcalendar.for_security(s))) for s in secs)
+
+def _tick_columns(secs, event_list, sdtime, edtime, max_in_flight, use_cache, refresh,
+                  columns=blpdecode.TICK_COLUMNS):
+    # {security: Columns} (UTC times) of get_Ticks_many
+    key = lambda s: ('IntradayTickRequest', s, ','.join(event_list), 0)
+    def cached(group, start, end, exchange):
+        fetch = lambda secs, gstart, gend, answered=None: _fetch_ticks(secs, event_list, gstart, gend,
+                                                                       max_in_flight, exchange, answered)
+        return _cached(group, key, columns, start, end, fetch, use_cache, refresh, _settled())
+    return _coalesced(('IntradayTickRequest', tuple(secs), tuple(event_list), sdtime, edtime, tuple(columns)),
+                      lambda: _by_exchange(secs, sdtime, edtime, cached), refresh)
+
+def get_Ticks(s, event_list, sdtime, edtime, use_cache=True, refresh=False, store=False):
+    return get_Ticks_many([s], event_list, sdtime, edtime,
+                          use_cache=use_cache, refresh=refresh, store=store)[s]
+
+def _fetch_bars(secs, event_list, start, end, barinterval, max_in_flight, exchange, columns=blpdecode.BAR_COLUMNS,
+                answered=None):
+    build = lambda service, sec, wlo, whi: _bar_request(service, sec, event_list, wlo, whi, barinterval)
+    return _fetch_split("IntradayBarRequest", secs, build, blpdecode.decode_bars, columns,
+                        _bar_data, start, end, max_in_flight, exchange, answered)
+
+def get_Bars_many(secs, event_list, sdtime, edtime, barinterval, fld_list={}, max_in_flight=MAX_IN_FLIGHT,
+                  use_cache=True, refresh=False, panel=False):
+    '''get_Bars for many securities on one session.  sdtime and edtime are
+    in each security's exchange time, as are the bar times.  Every
+    security's range is split into one request per session day, and up to max_in_flight
+    requests are outstanding at once; returns {security: DataFrame}, or
+    with panel=True one blppanel.Panel (UTC times).  Only the bar fields in
+    fld_list (all when empty) are decoded.'''
+    bars = _bar_columns(secs, event_list, sdtime, edtime, barinterval, max_in_flight, use_cache, refresh,
+                        fld_list)
+    with metrics.timer('frame', "IntradayBarRequest"):
+        if panel:
+            return blppanel.Panel.from_columns(bars, OrderedDict.fromkeys(secs))
+        return dict((sec, bars[sec].frame(fld_list, blpcalendar.for_security(sec))) for sec in secs)
+
+def _bar_columns(secs, event_list, sdtime, edtime, barinterval, max_in_flight, use_cache, refresh,
+                 fld_list=None):
+    # {security: Columns} (UTC times) of get_Bars_many, holding only the
+    # fields in fld_list
+    columns = blpdecode.bar_columns(fld_list)
+    return _coalesced(('IntradayBarRequest', tuple(secs), tuple(event_list), sdtime, edtime, barinterval,
+                       tuple(name for name, _ in columns)),
+                      lambda: _fetch_bar_columns(secs, event_list, sdtime, edtime, barinterval, max_in_flight,
+                                                 use_cache, refresh, fld_list),
+                      refresh)
+
+def _fetch_bar_columns(secs, event_list, sdtime, edtime, barinterval, max_in_flight, use_cache, refresh,
+                       fld_list):
+    base = blpbars.BASE_INTERVAL
+    if RESAMPLE_BARS and barinterval != base and barinterval % base == 0:
+        bars = _bar_columns(secs, event_list, sdtime, edtime, base, max_in_flight, use_cache, refresh, fld_list)
+        return dict((sec, blpbars.resample(bars[sec], barinterval, blpcalendar.for_security(sec)))
+                    for sec in secs)
+    columns = blpdecode.bar_columns(fld_list)
+    full = lambda sec: ('IntradayBarRequest', sec, ','.join(event_list), barinterval)
+    def cached(group, start, end, exchange):
+        key = full
+        if len(columns) < len(blpdecode.BAR_COLUMNS):
+            # a projection is read from the full bars when they cover the range,
+            # else fetched and cached under a key of its own
+            if use_cache and disk_cache is not None and (
+                    refresh or any(disk_cache.gaps(full(sec), start, end) for sec in group)):
+                key = lambda sec: full(sec) + (','.join(name for name, _ in columns),)
+        fetch = lambda secs, gstart, gend, answered=None: _fetch_bars(secs, event_list, gstart, gend, barinterval,
+                                                                      max_in_flight, exchange, columns, answered)
+
+        return _cached(group, key, columns, start, end, fetch, use_cache, refresh, _settled(barinterval))
+    return _by_exchange(secs, sdtime, edtime, cached)
+
+def get_Bars(sec, event_list, sdtime, edtime, barinterval, fld_list={}, use_cache=True, refresh=False):
+    return get_Bars_many([sec], event_list, sdtime, edtime, barinterval, fld_list,
+                         use_cache=use_cache, refresh=refresh)[sec]
+
+def get_TickBars_many(secs, event_list, sdtime, edtime, seconds=None, volume=None, ticks=None,
+                      types=('TRADE',), max_in_flight=MAX_IN_FLIGHT, use_cache=True, refresh=False):
+    '''Bars built locally from the ticks of get_Ticks_many (blpaggregate):
+    time bars of `seconds`, bars of `volume` shares (one threshold or one
+    per security), or bars of `ticks` ticks, over the event types in
+    `types`.  Returns {security: DataFrame} of OHLC, numEvents, VOLUME,
+    VALUE, VWAP, TWAP, PARTICIPATION and END in exchange time.'''
+    cols = _tick_columns(secs, event_list, sdtime, edtime, max_in_flight, use_cache, refresh)
+    seg = blpaggregate.Segments.from_ticks(OrderedDict((s, cols[s]) for s in secs), types)
+    if seconds is not None:
+        bars = blpaggregate.time_bars(seg, seconds)
+    elif volume is not None:
+        bars = blpaggregate.volume_bars(seg, volume)
+    elif ticks is not None:
+        bars = blpaggregate.tick_bars(seg, ticks)
+    else:
+        raise ValueError("One of seconds, volume or ticks is needed")
+    with metrics.timer('frame', "IntradayTickRequest"):
+        return blpaggregate.frames(bars)
+
+def get_TickBars(sec, event_list, sdtime, edtime, seconds=None, volume=None, ticks=None, types=('TRADE',),
+                 use_cache=True, refresh=False):
+    return get_TickBars_many([sec], event_list, sdtime, edtime, seconds, volume, ticks, types,
+                             use_cache=use_cache, refresh=refresh)[sec]
+
+
+def _split_range(sdtime, edtime, window):
+    '''Split the sdtime-edtime range into consecutive sub-windows no longer
+    than `window`; returns [(sd, ed), ...] as datetime64.'''
+    start, end = np.datetime64(sdtime, 'us'), np.datetime64(edtime, 'us')
+    window = np.timedelta64(window, 'us')
+    windows = []
+    while start < end:
+        stop = min(start + window, end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+def _iter_frames(sec, build, decode, columns, data, sdtime, edtime, rows, window, fld_list=None):
+    # One request per sub-window on a borrowed session; a frame is yielded for
+    # every response message (rows=None) or every `rows` rows.
+    pending = None
+    exchange = blpcalendar.for_security(sec)
+    windows = _split_range(sdtime, edtime, window)
+    with session_manager.borrow() as session:
+        refDataService = session.getService("//blp/refdata")
+        for n, (sd, ed) in enumerate(windows):
+            last = n == len(windows) - 1
+            start, stop = pd.Timestamp(sd), pd.Timestamp(ed)
+            request = build(refDataService, _utc(sd, exchange), _utc(ed, exchange))
+            for key, msg, done in session.pipeline([(sec, request)], 1):
+                if msg.hasElement(RESPONSE_ERROR):
+                    continue
+                cols = blpdecode.Columns(columns)
+                decode(data(msg), cols)
+                frame = cols.frame(fld_list, exchange)
+                # keep rows at the window edges in exactly one window
+                if n:
+                    frame = frame[frame.index >= start]
+                if not last:
+                    frame = frame[frame.index < stop]
+                if rows is None:
+                    if len(frame):
+                        yield frame
+                    continue
+                pending = frame if pending is None else pd.concat([pending, frame])
+                while len(pending) >= rows:
+                    yield pending.iloc[:rows]
+                    pending = pending.iloc[rows:]
+    if pending is not None and len(pending):
+        yield pending
+
+def iter_Ticks(s, event_list, sdtime, edtime, rows=None, window=dt.timedelta(days=1)):
+    '''Generator version of get_Ticks for pulls too big to hold in memory.
+
+    The range is requested in sub-windows of at most `window`; yields a
+    DataFrame per PARTIAL_RESPONSE message, or per `rows` rows if given.'''
+    build = lambda service, start, end: _tick_request(service, s, event_list, start, end)
+    return _iter_frames(s, build, blpdecode.decode_ticks, blpdecode.TICK_COLUMNS,
+                        _tick_data, sdtime, edtime, rows, window)
+
+def iter_Bars(sec, event_list, sdtime, edtime, barinterval, fld_list={}, rows=None,
+              window=dt.timedelta(days=5)):
+    '''Generator version of get_Bars; see iter_Ticks.'''
+    build = lambda service, start, end: _bar_request(service, sec, event_list, start, end, barinterval)
+    return _iter_frames(sec, build, blpdecode.decode_bars, blpdecode.bar_columns(fld_list),
+                        _bar_data, sdtime, edtime, rows, window, fld_list)
+
+
+def _ref_request(service, sec_list, fld_list, overrides=()):
+    request = service.createRequest("ReferenceDataRequest")
+    for s in sec_list:
+        request.append("securities",s)
+    for f in fld_list:
+        request.append("fields",f)
+    for fieldId, value in overrides:
+        override = request.getElement("overrides").appendElement()
+        override.setElement("fieldId", fieldId)
+        override.setElement("value", value)
+    return request
+
+def _decode_ref(msg, columns, rows):
+    # columns is {FIELD: object array}, rows is {security: row}; a bulk field
+    # becomes a DataFrame of its rows in a single cell
+    securityDataArray = msg.getElement(SECURITY_DATA)
+    for securityData in securityDataArray.values():
+        row = rows.get(securityData.getElementAsString(SECURITY))
+        if row is None or not securityData.hasElement(FIELD_DATA):
+            continue
+        for field in securityData.getElement(FIELD_DATA).elements():
+            column = columns.get(str(field.name()).upper())
+            if column is None:
+                continue
+            if field.isArray():
+                column[row] = pd.DataFrame([dict((str(e.name()), e.getValue()) for e in item.elements())
+                                            for item in field.values()])
+            else:
+                column[row] = field.getValue()
+
+_MISSING = object()
+
+def _isnan(value):
+    return isinstance(value, float) and value != value
+
+def get_Ref(secs, fields, overrides=None, use_cache=True, refresh=False, max_in_flight=MAX_IN_FLIGHT):
+    '''Reference data for every security and field, as a frame indexed by
+    security with a column per field; bulk fields hold a DataFrame per
+    cell and missing values are NaN.  overrides is {fieldId: value}.
+
+    Values are memoized in ref_cache per (security, field, overrides), so
+    only the cells not already held are requested, in ReferenceDataRequests
+    of at most REF_CELLS securities x fields sent concurrently.'''
+    overrides = tuple(sorted((overrides or {}).items()))
+    fields = list(fields)
+    sec_list = list(OrderedDict.fromkeys(secs))
+    use_cache = use_cache and ref_cache is not None
+    key = lambda s, f: (s, f.upper(), overrides)
+    values = {}
+    plan = {}
+    for s in sec_list:
+        missing = []
+        for f in fields:
+            value = ref_cache.get(key(s, f), _MISSING) if use_cache and not refresh else _MISSING
+            if value is _MISSING:
+                missing.append(f)
+            else:
+                values[key(s, f)] = value
+        if missing:
+            plan.setdefault(tuple(missing), []).append(s)
+
+    if plan:
+        requests, decoded = [], []
+        for fld_list, group in plan.items():
+            rows = dict((s, i) for i, s in enumerate(group))
+            columns = dict((f.upper(), np.full(len(group), np.nan, dtype=object)) for f in fld_list)
+            decoded.append((fld_list, group, rows, columns))
+        with session_manager.borrow() as session:
+            refDataService = session.getService("//blp/refdata")
+            for n, (fld_list, group, rows, columns) in enumerate(decoded):
+                batch = max(1, REF_CELLS // len(fld_list))
+                requests += [(n, _ref_request(refDataService, group[i:i + batch], fld_list, overrides))
+                             for i in range(0, len(group), batch)]
+            for n, msg, done in session.pipeline(requests, max_in_flight):
+                if msg.hasElement(RESPONSE_ERROR):
+                    continue
+                fld_list, group, rows, columns = decoded[n]
+                start = clock()
+                _decode_ref(msg, columns, rows)
+                count = msg.getElement(SECURITY_DATA).numValues()
+                metrics.decoded("ReferenceDataRequest", clock() - start, count, count * len(fld_list), 0)
+        for fld_list, group, rows, columns in decoded:
+            for f in fld_list:
+                column = columns[f.upper()]
+                for s, i in rows.items():
+                    values[key(s, f)] = column[i]
+                    # only cells that came back are memoized; failures are retried
+                    if use_cache and not _isnan(column[i]):
+                        ref_cache.put(key(s, f), column[i])
+
+    secs = list(secs)
+    with metrics.timer('frame', "ReferenceDataRequest"):
+        data = pd.DataFrame(OrderedDict((f, [values[key(s, f)] for s in secs]) for f in fields),
+                            index=pd.Index(secs, name='security'), columns=fields)
+        return data.infer_objects()
+
+def _asof(asof):
+    # as-of date key 'YYYYMMDD'; today when not given
+    if asof is None:
+        return dt.date.today().strftime("%Y%m%d")
+    return pd.Timestamp(asof).strftime("%Y%m%d")
+
+def _index_request(service, index, asof=None):
+    # current members from Indx_Members, or the members on `asof` from
+    # INDX_MWEIGHT_HIST with an END_DATE_OVERRIDE
+    if asof is None:
+        return _ref_request(service, [index], ["Indx_Members"])
+    return _ref_request(service, [index], ["INDX_MWEIGHT_HIST"], [("END_DATE_OVERRIDE", asof)])
+
+def _decode_index(msg, response):
+    '''Append the Indx_Members of one response message to `response`; a
+    scalar field replaces it instead.'''
+    securityDataArray = msg.getElement(SECURITY_DATA)
+    for i in range(0,securityDataArray.numValues()):
+        
+        #print the security name
+        securityData = securityDataArray.getValue(i)
+        #print securityData.getElement(SECURITY).getValue()
+        
+        #Each security element has a fieldData element with the fields requested
+        fieldData = securityData.getElement(FIELD_DATA)  
+        
+        for field in fieldData.elements():
+            if field.name() == INDX_MWEIGHT_HIST:
+                for row in field.values():
+                    response.append(row.getElementAsString(INDEX_MEMBER) + " Equity")
             
-            for msg in ev:
-                if ev.eventType() == blpapi.Event.RESPONSE or ev.eventType() == blpapi.Event.PARTIAL_RESPONSE:                       
-                    data = msg.getElement(BAR_DATA).getElement(BAR_TICK_DATA)
-                    for bar in data.values():
-                        time = bar.getElementAsDatetime(TIME)
-                        time = time - UTC_OFFSET
-                        timeString = bar.getElementAsString(TIME)
-                        open = bar.getElementAsFloat(OPEN)
-                        high = bar.getElementAsFloat(HIGH)
-                        low = bar.getElementAsFloat(LOW)
-                        close = bar.getElementAsFloat(CLOSE)
-                        numEvents = bar.getElementAsInteger(NUM_EVENTS)
-                        volume = bar.getElementAsInteger(VOLUME)
-                        value = bar.getElementAsFloat(VALUE)
-                        
-                        indexlist.append(time)
-                        openlist.append(open)
-                        highlist.append(high)
-                        lowlist.append(low)
-                        closelist.append(close)
-                        numEventslist.append(numEvents)
-                        volumelist.append(volume)
-                        valuelist.append(value)
-            # Response completely received, so we could exit
+            elif not field.isArray():
+                response = field.getValue()
             
-            if ev.eventType() == blpapi.Event.RESPONSE:
-                break
-    finally:
-        # Stop the session
-        session.stop()
-        
-    output = pd.DataFrame()
-    
-    df = pd.DataFrame({'OPEN' : openlist, \
-                           'HIGH' : highlist, \
-                           'LOW' : lowlist, \
-                           'CLOSE' : closelist, \
-                           'numEvents' : numEventslist, \
-                           'VOLUME' : volumelist, \
-                           'VALUE' : valuelist}, index=indexlist)      
-    if not fld_list:
-        output = df
-    else:                       
-        for f in fld_list:
-            output=output.join(df[f],how="outer")
-    
-    return output
-
+            #bulk fields are returned as array
+            elif field.isArray():                           
+                for i, row in enumerate(field.values()):
+                    if i != 0:
+                        for col in field.getValue(i).elements():                                        
+                            response.append(col.getValue() + " Equity")
+    return response
 
-def get_index(index): 
-    global options
-    session = blpapi.Session(options)
-    session.start()
-    session.openService('//blp/refdata')
-    refDataService = session.getService("//blp/refdata")
-    request = refDataService.createRequest("ReferenceDataRequest")
-    request.append("securities",index)
-    request.append("fields","Indx_Members")  
-    session.sendRequest(request)
-    
-    try:
-        # Process received events
-        response = []   
-        while(True):
-            ev = session.nextEvent()
-            if ev.eventType() == blpapi.Event.PARTIAL_RESPONSE or ev.eventType() == blpapi.Event.RESPONSE:            
-                
-                for msg in ev:
-                    securityDataArray = msg.getElement(SECURITY_DATA)
-                    for i in range(0,securityDataArray.numValues()):
-                        
-                        #print the security name
-                        securityData = securityDataArray.getValue(i)
-                        #print securityData.getElement(SECURITY).getValue()
-                        
-                        #Each security element has a fieldData element with the fields requested
-                        fieldData = securityData.getElement(FIELD_DATA)  
-                        
-                        for field in fieldData.elements():
-                            if not field.isArray():
-                                response = field.getValue()
-                            
-                            #bulk fields are returned as array
-                            elif field.isArray():                           
-                                for i, row in enumerate(field.values()):
-                                    if i != 0:
-                                        for col in field.getValue(i).elements():                                        
-                                            response.append(col.getValue() + " Equity")
-                                
-            # Response completely received, so we could exit
-            if ev.eventType() == blpapi.Event.RESPONSE:
-                break
-    finally:
-        # Stop the session
-        session.stop()
+def get_index(index, asof=None, use_cache=True, refresh=False): 
+    '''Members of `index` as tickers ending in " Equity".  With asof (a date
+    or 'YYYYMMDD') returns the constituents on that date, from
+    INDX_MWEIGHT_HIST.  Lookups are memoized in index_cache per (index,
+    as-of date); current membership expires after a day, past snapshots
+    are kept.  A lookup answered with a responseError raises RuntimeError,
+    and an empty membership is returned but not memoized.'''
+
+    key = _asof(asof)
+    if use_cache and index_cache is not None and not refresh:
+        response = index_cache.get(index, key)
+        if response is not None:
+            return response
+    with session_manager.borrow() as session:
+        refDataService = session.getService("//blp/refdata")
+        request = _index_request(refDataService, index, None if asof is None else key)
+        response, error = [], None
+        for _, msg, done in session.pipeline([(index, request)], 1):
+            if msg.hasElement(RESPONSE_ERROR):
+                error = _error_message(msg)
+                continue
+            response = _decode_index(msg, response)
+    return _index_result(index, key, response, error, use_cache)
+
+def _error_message(msg):
+    return msg.getElement(RESPONSE_ERROR).getElementAsString(MESSAGE)
+
+def _index_result(index, key, response, error, use_cache):
+    # a failed lookup raises rather than pass for an empty index, and only a
+    # non-empty member list is memoized (a past snapshot would be kept for good)
+    if error is not None:
+        raise RuntimeError("Index members of %s not available: %s" % (index, error))
+    if use_cache and index_cache is not None and isinstance(response, list) and response:
+        index_cache.put(index, key, response)
     return response
 
-def bbg_volcurve(ind, event, edate, numdays, interval,fld_lst):
-    sec_list = blp.get_index(ind)
-    volcurves = pd.DataFrame()
-    fmt = "%Y-%m-%d" + 'T' + "%H:%M:%S"  #Assumes no milliseconds
-    endDateTime = dt.datetime.strptime(edate, fmt)
-    bday_jp = CustomBusinessDay(holidays=zip(*CountryHolidays.get('JP', int(edate[0:4])))[0])
-    startDateTime = endDateTime.replace(hour=9) - numdays*BDay()
-    timedelta =  pd.date_range(startDateTime, endDateTime, freq=bday_jp).nunique()
-    sdate = startDateTime.strftime(fmt)
-    for stock in sec_list:
-        output=get_Bars(stock, event, sdate, edate, interval, fld_lst)
-        output.rename(columns={'VOLUME':stock},inplace=True)
-        volcurves = volcurves.join(output,how="outer")
+
+def _volcurve_bars(ind, event, edate, numdays, interval, fld_lst, calendar):
+    sec_list, sdate, ndays = _volcurve_window(ind, edate, numdays, calendar)
+    return get_Bars_many(sec_list, event, sdate, edate, interval, fld_lst), ndays
+
+def _exchange_of(sec_list):
+    # exchange of an index's members, taken from the first
+    return blpcalendar.for_security(sec_list[0]) if sec_list else blpcalendar.DEFAULT
+
+def _open(day, exchange):
+    # 'YYYY-MM-DDTHH:MM:SS' of the exchange's first session open on `day`
+    opening = blpcalendar.sessions_on(exchange.sessions, str(day)[:10])[0][0]
+    return '%sT%02d:%02d:00' % ((str(day)[:10],) + divmod(opening, 60))
+
+
+def _volcurve_window(ind, edate, numdays, calendar):
+    # (members, start of the first of numdays business days, number of days)
+    sec_list = get_index(ind)
+    exchange = _exchange_of(sec_list)
+    end = np.datetime64(edate, 'D')
+    if calendar is None:
+        year = int(str(end)[:4])
+        calendar = exchange.calendar([year - 1, year])
+    first = pd.Timestamp(end) - numdays*calendar
+    ndays = len(pd.date_range(first, pd.Timestamp(end), freq=calendar))
+    return sec_list, _open(first.date(), exchange), ndays
+
+def bbg_volcurve(ind, event, edate, numdays, interval,fld_lst, calendar=None):
+    '''ADV, per-bucket volume sums and cumulative volume curves for the
+    members of index `ind` over the `numdays` business days up to edate.
+    calendar is a precomputed CustomBusinessDay; by default the cached
+    calendar of the members' exchange (blpcalendar) is used.  Its requests
+    go out in the scheduler's BULK class, behind interactive lookups.'''
+    with blpscheduler.priority(blpscheduler.BULK):
+        bars, ndays = _volcurve_bars(ind, event, edate, numdays, interval, fld_lst, calendar)
 
     #process the raw data into historical averages
-    volcurves.rename(columns=lambda x: x[:4], inplace=True)
-    timevect = pd.Series(volcurves.index.values)
-    timeframet = timevect.to_frame()
-    timeframet.columns =['date']
-    timeframet.set_index(timevect,inplace="True")
-    timeframet['bucket'] = timeframet['date'].apply(lambda x: dt.datetime.strftime(x, '%H:%M:%S'))
-    timeframet=timeframet.join(volcurves)
-    volcurvesum=timeframet.groupby(['bucket']).sum()
-    adv = volcurvesum.sum()/timedelta
-    volcurves = volcurvesum / volcurvesum.sum()
-    volcurves = volcurves.cumsum()
-    volcurves = volcurves.interpolate()
-    volcurvesum = volcurvesum.interpolate()
-    
-    return adv, volcurvesum.fillna(method=bfill), volcurves.fillna(method=bfill)
+    bars = dict((stock[:4], bars[stock]) for stock in bars)
+    return blpvolcurve.volume_curve(bars, ndays)
+
+def bbg_volcurve_state(ind, event, edate, numdays, interval, fld_lst, calendar=None):
+    '''bbg_volcurve as a blpvolcurve.VolumeCurve that can be rolled forward
+    a day at a time with bbg_volcurve_roll; result() gives the same tuple.'''
+    with blpscheduler.priority(blpscheduler.BULK):
+        bars, ndays = _volcurve_bars(ind, event, edate, numdays, interval, fld_lst, calendar)
+    return blpvolcurve.VolumeCurve.from_bars(bars, ndays, label=lambda x: x[:4])
+
+def bbg_volcurve_roll(curve, event, edate, interval, fld_lst):
+    '''Fetch the day ending at edate for the securities in `curve` and add it,
+    dropping the oldest day.'''
+    sdate = _open(edate, _exchange_of(curve.secs))
+    with blpscheduler.priority(blpscheduler.BULK):
+        bars = get_Bars_many(curve.secs, event, sdate, edate, interval, fld_lst)
+    curve.add_day(bars, edate[:10])
+    return curve
 
 
 
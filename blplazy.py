@@ -0,0 +1,79 @@
+'''Deferred imports and blpapi.Name constants.
+
+Importing blpfunctions used to load blpapi, pandas and numpy and create
+every blpapi.Name at once, which a short job paid for even when its one call
+(a cached get_index, say) needed none of them.  The blp modules now bind
+their heavy dependencies with module(), which imports on first attribute
+access, and declare their Name constants with Names, which creates them
+all when the first session starts or when another module reads one:
+
+    np = blplazy.module('numpy')
+    _names = blplazy.Names(globals(), SECURITY_DATA="securityData")
+    __getattr__ = _names.getattr        # blpfunctions.SECURITY_DATA works too
+
+Python 3.7+ is needed for the module-level __getattr__; on older versions
+read the constants after a session has started.
+'''
+import importlib
+import sys
+import types
+
+_registry = []
+
+
+class _LazyModule(types.ModuleType):
+    '''Stands in for a module until one of its attributes is read, then
+    imports it and copies its namespace so later reads are plain lookups.'''
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            raise AttributeError(attr)
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def module(name):
+    '''`name` if it is already imported, else a stand-in that imports it on use.'''
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+class Names(object):
+    '''blpapi.Name constants of one module, created together on first need.
+
+    `names` maps each constant to an element name, or to a tuple of names
+    for a tuple of Names.  The constants are written into `namespace` (the
+    module's globals()), so code in the module reads them as plain globals
+    once resolve() has run.'''
+
+    def __init__(self, namespace, **names):
+        self.namespace = namespace
+        self.names = names
+        self.resolved = False
+        _registry.append(self)
+
+    def resolve(self):
+        if self.resolved:
+            return
+        blpapi = importlib.import_module('blpapi')
+        for attr, name in self.names.items():
+            if isinstance(name, tuple):
+                self.namespace[attr] = tuple(blpapi.Name(n) for n in name)
+            else:
+                self.namespace[attr] = blpapi.Name(name)
+        self.resolved = True
+
+    def getattr(self, attr):
+        '''Module __getattr__ serving the constants.'''
+        if attr not in self.names:
+            raise AttributeError("module %r has no attribute %r" % (self.namespace.get('__name__'), attr))
+        self.resolve()
+        return self.namespace[attr]
+
+
+def resolve():
+    '''Create the Name constants of every module; sessions call this on start.'''
+    for names in list(_registry):
+        names.resolve()
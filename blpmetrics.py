@@ -0,0 +1,179 @@
+'''Timers, counters and latency histograms for Bloomberg requests.
+
+blpsession and blpfunctions record into the module-level `metrics`:
+
+    phases (seconds, per request type)
+        queue_wait      waiting for a blpscheduler slot (per priority class)
+        session_start   start() of a pooled session
+        service_open    openService of a service not yet cached
+        first_response  sendRequest to the first PARTIAL_RESPONSE/RESPONSE
+        request         sendRequest to the final RESPONSE
+        decode          decoding response messages into Columns
+        frame           building the DataFrames returned to the caller
+    counters (per request type)
+        requests, failures, messages, rows, elements, bytes (decoded)
+        hits, misses, coalesced (blpcache.Coalescer: calls answered by a
+            recent result, by a new request, or by one already in flight)
+        retries, throttled (blpscheduler: requests sent again after a
+            transient responseError, and LIMIT errors among those)
+    gauges
+        queue_depth, in_flight (blpscheduler, read at export)
+
+Each phase goes into a fixed log-spaced Histogram, so recording is a bisect
+and two additions under a lock and percentiles come from the buckets.
+Export with metrics.prometheus() (text exposition format) or register a
+callback(name, request_type, value) in metrics.callbacks to receive every
+observation; set metrics.enabled = False to switch recording off.
+'''
+import bisect
+import contextlib
+import threading
+from timeit import default_timer as clock
+
+# histogram bucket upper bounds (seconds): 10us doubling every two buckets up to ~2 min
+BOUNDS = [1e-5 * 2 ** (i / 2.0) for i in range(48)]
+
+PHASES = ['queue_wait', 'session_start', 'service_open', 'first_response', 'request', 'decode', 'frame']
+COUNTERS = ['requests', 'failures', 'messages', 'rows', 'elements', 'bytes', 'hits', 'misses', 'coalesced',
+            'retries', 'throttled']
+
+
+class Histogram(object):
+    '''Counts of observations per BOUNDS bucket plus their sum and maximum.'''
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        '''Estimate of the q-th percentile (0-100), interpolated within its bucket.'''
+        if not self.count:
+            return float('nan')
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = BOUNDS[i - 1] if i else 0.0
+                hi = BOUNDS[i] if i < len(BOUNDS) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Metrics(object):
+    def __init__(self):
+        self.enabled = True
+        self.counters = {}      # (name, request type) -> total
+        self.histograms = {}    # (phase, request type) -> Histogram
+        self.callbacks = []
+        self.gauges = {}        # name -> (label, function() -> {label value: value})
+        self._lock = threading.Lock()
+
+    def incr(self, name, kind='', n=1):
+        if not self.enabled:
+            return
+        key = (name, kind)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+        for callback in self.callbacks:
+            callback(name, kind, n)
+
+    def observe(self, phase, kind, seconds):
+        if not self.enabled:
+            return
+        key = (phase, kind)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+        for callback in self.callbacks:
+            callback(phase, kind, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, phase, kind=''):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.observe(phase, kind, clock() - start)
+
+    def decoded(self, kind, seconds, rows, elements, nbytes):
+        '''Record one decode call.'''
+        if not self.enabled:
+            return
+        self.observe('decode', kind, seconds)
+        self.incr('rows', kind, rows)
+        self.incr('elements', kind, elements)
+        self.incr('bytes', kind, nbytes)
+
+    def percentiles(self, phase, kind='', qs=(50, 90, 99)):
+        histogram = self.histograms.get((phase, kind))
+        return dict((q, histogram.percentile(q) if histogram else float('nan')) for q in qs)
+
+    def summary(self, qs=(50, 90, 99)):
+        '''{(phase, request type): {'count', 'sum', 'max', 'p50', ...}}'''
+        with self._lock:
+            items = list(self.histograms.items())
+        summary = {}
+        for key, histogram in sorted(items):
+            row = {'count': histogram.count, 'sum': histogram.sum, 'max': histogram.max}
+            for q in qs:
+                row['p%g' % q] = histogram.percentile(q)
+            summary[key] = row
+        return summary
+
+    def prometheus(self, prefix='blp'):
+        '''All counters, histograms and gauges in the Prometheus text exposition format.'''
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(h.counts), h.count, h.sum) for key, h in self.histograms.items())
+        lines = []
+        names = sorted(set(name for (name, _), _ in counters))
+        for name in names:
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            for (cname, kind), value in counters:
+                if cname == name:
+                    lines.append('%s_%s_total{request="%s"} %d' % (prefix, name, kind, value))
+        if histograms:
+            metric = '%s_phase_seconds' % prefix
+            lines.append('# TYPE %s histogram' % metric)
+            for (phase, kind), counts, count, total in histograms:
+                labels = 'phase="%s",request="%s"' % (phase, kind)
+                cumulative = 0
+                for bound, n in zip(BOUNDS, counts):
+                    cumulative += n
+                    lines.append('%s_bucket{%s,le="%.6g"} %d' % (metric, labels, bound, cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, labels, count))
+                lines.append('%s_sum{%s} %.9g' % (metric, labels, total))
+                lines.append('%s_count{%s} %d' % (metric, labels, count))
+        for name, (label, read) in sorted(self.gauges.items()):
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            for value, n in sorted(read().items()):
+                lines.append('%s_%s{%s="%s"} %g' % (prefix, name, label, value, n))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+
+
+def request_type(request):
+    '''Operation name of a blpapi Request, e.g. "IntradayBarRequest".'''
+    try:
+        return str(request.asElement().name())
+    except Exception:
+        return ''
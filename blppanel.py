@@ -0,0 +1,167 @@
+'''Cross-sectional result of a batch get_Bars / get_Ticks call.
+
+A Panel puts every security on one sorted UTC time axis.  Each field is a
+dense (time x security) array, and fields of one dtype share a single
+(field x time x security) block, so a field is a view of its block.
+`mask` marks the cells a security actually has.  Cross-sectional maths is
+plain array maths, with no reindexing or joining per name:
+
+    panel = get_Bars_many(secs, ['TRADE'], sd, ed, 5, panel=True)
+    close = panel.masked('CLOSE')                   # numpy MaskedArray, no copy
+    returns = np.diff(np.log(panel.ffill('CLOSE')), axis=0)
+    panel.frame('VOLUME', exchange)                 # wide DataFrame, no copy
+    panel.long_frame()                              # time/security/field rows
+    panel.to_xarray()                               # Dataset sharing the blocks
+
+Ticks can share a time stamp.  A time then appears on the axis as many
+times as any one security repeats it, and the k-th tick of every security
+at that time lands on the same row.  Empty cells hold NaN in float fields,
+0 in integer fields and None in object fields.
+'''
+from collections import OrderedDict
+
+import blplazy
+
+np = blplazy.module('numpy')
+pd = blplazy.module('pandas')
+
+
+def _fill(dtype):
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind == 'O':
+        return None
+    if dtype.kind in 'mM':
+        return np.array('NaT', dtype=dtype)
+    return 0
+
+
+def _ranks(t):
+    # occurrence number of every time among the equal times before it (t sorted)
+    n = len(t)
+    if not n:
+        return np.empty(0, dtype=np.int64)
+    new = np.r_[True, t[1:] != t[:-1]]
+    return np.arange(n) - np.maximum.accumulate(np.where(new, np.arange(n), 0))
+
+
+class Panel(object):
+    '''Aligned (time x security) arrays per field.
+
+    time is datetime64[us] UTC, keys the securities (columns), values
+    {field: 2D array} and mask a boolean (time x security) array that is
+    True where the security has a row; fields orders the values.'''
+
+    def __init__(self, time, keys, values, mask, fields=None):
+        self.time = time
+        self.keys = list(keys)
+        self.values = values
+        self.mask = mask
+        self.fields = list(values) if fields is None else list(fields)
+        self._index = dict((key, i) for i, key in enumerate(self.keys))
+
+    @classmethod
+    def from_columns(cls, columns, keys=None):
+        '''Build from {security: blpdecode.Columns} (UTC times, sorted per
+        security), with columns in the order of `keys` (all, in dict order,
+        when None).  Every security must have the same column names.'''
+        keys = list(columns) if keys is None else list(keys)
+        cols = [columns[key] for key in keys]
+        names = cols[0].names if cols else []
+        times = [c.times() for c in cols]
+        ranks = [_ranks(t) for t in times]
+        flat = np.concatenate(times) if cols else np.empty(0, dtype='datetime64[us]')
+        flat_rank = np.concatenate(ranks) if cols else np.empty(0, dtype=np.int64)
+        # each distinct time takes as many rows as its most repeated security needs
+        distinct, inverse = np.unique(flat, return_inverse=True)
+        inverse = inverse.ravel()
+        rows = np.zeros(len(distinct), dtype=np.int64)
+        np.maximum.at(rows, inverse, flat_rank + 1)
+        first_row = np.cumsum(rows) - rows
+        time = np.repeat(distinct, rows)
+        position = first_row[inverse] + flat_rank
+        column = np.repeat(np.arange(len(keys)), [len(t) for t in times])
+        mask = np.zeros((len(time), len(keys)), dtype=bool)
+        mask[position, column] = True
+        # one (field x time x security) block per dtype; each field is a view
+        groups = OrderedDict()
+        for name in names:
+            dtype = np.result_type(*[c.arrays[name].dtype for c in cols])
+            groups.setdefault(dtype, []).append(name)
+        values = {}
+        for dtype, group in groups.items():
+            block = np.empty((len(group), len(time), len(keys)), dtype=dtype)
+            block[...] = _fill(dtype)
+            for i, name in enumerate(group):
+                block[i][position, column] = np.concatenate([c.column(name) for c in cols])
+                values[name] = block[i]
+        return cls(time, keys, values, mask, names)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def shape(self):
+        '''(times, securities)'''
+        return self.mask.shape
+
+    def column(self, key):
+        '''Index of security `key` along the security axis.'''
+        return self._index[key]
+
+    def block(self, fields=None):
+        '''(field x time x security) array of `fields` (all by default).
+        When they are exactly the fields sharing one block, in block order,
+        that block is returned without a copy; otherwise they are stacked.'''
+        fields = self.fields if fields is None else list(fields)
+        base = self.values[fields[0]].base
+        if (base is not None and base.ndim == 3 and len(base) == len(fields)
+                and all(self.values[f].base is base for f in fields)
+                and all(self.values[f].ctypes.data == base[i].ctypes.data for i, f in enumerate(fields))):
+            return base
+        return np.stack([self.values[f] for f in fields])
+
+    def masked(self, field):
+        '''numpy MaskedArray view of `field`, masked where a security has no row.'''
+        return np.ma.MaskedArray(self.values[field], mask=~self.mask, copy=False)
+
+    def ffill(self, field):
+        '''Copy of `field` with every empty cell holding the security's
+        previous value (empty before its first row).'''
+        rows = np.where(self.mask, np.arange(len(self.time))[:, None], 0)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        filled = np.take_along_axis(self.values[field], rows, axis=0)
+        seen = np.maximum.accumulate(self.mask, axis=0)
+        filled[~seen] = _fill(filled.dtype)
+        return filled
+
+    def local_time(self, exchange):
+        '''The time axis in the local time of `exchange` (a blpcalendar.Exchange).'''
+        return exchange.to_local(self.time)
+
+    def frame(self, field, exchange=None):
+        '''Wide DataFrame of one field (time x security) sharing the panel's
+        memory; times UTC, or local to `exchange`.'''
+        time = self.time if exchange is None else self.local_time(exchange)
+        return pd.DataFrame(self.values[field], index=pd.DatetimeIndex(time, name='time'),
+                            columns=pd.Index(self.keys, name='security'), copy=False)
+
+    def long_frame(self, fields=None):
+        '''Long DataFrame of time/security rows that exist, one column per field.'''
+        fields = self.fields if fields is None else list(fields)
+        rows, cols = np.nonzero(self.mask)
+        data = OrderedDict([('time', self.time[rows]),
+                            ('security', np.asarray(self.keys, dtype=object)[cols])])
+        for f in fields:
+            data[f] = self.values[f][rows, cols]
+        return pd.DataFrame(data, columns=list(data))
+
+    def to_xarray(self, fields=None):
+        '''xarray Dataset with a (time, security) variable per field over
+        the panel's own arrays, plus the mask as `valid`.'''
+        import xarray as xr
+        fields = self.fields if fields is None else list(fields)
+        coords = {'time': self.time, 'security': self.keys}
+        data = dict((f, (('time', 'security'), self.values[f])) for f in fields)
+        data['valid'] = (('time', 'security'), self.mask)
+        return xr.Dataset(data, coords=coords)
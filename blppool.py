@@ -0,0 +1,259 @@
+'''Process-pool fan-out for index-wide pulls.
+
+The security list is sharded across worker processes.  Each worker has its
+own session manager (so its own blpapi session), fetches and decodes its
+shard with the usual get_* machinery and disk cache, and copies the decoded
+columns of the whole shard into one shared-memory block.  Only the block's
+name and layout are pickled back; the parent maps the block and builds
+DataFrames, or volume curves, straight from views into it.
+
+    bars = get_Bars_parallel(secs, ['TRADE'], '2016-04-11T09:00:00', '2016-04-15T15:00:00', 1)
+    adv, sums, curves = bbg_volcurve_parallel('NKY Index', ['TRADE'], '2016-04-15T15:00:00', 20, 1, {})
+
+Every task carries the caller's blpscheduler priority class and its share
+of the scheduler's limits.  The shard count is held to max_concurrent, and
+rate, burst and max_concurrent are divided among the shards fetching at
+once, so the workers together keep to the parent's limits.  Each worker
+still backs off on its own throttled responses.
+
+The pool is started on first use and kept, with its sessions, until
+shutdown().  Python 3.8+ only.  Under the spawn start method (Windows,
+macOS) workers import the blp modules afresh, so pick a non-default
+backend with BLP_BACKEND rather than by patching sys.modules.
+'''
+import multiprocessing
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+import blpcalendar
+import blpdecode
+import blpfunctions
+import blpscheduler
+import blpvolcurve
+from blpcache import Coalescer
+from blpsession import SessionManager, MAX_IN_FLIGHT
+
+# worker processes; None means one per core
+PROCESSES = None
+
+_pool = None
+_pool_size = None
+
+
+class SharedBlock(object):
+    '''Decoded rows of many keys (securities, or (security, field) pairs)
+    in one shared-memory segment.  `time` and every array in `arrays` hold
+    all keys back to back; key i owns rows offsets[i]:offsets[i + 1].'''
+
+    def __init__(self, name, keys, counts, layout):
+        self._shm = shared_memory.SharedMemory(name=name)
+        # the mapping stays valid after the name is gone, so nothing leaks
+        # if the parent dies before close()
+        self._shm.unlink()
+        self.keys = list(keys)
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        self._index = dict((key, i) for i, key in enumerate(self.keys))
+        n = int(self.offsets[-1])
+        self.columns_spec = [(column, np.dtype(dtype)) for column, dtype, _ in layout[1:]]
+        views = dict((column, np.ndarray((n,), dtype=np.dtype(dtype), buffer=self._shm.buf, offset=offset))
+                     for column, dtype, offset in layout)
+        self.time = views.pop('time')
+        self.arrays = views
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def columns(self, key):
+        '''blpdecode.Columns of one key, as views into the block.'''
+        i = self._index[key]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return blpdecode.Columns.from_arrays(self.columns_spec, self.time[lo:hi],
+                                             dict((name, a[lo:hi]) for name, a in self.arrays.items()))
+
+    def close(self):
+        '''Unmap the block; views into it must not be used afterwards.'''
+        self.time = self.arrays = None
+        self._shm.close()
+
+
+def _pack(response, keys):
+    # copy {key: Columns} into a new shared-memory segment; returns what
+    # SharedBlock needs to map it
+    cols = [response[key] for key in keys]
+    counts = [c.n for c in cols]
+    n = sum(counts)
+    names = cols[0].names if cols else []
+    data = {'time': [c.times() for c in cols]}
+    for name in names:
+        parts = [c.column(name) for c in cols]
+        if any(p.dtype == object for p in parts):
+            # tick types: fixed-width strings, as in the disk cache
+            parts = [p.astype('U') if len(p) else np.empty(0, dtype='U1') for p in parts]
+        data[name] = parts
+    layout, offset = [], 0
+    for name in ['time'] + names:
+        dtype = np.result_type(*[p.dtype for p in data[name]]) if data[name] else np.dtype('f8')
+        layout.append((name, dtype.str, offset))
+        offset += -(-n * dtype.itemsize // 8) * 8
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for name, dtype, start in layout:
+            out = np.ndarray((n,), dtype=np.dtype(dtype), buffer=shm.buf, offset=start)
+            pos = 0
+            for part in data[name]:
+                out[pos:pos + len(part)] = part
+                pos += len(part)
+            del out
+        name = shm.name
+    finally:
+        shm.close()
+    # the parent owns and unlinks it now; stop this process's resource
+    # tracker from removing it when the worker exits
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return name, keys, counts, layout
+
+
+def _init():
+    # a forked worker must not share the parent's sockets, nor wait on the
+    # parent's in-flight calls
+    blpfunctions.session_manager = SessionManager(blpfunctions.options)
+    # slots held by the parent's requests are not this process's; _work
+    # configures it with the parent's share
+    blpscheduler.scheduler = blpscheduler.Scheduler()
+    if blpfunctions.coalescer is not None:
+        blpfunctions.coalescer = Coalescer(blpfunctions.coalescer.results.ttl)
+
+
+def _work(task):
+    what, keys, args, level, settings = task
+    scheduler = blpscheduler.scheduler
+    if scheduler.settings() != settings:
+        scheduler.configure(**settings)
+    with blpscheduler.priority(level):
+        return _pack(_FETCH[what](keys, *args), keys)
+
+
+_FETCH = {'bars': blpfunctions._bar_columns,
+          'ticks': blpfunctions._tick_columns,
+          'hist': blpfunctions._hist_columns}
+
+
+def pool(processes=PROCESSES):
+    global _pool, _pool_size
+    processes = processes or os.cpu_count() or 1
+    if _pool is None or _pool_size != processes:
+        shutdown()
+        _pool = multiprocessing.Pool(processes, initializer=_init)
+        _pool_size = processes
+    return _pool
+
+
+def shutdown():
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = _pool_size = None
+
+
+def _workers(processes):
+    # processes to shard over: no more than the scheduler's concurrency cap
+    processes = processes or os.cpu_count() or 1
+    cap = blpscheduler.scheduler.max_concurrent
+    return processes if cap is None else max(1, min(processes, cap))
+
+
+def _shards(keys, n):
+    # n contiguous, order-preserving shards of about equal size
+    bounds = np.linspace(0, len(keys), n + 1).round().astype(int)
+    return [keys[bounds[i]:bounds[i + 1]] for i in range(n) if bounds[i] < bounds[i + 1]]
+
+
+def _run(what, shards, args, processes):
+    level, settings = blpscheduler.level(), blpscheduler.scheduler.share(max(len(shards), 1))
+    return [SharedBlock(*packed) for packed in
+            pool(processes).map(_work, [(what, shard, args, level, settings) for shard in shards])]
+
+
+def _blocks(what, secs, args, processes):
+    return _run(what, _shards(list(secs), _workers(processes)), args, processes)
+
+
+def get_Bars_parallel(secs, event_list, sdtime, edtime, barinterval, fld_list={}, processes=PROCESSES,
+                      max_in_flight=MAX_IN_FLIGHT, use_cache=True, refresh=False, blocks=False):
+    '''get_Bars_many with the securities sharded across worker processes.
+    Returns {security: DataFrame} in exchange time, or with blocks=True
+    the SharedBlocks (UTC times) for the caller to use and close().'''
+    result = _blocks('bars', secs, (event_list, sdtime, edtime, barinterval, max_in_flight, use_cache, refresh,
+                                     fld_list), processes)
+    if blocks:
+        return result
+    return _frames(result, lambda key, cols: cols.frame(fld_list, blpcalendar.for_security(key)))
+
+
+def get_Ticks_parallel(secs, event_list, sdtime, edtime, processes=PROCESSES,
+                       max_in_flight=MAX_IN_FLIGHT, use_cache=True, refresh=False, blocks=False):
+    '''get_Ticks_many with the securities sharded across worker processes.'''
+    result = _blocks('ticks', secs, (event_list, sdtime, edtime, max_in_flight, use_cache, refresh), processes)
+    if blocks:
+        return result
+    return _frames(result, lambda key, cols: cols.frame(exchange=blpcalendar.for_security(key)))
+
+
+def get_Hist_parallel(sec_list, fld_list, start_date, end_date, processes=PROCESSES, long=False,
+                      max_in_flight=MAX_IN_FLIGHT, use_cache=True, refresh=False):
+    '''get_Hist with the securities sharded across worker processes.'''
+    shards = [[(s, f) for s in shard for f in fld_list] for shard in _shards(list(sec_list), _workers(processes))]
+    result = _run('hist', shards, (start_date, end_date, use_cache, refresh, max_in_flight), processes)
+    try:
+        response = dict((key, block.columns(key)) for block in result for key in block.keys)
+        return blpfunctions._hist_frame([(s, f) for s in sec_list for f in fld_list], response, long)
+    finally:
+        for block in result:
+            block.close()
+
+
+def _frames(blocks, frame):
+    try:
+        return dict((key, frame(key, block.columns(key))) for block in blocks for key in block.keys)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def bbg_volcurve_parallel(ind, event, edate, numdays, interval, fld_lst, calendar=None, processes=PROCESSES):
+    '''bbg_volcurve with the index members' bars fetched and decoded in
+    worker processes; the curve is summed straight from the shared blocks
+    without building a DataFrame per security.  Like bbg_volcurve, its
+    requests go out in the scheduler's BULK class.'''
+    with blpscheduler.priority(blpscheduler.BULK):
+        sec_list, sdate, ndays = blpfunctions._volcurve_window(ind, edate, numdays, calendar)
+        blocks = get_Bars_parallel(sec_list, event, sdate, edate, interval, ['VOLUME'], processes=processes,
+                                   blocks=True)
+    try:
+        secs, minutes, values, sec_idx = [], [], [], []
+        for block in blocks:
+            local = blpcalendar.localize(block.time, block.keys, np.diff(block.offsets))
+            minutes.append(local.astype('datetime64[m]').astype(np.int64) % 1440)
+            values.append(np.asarray(block.arrays['VOLUME'], dtype=np.float64))
+            sec_idx.append(np.repeat(np.arange(len(secs), len(secs) + len(block.keys)), np.diff(block.offsets)))
+            secs += block.keys
+        if not secs:
+            return blpvolcurve.volume_curve({}, ndays)
+        buckets, sums = blpvolcurve.bucket_sums_arrays(np.concatenate(minutes), np.concatenate(values),
+                                                       np.concatenate(sec_idx), len(secs))
+    finally:
+        for block in blocks:
+            block.close()
+    adv, cumulative = blpvolcurve.curves(sums, ndays)
+    labels = blpvolcurve.bucket_labels(buckets)
+    columns = [stock[:4] for stock in secs]
+    return (pd.Series(adv, index=columns),
+            pd.DataFrame(sums, index=labels, columns=columns),
+            pd.DataFrame(cumulative, index=labels, columns=columns))
@@ -0,0 +1,206 @@
+'''Record live blpapi sessions to files that fakeblpapi can replay.
+
+    BLP_BACKEND=record:/data/blp python job.py      # talk to the terminal and save
+    BLP_BACKEND=replay:/data/blp python job.py      # answer from the saved files
+
+Every request is stored as one JSON file named after a hash of its
+operation and parameters.  The file holds the request and the
+PARTIAL_RESPONSE/RESPONSE/REQUEST_STATUS events that answered it, as plain
+Element trees:
+
+    {'n': name, 'v': scalar}            scalar element
+    {'n': name, 'c': [node, ...]}       sequence / choice
+    {'n': name, 'a': [item, ...]}       array; items are nodes or {'v': scalar}
+
+Datetimes are kept as naive UTC ({'t': iso}), dates as {'d': iso}.  Null
+elements are left out.  Request datetimes are rounded to the second when
+hashing, and false or empty parameters are ignored, so a replayed run
+matches a recording even if its UTC offset was computed a few
+microseconds differently or the terminal filled in schema defaults.
+'''
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+import types
+
+EVENT_TYPES = ['PARTIAL_RESPONSE', 'RESPONSE', 'REQUEST_STATUS']
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _is_element(value):
+    return hasattr(value, 'elements') and hasattr(value, 'isArray')
+
+
+def _scalar(value):
+    if isinstance(value, dt.datetime):
+        if value.tzinfo is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        return {'t': value.strftime(DATETIME_FORMAT)}
+    if isinstance(value, dt.date):
+        return {'d': value.strftime("%Y-%m-%d")}
+    if isinstance(value, dt.time):
+        return {'h': value.strftime("%H:%M:%S.%f")}
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def scalar(value):
+    '''Inverse of the scalar encoding used in recordings.'''
+    if isinstance(value, dict):
+        if 't' in value:
+            return dt.datetime.strptime(value['t'], DATETIME_FORMAT)
+        if 'd' in value:
+            return dt.datetime.strptime(value['d'], "%Y-%m-%d").date()
+        if 'h' in value:
+            return dt.datetime.strptime(value['h'], "%H:%M:%S.%f").time()
+    return value
+
+
+def encode(element):
+    '''Element tree -> JSON-able node.'''
+    node = {'n': str(element.name())}
+    if element.isArray():
+        node['a'] = [encode(v) if _is_element(v) else {'v': _scalar(v)} for v in element.values()]
+    elif element.isComplexType():
+        node['c'] = [encode(c) for c in element.elements() if c.numValues()]
+    else:
+        node['v'] = _scalar(element.getValue())
+    return node
+
+
+def _canonical(node):
+    # what a request is matched on: children in name order, datetimes to the second
+    if isinstance(node, list):
+        return [_canonical(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    if 't' in node:
+        t = scalar(node) + dt.timedelta(microseconds=500000)
+        return {'t': t.strftime("%Y-%m-%dT%H:%M:%S")}
+    out = dict((k, _canonical(v)) for k, v in node.items())
+    if 'c' in out:
+        # schema defaults (false / empty) may or may not be set explicitly
+        out['c'] = sorted([c for c in out['c'] if not _unset(c.get('v', 0))], key=lambda c: c['n'])
+    return out
+
+
+def _unset(value):
+    return value is None or value is False or value == ''
+
+
+def request_key(request):
+    '''File name stem for a blpapi Request.'''
+    text = json.dumps(_canonical(encode(request.asElement())), sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def load(directory, request):
+    '''The recording answering `request` as [(event type name, [(message type,
+    element node)])], or None when it was not recorded.'''
+    try:
+        with open(os.path.join(directory, request_key(request) + '.json')) as f:
+            record = json.load(f)
+    except (IOError, OSError):
+        return None
+    return [(e['type'], [(m['type'], m['element']) for m in e['messages']]) for e in record['events']]
+
+
+class Recorder(object):
+    '''Collects the events answering each request sent on recording sessions
+    and writes one file per request once its final event has arrived.'''
+
+    def __init__(self, blpapi, directory):
+        self.blpapi = blpapi
+        self.directory = directory
+        self.written = 0
+        self._open = {}     # (id of the session, correlation id value) -> record
+        self._lock = threading.Lock()
+        self._types = dict((getattr(blpapi.Event, name), name) for name in EVENT_TYPES)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def sent(self, session, request, cid):
+        # every session numbers its correlation ids afresh, so they are kept per session
+        record = {'key': request_key(request), 'request': encode(request.asElement()), 'events': []}
+        with self._lock:
+            self._open[(id(session), cid.value())] = record
+
+    def received(self, session, event):
+        name = self._types.get(event.eventType())
+        if name is None:
+            return
+        grouped = []
+        with self._lock:
+            for msg in event:
+                cids = msg.correlationIds()
+                value = (id(session), cids[0].value()) if cids else None
+                record = self._open.get(value)
+                if record is None:
+                    continue
+                if not grouped or grouped[-1][0] is not record:
+                    grouped.append((record, value, []))
+                grouped[-1][2].append({'type': str(msg.messageType()), 'element': encode(msg.asElement())})
+            done = []
+            for record, value, messages in grouped:
+                record['events'].append({'type': name, 'messages': messages})
+                if name != 'PARTIAL_RESPONSE' and self._open.pop(value, None) is not None:
+                    done.append(record)
+        for record in done:
+            self._write(record)
+
+    def _write(self, record):
+        path = os.path.join(self.directory, record['key'] + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.rename(path + '.tmp', path)
+        self.written += 1
+
+
+class RecordingSession(object):
+    '''blpapi.Session that passes every request and response through a Recorder.'''
+
+    def __init__(self, recorder, options=None, eventHandler=None):
+        self._recorder = recorder
+        if eventHandler is None:
+            self._session = recorder.blpapi.Session(options)
+        else:
+            def handler(event, session):
+                recorder.received(self, event)
+                eventHandler(event, self)
+            self._session = recorder.blpapi.Session(options, handler)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        if correlationId is None:
+            correlationId = self._recorder.blpapi.CorrelationId(id(request))
+        self._recorder.sent(self, request, correlationId)
+        return self._session.sendRequest(request, identity, correlationId, eventQueue, requestLabel)
+
+    def nextEvent(self, timeout=0):
+        ev = self._session.nextEvent(timeout)
+        self._recorder.received(self, ev)
+        return ev
+
+    def tryNextEvent(self):
+        ev = self._session.tryNextEvent()
+        if ev is not None:
+            self._recorder.received(self, ev)
+        return ev
+
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def module(blpapi, directory):
+    '''A copy of the `blpapi` module whose Sessions record into `directory`.'''
+    recorder = Recorder(blpapi, directory)
+    wrapped = types.ModuleType('blpapi')
+    wrapped.__dict__.update(blpapi.__dict__)
+    wrapped.Session = lambda options=None, eventHandler=None: RecordingSession(recorder, options, eventHandler)
+    wrapped.recorder = recorder
+    return wrapped
@@ -0,0 +1,315 @@
+'''Priority, rate limits and retries for every request sent to the terminal.
+
+PooledSession.pipeline, which all the get_* functions send through, takes a
+slot from the module-level `scheduler` before every sendRequest and gives it
+back on the final response.  A slot needs
+
+    a token from a token bucket refilled at `rate` requests a second and
+        holding at most `burst` (no limit when rate is None), and
+    a place under the concurrency cap, across all threads and sessions:
+        max_concurrent (None for none), lowered further while the terminal
+        is throttling (see below).
+
+Waiting callers are served by priority class, then in arrival order, so a
+get_Hist lookup goes ahead of the bars still queued by a bbg_volcurve run:
+
+    INTERACTIVE   ReferenceDataRequest, HistoricalDataRequest, get_index
+    NORMAL        everything else
+    BULK          bbg_volcurve, bbg_volcurve_state, bbg_volcurve_roll,
+                  blppool.bbg_volcurve_parallel (in its workers too)
+
+A thread can set its class with `with priority(BULK): ...`, and pipeline()
+takes one explicitly.  A RESPONSE whose responseError has a transient
+category (RETRY_CATEGORIES, less FINAL_SUBCATEGORIES such as the daily
+capacity) is sent again after a jittered exponential backoff, up to
+`retries` times, before the caller sees the error.  A LIMIT error also
+halves the concurrency cap, which then grows back by about one slot per
+cap's worth of successful responses.
+
+    scheduler.configure(rate=50, burst=10, max_concurrent=16)
+    scheduler.snapshot()    # {'queued': {'bulk': 3, ...}, 'in_flight': 16, ...}
+
+Time spent waiting for a slot goes to blpmetrics as the 'queue_wait' phase
+per class, retries and throttled responses to the 'retries' and 'throttled'
+counters per request type, and metrics.prometheus() exports the queue
+depth and the requests in flight as gauges.
+'''
+import contextlib
+import heapq
+import itertools
+import random
+import threading
+
+import blplazy
+
+from blpmetrics import metrics, clock
+
+_names = blplazy.Names(globals(),
+                       RESPONSE_ERROR="responseError",
+                       CATEGORY="category",
+                       SUBCATEGORY="subcategory")
+__getattr__ = _names.getattr
+
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+
+'''Priority class -> name used in metrics and snapshot()'''
+CLASSES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BULK: 'bulk'}
+
+'''Class of a request type when neither the caller nor priority() gives one'''
+DEFAULT_PRIORITY = {'ReferenceDataRequest': INTERACTIVE,
+                    'HistoricalDataRequest': INTERACTIVE}
+
+'''responseError categories worth sending again, and subcategories that are
+not (capacity used up for the day or month will not come back in seconds)'''
+RETRY_CATEGORIES = {'LIMIT', 'TIMEOUT', 'INTERNAL_ERROR'}
+FINAL_SUBCATEGORIES = {'DAILY_CAPACITY_REACHED', 'MONTHLY_CAPACITY_REACHED'}
+
+# adaptive concurrency cap with no max_concurrent is dropped once it grows back to this
+UNCAPPED = 64
+
+'''What configure() changes'''
+SETTINGS = ('rate', 'burst', 'max_concurrent', 'retries', 'backoff', 'max_backoff')
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def priority(level):
+    '''Send this thread's requests in class `level` inside the block.'''
+    previous = getattr(_local, 'level', None)
+    _local.level = level
+    try:
+        yield
+    finally:
+        _local.level = previous
+
+
+def level():
+    '''Class set by this thread's innermost priority() block, or None.'''
+    return getattr(_local, 'level', None)
+
+
+def current(kind=''):
+    '''Class of a request of type `kind` sent now from this thread.'''
+    set_level = level()
+    return DEFAULT_PRIORITY.get(kind, NORMAL) if set_level is None else set_level
+
+
+def error_category(msg):
+    '''(category, subcategory) of msg's responseError, or None without one.'''
+    if not msg.hasElement(RESPONSE_ERROR):
+        return None
+    error = msg.getElement(RESPONSE_ERROR)
+    return tuple(error.getElementAsString(name) if error.hasElement(name) else ''
+                 for name in (CATEGORY, SUBCATEGORY))
+
+
+def transient(category):
+    '''Whether an error_category() result is worth retrying.'''
+    return (category is not None and category[0] in RETRY_CATEGORIES
+            and category[1] not in FINAL_SUBCATEGORIES)
+
+
+class Scheduler(object):
+    '''Slots for requests: token bucket, concurrency cap and priority queue.
+
+    acquire() and release() bracket every request; backoff_delay() gives retry
+    delays, throttled()/succeeded() drive the adaptive cap.  Slots taken for
+    an `owner` (pipeline() passes its thread) are counted per owner, so that
+    a thread already holding some is never made to wait on itself.'''
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None, retries=3, backoff=0.5, max_backoff=30.0):
+        self._cond = threading.Condition()
+        self._waiting = []          # heap of (class, arrival) blocked in acquire()
+        self._arrivals = itertools.count()
+        self._random = random.Random()
+        self.in_flight = 0
+        self._held = {}             # owner -> slots it holds
+        self.limit = None           # adaptive cap while throttled, else None
+        self.tokens = 0.0
+        self._refilled = clock()
+        self.stats = {'granted': 0, 'retries': 0, 'throttled': 0}
+        self.rate = self.burst = self.max_concurrent = None
+        self.configure(rate=rate, burst=burst, max_concurrent=max_concurrent, retries=retries,
+                       backoff=backoff, max_backoff=max_backoff)
+
+    def configure(self, **settings):
+        '''Change rate, burst, max_concurrent, retries, backoff (first retry
+        delay, seconds) or max_backoff; waiting callers see the new limits.'''
+        with self._cond:
+            for name, value in settings.items():
+                if name not in SETTINGS:
+                    raise TypeError("Unknown scheduler setting %r" % name)
+                setattr(self, name, value)
+            if self.rate is not None and self.burst is None:
+                self.burst = max(1.0, float(self.rate))
+            if 'rate' in settings or 'burst' in settings:
+                self.tokens = float(self.burst or 0)
+                self._refilled = clock()
+            if 'max_concurrent' in settings:
+                self.limit = None
+            self._cond.notify_all()
+
+    def settings(self):
+        '''{setting: value} of everything configure() takes.'''
+        return dict((name, getattr(self, name)) for name in SETTINGS)
+
+    def share(self, n):
+        '''settings() for each of n processes that together keep to this
+        scheduler's limits: rate and burst divided by n, and max_concurrent
+        too, rounded down (n should not exceed it).'''
+        settings = self.settings()
+        if self.rate is not None:
+            settings['rate'] = float(self.rate) / n
+            settings['burst'] = max(1.0, float(self.burst) / n)
+        if self.max_concurrent is not None:
+            settings['max_concurrent'] = max(1, self.max_concurrent // n)
+        return settings
+
+    def _cap(self):
+        caps = [c for c in (self.max_concurrent, self.limit) if c is not None]
+        return min(caps) if caps else None
+
+    def _delay(self, now, capped=True):
+        # seconds until a slot could be free, 0 if one is, None if only a release frees one
+        cap = self._cap()
+        if capped and cap is not None and self.in_flight >= cap:
+            return None
+        if self.rate is None:
+            return 0.0
+        self.tokens = min(float(self.burst), self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def _grant(self, level, waited, owner):
+        self.in_flight += 1
+        if owner is not None:
+            self._held[owner] = self._held.get(owner, 0) + 1
+        if self.rate is not None:
+            self.tokens -= 1
+        self.stats['granted'] += 1
+        metrics.observe('queue_wait', CLASSES.get(level, str(level)), waited)
+
+    def acquire(self, level=NORMAL, block=True, since=None, owner=None):
+        '''Take a slot for a request of class `level`.  With block, waits
+        behind every caller of the same or a higher class; without, returns
+        False at once if it would have to.  `since` is when the caller first
+        asked (for queue_wait), if that was in an earlier call.
+
+        A blocking call for an `owner` that holds slots already waits only
+        for a rate token, not for the cap or the queue: the slots it would
+        wait on are its own (e.g. a get_Bars inside an iter_Ticks loop,
+        whose request stays in flight while the generator is suspended).'''
+        with self._cond:
+            now = clock()
+            since = now if since is None else since
+            if not block:
+                if (self._waiting and self._waiting[0][0] <= level) or self._delay(now) != 0:
+                    return False
+                self._grant(level, now - since, owner)
+                return True
+            if self._held.get(owner):
+                delay = self._delay(now, capped=False)
+                while delay:
+                    self._cond.wait(delay)
+                    now = clock()
+                    delay = self._delay(now, capped=False)
+                self._grant(level, now - since, owner)
+                return True
+            entry = (level, next(self._arrivals))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    delay = self._delay(now)
+                    if self._waiting[0] == entry and delay == 0:
+                        break
+                    self._cond.wait(delay if self._waiting[0] == entry else None)
+                    now = clock()
+                heapq.heappop(self._waiting)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            self._grant(level, now - since, owner)
+            self._cond.notify_all()
+            return True
+
+    def release(self, n=1, owner=None):
+        '''Give back the slots of n finished (or abandoned) requests, taken
+        for `owner`.'''
+        if not n:
+            return
+        with self._cond:
+            self.in_flight -= n
+            if owner is not None:
+                self._held[owner] -= n
+                if not self._held[owner]:
+                    del self._held[owner]
+            self._cond.notify_all()
+
+
+    def delay(self):
+        '''Seconds until a non-blocking acquire could succeed (None: not
+        until a request finishes).'''
+        with self._cond:
+            return self._delay(clock())
+
+    def backoff_delay(self, attempt):
+        '''Seconds to wait before retry number `attempt` (0 for the first):
+        the exponential delay capped at max_backoff, half of it jittered.'''
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + self._random.uniform(0, delay / 2)
+
+    def throttled(self, kind=''):
+        '''The terminal refused a request for load (before its slot is
+        released): halve the cap to what was in flight.'''
+        with self._cond:
+            self.stats['throttled'] += 1
+            self.limit = max(1.0, self.in_flight / 2.0)
+        metrics.incr('throttled', kind)
+
+    def succeeded(self):
+        '''A request completed: let a lowered cap grow back.'''
+        if self.limit is None:
+            return
+        with self._cond:
+            if self.limit is None:
+                return
+            self.limit += 1.0 / self.limit
+            ceiling = UNCAPPED if self.max_concurrent is None else self.max_concurrent
+            if self.limit >= ceiling:
+                self.limit = None
+            self._cond.notify_all()
+
+    def retried(self, kind=''):
+        with self._cond:
+            self.stats['retries'] += 1
+        metrics.incr('retries', kind)
+
+    def snapshot(self):
+        '''Queue depth per class, requests in flight, the current cap and tokens.'''
+        with self._cond:
+            queued = dict((name, 0) for name in CLASSES.values())
+            for level, _ in self._waiting:
+                name = CLASSES.get(level, str(level))
+                queued[name] = queued.get(name, 0) + 1
+            self._delay(clock())
+            return {'queued': queued, 'in_flight': self.in_flight, 'cap': self._cap(),
+                    'tokens': self.tokens if self.rate is not None else None,
+                    'stats': dict(self.stats)}
+
+
+scheduler = Scheduler()
+
+
+def _queue_depth():
+    return scheduler.snapshot()['queued']
+
+
+def _in_flight():
+    return {'': scheduler.in_flight}
+
+
+metrics.gauges['queue_depth'] = ('class', _queue_depth)
+metrics.gauges['in_flight'] = ('request', _in_flight)
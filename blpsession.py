@@ -0,0 +1,314 @@
+'''Long-lived blpapi sessions shared by the get_* functions.
+
+Starting a session and opening //blp/refdata costs more than most small
+requests, so sessions are started lazily, kept in a small pool, and handed
+out with borrow().  Service handles are cached per session.  A session that
+reports SessionTerminated (or fails its health check) is dropped and a fresh
+one is started on the next borrow.  Session start, service open and
+per-request latencies and message counts are recorded in blpmetrics.metrics.
+Every request sent through pipeline() takes a blpscheduler slot first.
+'''
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+import blpbackend
+import blplazy
+import blpscheduler
+
+from blpmetrics import metrics, clock, request_type
+
+blpapi = blplazy.module('blpapi')
+
+_names = blplazy.Names(globals(),
+                       SESSION_STARTED="SessionStarted",
+                       SESSION_TERMINATED="SessionTerminated",
+                       SESSION_STARTUP_FAILURE="SessionStartupFailure",
+                       SESSION_CONNECTION_DOWN="SessionConnectionDown",
+                       DEAD_SESSION=("SessionTerminated", "SessionStartupFailure", "SessionConnectionDown"))
+__getattr__ = _names.getattr
+
+_options = None
+
+# Requests outstanding at once in pipeline(); keep under the terminal's throttle
+MAX_IN_FLIGHT = 8
+
+# nextEvent timeout (ms) in pipeline() while sends wait for a scheduler slot
+POLL = 10
+
+
+class SessionTerminatedError(RuntimeError):
+    pass
+
+
+def default_options():
+    '''The SessionOptions (localhost:8194) of managers created without any,
+    built on first use and shared, so changes to it apply to them all.'''
+    global _options
+    if _options is None:
+        _options = blpapi.SessionOptions()
+        _options.setServerHost('localhost')
+        _options.setServerPort(8194)
+    return _options
+
+
+class PooledSession(object):
+    '''A started blpapi.Session plus its cache of opened services.'''
+
+    def __init__(self, options):
+        blplazy.resolve()
+        self.session = blpapi.Session(options)
+        self.services = {}
+        self.alive = False
+        self.started_at = None
+        self.last_used = None
+        self._cids = itertools.count(1)
+        self.holder = None
+
+    def start(self):
+        with metrics.timer('session_start'):
+            started = self.session.start()
+        if not started:
+            raise SessionTerminatedError("Failed to start session.")
+        self.alive = True
+        self.started_at = self.last_used = time.time()
+
+    def stop(self):
+        self.alive = False
+        self.services.clear()
+        try:
+            self.session.stop()
+        except Exception:
+            pass
+
+    def getService(self, name):
+        service = self.services.get(name)
+        if service is None:
+            with metrics.timer('service_open'):
+                opened = self.session.openService(name)
+            if not opened:
+                raise SessionTerminatedError("Failed to open %s" % name)
+            service = self.services[name] = self.session.getService(name)
+        return service
+
+    def sendRequest(self, request, correlationId=None):
+        self.last_used = time.time()
+        return self.session.sendRequest(request, correlationId=correlationId)
+
+    def nextEvent(self, timeout=0):
+        ev = self.session.nextEvent(timeout)
+        self._check(ev)
+        return ev
+
+    def pipeline(self, requests, max_in_flight=MAX_IN_FLIGHT, timeout=500, priority=None):
+        '''Send (key, request) pairs with at most max_in_flight outstanding.
+
+        Each request is tagged with its own CorrelationId; yields
+        (key, msg, done) for every PARTIAL_RESPONSE/RESPONSE message in the
+        order they arrive, with done set on the final message of a request.
+        A request that fails with a REQUEST_STATUS event is simply completed.
+
+        Every send first takes a blpscheduler slot in class `priority`
+        (blpscheduler.current() of the request type by default).  A request
+        answered with nothing but a transient responseError is sent again
+        after a backoff instead of being yielded, until the scheduler's
+        retries run out.
+        '''
+        scheduler = blpscheduler.scheduler
+        owner = threading.get_ident()   # slots held by this thread, see Scheduler.acquire
+        pending = [(key, request, 0) for key, request in requests][::-1]
+        retry = []      # heap of (due, order, key, request, attempt)
+        order = itertools.count()
+        in_flight = {}
+        sent = {}       # correlation id value -> [request type, send time, first response seen, request, attempt]
+        asked = None    # when the scheduler first refused the next send
+        try:
+            while pending or in_flight or retry:
+                while retry and retry[0][0] <= clock():
+                    pending.append(heapq.heappop(retry)[2:])
+                while pending and len(in_flight) < max_in_flight:
+                    key, request, attempt = pending[-1]
+                    kind = request_type(request)
+                    level = blpscheduler.current(kind) if priority is None else priority
+                    if not scheduler.acquire(level, block=not in_flight, since=asked, owner=owner):
+                        asked = asked if asked is not None else clock()
+                        break
+                    asked = None
+                    pending.pop()
+                    cid = blpapi.CorrelationId(next(self._cids))
+                    in_flight[cid.value()] = key
+                    sent[cid.value()] = [kind, clock(), False, request, attempt]
+                    self.sendRequest(request, cid)
+                if not in_flight:
+                    if retry and not pending:
+                        time.sleep(max(0.0, retry[0][0] - clock()))
+                    continue
+                # while sends are held back, look for a free slot again soon
+                ev = self.nextEvent(timeout if not pending and not retry else POLL)
+                evtype = ev.eventType()
+                if evtype not in (blpapi.Event.PARTIAL_RESPONSE, blpapi.Event.RESPONSE,
+                                  blpapi.Event.REQUEST_STATUS):
+                    continue
+                for msg in ev:
+                    cids = msg.correlationIds()
+                    if not cids or cids[0].value() not in in_flight:
+                        continue    # left over from an abandoned request
+                    value = cids[0].value()
+                    done = evtype != blpapi.Event.PARTIAL_RESPONSE
+                    key = in_flight.pop(value) if done else in_flight[value]
+                    timing = sent.pop(value) if done else sent[value]
+                    kind, elapsed = timing[0], clock() - timing[1]
+                    if done and evtype == blpapi.Event.RESPONSE and not timing[2]:
+                        category = blpscheduler.error_category(msg)
+                        if blpscheduler.transient(category) and timing[4] < scheduler.retries:
+                            if category[0] == 'LIMIT':
+                                scheduler.throttled(kind)
+                            scheduler.release(owner=owner)
+                            scheduler.retried(kind)
+                            heapq.heappush(retry, (clock() + scheduler.backoff_delay(timing[4]), next(order),
+                                                   key, timing[3], timing[4] + 1))
+                            continue
+                    if done:
+                        scheduler.release(owner=owner)
+                        scheduler.succeeded()
+                    if evtype == blpapi.Event.REQUEST_STATUS:
+                        metrics.incr('failures', kind)
+                    else:
+                        metrics.incr('messages', kind)
+                        if not timing[2]:
+                            timing[2] = True
+                            metrics.observe('first_response', kind, elapsed)
+                    if done:
+                        metrics.observe('request', kind, elapsed)
+                        metrics.incr('requests', kind)
+                    if evtype != blpapi.Event.REQUEST_STATUS:
+                        yield key, msg, done
+        finally:
+            # slots of requests abandoned by the caller or an error
+            scheduler.release(len(in_flight), owner)
+
+
+    def _check(self, ev):
+        if ev.eventType() == blpapi.Event.SESSION_STATUS:
+            for msg in ev:
+                if msg.messageType() in DEAD_SESSION:
+                    self.alive = False
+                    raise SessionTerminatedError(str(msg.messageType()))
+
+    def healthy(self):
+        '''Drain queued admin events left over from earlier use and report
+        whether the session is still connected.'''
+        if not self.alive:
+            return False
+        try:
+            while True:
+                ev = self.session.tryNextEvent()
+                if ev is None:
+                    break
+                self._check(ev)
+        except SessionTerminatedError:
+            return False
+        return True
+
+
+class SessionManager(object):
+    '''Pool of up to `size` lazily started sessions.
+
+        with manager.borrow() as session:
+            service = session.getService("//blp/refdata")
+            session.sendRequest(request)
+            ev = session.nextEvent(500)
+
+    A borrowed session is used by one caller at a time; borrow() blocks while
+    all `size` sessions are out.  A thread that already holds a session (e.g.
+    while consuming an iter_* generator) gets an extra one instead of waiting
+    on itself.
+    '''
+
+    def __init__(self, options=None, size=1):
+        self.options = options
+        self.size = size
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+        self._holders = {}
+        self.stats = {'starts': 0, 'borrows': 0, 'reconnects': 0, 'waits': 0}
+
+    @contextlib.contextmanager
+    def borrow(self):
+        pooled = self._acquire()
+        try:
+            yield pooled
+        except GeneratorExit:
+            # an iter_* loop left early: the session is fine, and pipeline()
+            # skips the events still to come for the requests it abandoned
+            raise
+        except BaseException:
+
+            # The session may still hold events for an abandoned request (or
+            # be dead already); drop it rather than hand it to the next caller.
+            pooled.alive = False
+            raise
+        finally:
+            self._release(pooled)
+
+    def _acquire(self):
+        me = threading.current_thread().ident
+        with self._cond:
+            while not self._idle and self._count >= self.size and not self._holders.get(me):
+                self.stats['waits'] += 1
+                self._cond.wait()
+            self.stats['borrows'] += 1
+            self._holders[me] = self._holders.get(me, 0) + 1
+            if self._idle:
+                pooled = self._idle.pop()
+            else:
+                pooled = None
+                self._count += 1
+        if pooled is not None:
+            if pooled.healthy():
+                pooled.holder = me
+                return pooled
+            pooled.stop()
+            self.stats['reconnects'] += 1
+        try:
+            pooled = self._start()
+            pooled.holder = me
+            return pooled
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._unhold(me)
+                self._cond.notify()
+            raise
+
+    def _start(self):
+        pooled = PooledSession(self.options if self.options is not None else default_options())
+        pooled.start()
+        self.stats['starts'] += 1
+        return pooled
+
+    def _release(self, pooled):
+        with self._cond:
+            self._unhold(pooled.holder)
+            if pooled.alive and self._count <= self.size:
+                self._idle.append(pooled)
+            else:
+                pooled.stop()
+                self._count -= 1
+            self._cond.notify()
+
+    def _unhold(self, me):
+        self._holders[me] -= 1
+        if not self._holders[me]:
+            del self._holders[me]
+
+    def stop(self):
+        '''Stop every idle session; borrowed ones are stopped on release.'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for pooled in idle:
+            pooled.stop()
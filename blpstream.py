@@ -0,0 +1,180 @@
+'''Real-time subscriptions on //blp/mktdata.
+
+A MarketData object owns an asynchronous blpapi session whose event handler
+runs on the API's dispatcher thread.  Each update is written into a
+preallocated per-security RingBuffer of typed arrays; that thread is the
+only writer.  Readers (snapshot, last, bars) never take a lock: they copy
+what they need and then discard any rows the writer may have overwritten
+while they were copying, so the dispatcher is never held up by a reader.
+'''
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import blpbackend
+import blpapi
+
+SESSION_STARTED = blpapi.Name("SessionStarted")
+SESSION_TERMINATED = blpapi.Name("SessionTerminated")
+SUBSCRIPTION_FAILURE = blpapi.Name("SubscriptionFailure")
+SUBSCRIPTION_TERMINATED = blpapi.Name("SubscriptionTerminated")
+
+DEFAULT_FIELDS = ['LAST_PRICE', 'SIZE_LAST_TRADE', 'BID', 'ASK']
+CAPACITY = 65536
+
+
+class RingBuffer(object):
+    '''Last `capacity` updates of one security: int64 receive times (ns since
+    the epoch) and a float64 column per field (NaN where an update did not
+    carry the field), plus the latest value seen for every field.
+
+    Single writer; `count` is only advanced after a row is complete.'''
+
+    def __init__(self, fields, capacity=CAPACITY):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(self.fields)), np.nan)
+        self.latest = np.full(len(self.fields), np.nan)
+        self.count = 0
+
+    def last(self, n=None):
+        '''(times, values) copies of up to the last n rows, oldest first.'''
+        end = self.count
+        n = min(end, self.capacity) if n is None else min(n, end, self.capacity)
+        idx = np.arange(end - n, end) % self.capacity
+        times = self.time[idx]
+        values = self.values[idx]
+        # rows the writer wrapped onto while we copied are no longer valid
+        first_valid = self.count - self.capacity + 1
+        skip = max(0, first_valid - (end - n))
+        return times[skip:], values[skip:]
+
+
+class MarketData(object):
+    '''Subscribe to //blp/mktdata and keep a ring buffer per security.
+
+        md = MarketData(['6758 JT Equity', '7203 JT Equity'])
+        md.start()
+        md.snapshot()                       # latest value of every field
+        md.last('6758 JT Equity', 100)      # last 100 updates
+        md.bars('6758 JT Equity', 60)       # last 60 one-second bars
+        md.stop()
+    '''
+
+    def __init__(self, secs=(), fields=DEFAULT_FIELDS, capacity=CAPACITY, options=None):
+        if options is None:
+            options = blpapi.SessionOptions()
+            options.setServerHost('localhost')
+            options.setServerPort(8194)
+        self.options = options
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.rings = {}
+        self._cids = {}
+        self._secs = list(secs)
+        self._names = [blpapi.Name(f) for f in self.fields]
+        self._started = threading.Event()
+        self.session = None
+        self.stats = {'events': 0, 'messages': 0, 'failures': 0}
+
+    def start(self, timeout=10):
+        self.session = blpapi.Session(self.options, self._handle)
+        self.session.startAsync()
+        if not self._started.wait(timeout):
+            raise RuntimeError("Failed to start session.")
+        if self._secs:
+            self.subscribe(self._secs)
+        return self
+
+    def stop(self):
+        if self.session is not None:
+            self.session.stop()
+            self.session = None
+        self._started.clear()
+
+    def subscribe(self, secs):
+        subscriptions = blpapi.SubscriptionList()
+        for sec in secs:
+            if sec in self.rings:
+                continue
+            # the ring must exist before the first update can arrive
+            cid = blpapi.CorrelationId(len(self._cids) + 1)
+            ring = RingBuffer(self.fields, self.capacity)
+            self.rings[sec] = ring
+            self._cids[cid.value()] = ring
+            subscriptions.add(sec, self.fields, "", cid)
+        if subscriptions.size():
+            self.session.subscribe(subscriptions)
+
+    def _handle(self, event, session):
+        # Runs on the dispatcher thread: the only writer to the rings.
+        evtype = event.eventType()
+        if evtype == blpapi.Event.SUBSCRIPTION_DATA:
+            now = int(time.time() * 1e9)
+            names = self._names
+            nmsgs = 0
+            for msg in event:
+                ring = self._cids.get(msg.correlationIds()[0].value())
+                if ring is None:
+                    continue
+                i = ring.count % ring.capacity
+                row = ring.values[i]
+                row.fill(np.nan)
+                latest = ring.latest
+                for j, name in enumerate(names):
+                    if msg.hasElement(name):
+                        row[j] = latest[j] = msg.getElementAsFloat(name)
+                ring.time[i] = now
+                ring.count += 1
+                nmsgs += 1
+            self.stats['events'] += 1
+            self.stats['messages'] += nmsgs
+        elif evtype == blpapi.Event.SUBSCRIPTION_STATUS:
+            for msg in event:
+                if msg.messageType() in (SUBSCRIPTION_FAILURE, SUBSCRIPTION_TERMINATED):
+                    self.stats['failures'] += 1
+        elif evtype == blpapi.Event.SESSION_STATUS:
+            for msg in event:
+                if msg.messageType() == SESSION_STARTED:
+                    self._started.set()
+                elif msg.messageType() == SESSION_TERMINATED:
+                    self._started.clear()
+
+    def snapshot(self, secs=None):
+        '''Latest value of every field, one row per security.'''
+        secs = list(self.rings) if secs is None else list(secs)
+        return pd.DataFrame([self.rings[s].latest.copy() for s in secs],
+                            index=secs, columns=self.fields)
+
+    def last(self, sec, n=None):
+        '''Last n updates of `sec` (all buffered ones by default), oldest first.'''
+        times, values = self.rings[sec].last(n)
+        return pd.DataFrame(values, index=pd.to_datetime(times), columns=self.fields)
+
+    def bars(self, sec, n=60, seconds=1, price='LAST_PRICE', size='SIZE_LAST_TRADE'):
+        '''Live OHLC/volume/count bars of `seconds` over the trades in the
+        buffer, for the last n bar periods up to now.'''
+        ring = self.rings[sec]
+        times, values = ring.last()
+        period = int(seconds * 1e9)
+        now = int(time.time() * 1e9) // period * period
+        px = values[:, self.fields.index(price)]
+        qty = values[:, self.fields.index(size)] if size in self.fields else np.ones(len(px))
+        keep = (times >= now - (n - 1) * period) & ~np.isnan(px)
+        times, px, qty = times[keep], px[keep], np.nan_to_num(qty[keep])
+        columns = ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOLUME', 'numEvents']
+        if not len(times):
+            return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([]))
+        bucket = times // period * period
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], len(bucket)]
+        return pd.DataFrame({'OPEN': px[starts],
+                             'HIGH': np.maximum.reduceat(px, starts),
+                             'LOW': np.minimum.reduceat(px, starts),
+                             'CLOSE': px[ends - 1],
+                             'VOLUME': np.add.reduceat(qty, starts),
+                             'numEvents': ends - starts},
+                            index=pd.to_datetime(bucket[starts]), columns=columns)
@@ -0,0 +1,109 @@
+'''Compact in-memory store for intraday ticks.
+
+A TickStore holds one security's ticks as four typed arrays: int64 UTC
+nanosecond timestamps (sorted), uint8 event-type codes into `types`,
+float64 prices and int32 sizes, i.e. 21 bytes a tick instead of a Python
+string object per row.  between() slices by time with searchsorted and
+returns views; of_type() views come from a one-off regrouping by type.
+frame() and arrow() build a pandas DataFrame or a pyarrow Table on demand,
+with the event type as a categorical / dictionary column.
+'''
+import blplazy
+
+np = blplazy.module('numpy')
+pd = blplazy.module('pandas')
+
+'''Event types of IntradayTickRequest, in code order; others are appended per store'''
+TICK_TYPES = ['TRADE', 'BID', 'ASK', 'BID_BEST', 'ASK_BEST', 'MID_PRICE',
+              'AT_TRADE', 'BEST_BID', 'BEST_ASK']
+
+
+'''Tick columns as read back from the disk cache for a store: types stay
+fixed-width strings instead of becoming Python objects'''
+CACHE_COLUMNS = [('size', 'int64'), ('price', 'float64'), ('type', 'U')]
+
+
+def _ns(t):
+    '''datetime-like (naive means UTC) -> int64 ns since the epoch'''
+    t = pd.Timestamp(t)
+    if t.tzinfo is not None:
+        t = t.tz_convert('UTC').tz_localize(None)
+    return t.value
+
+
+class TickStore(object):
+    def __init__(self, time, type, price, size, types=TICK_TYPES):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.type = np.asarray(type, dtype=np.uint8)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.size = np.asarray(size, dtype=np.int32)
+        self.types = list(types)
+        self._by_type = None
+
+    @classmethod
+    def from_columns(cls, cols):
+        '''Build from blpdecode.Columns of TICK_COLUMNS (UTC times).'''
+        names = np.asarray(cols.column('type'))
+        types = list(TICK_TYPES)
+        if len(names):
+            found, inverse = np.unique(names.astype('U'), return_inverse=True)
+            for name in found:
+                if name not in types:
+                    types.append(name)
+            if len(types) > 256:
+                raise ValueError("More than 256 tick types")
+            codes = np.array([types.index(name) for name in found], dtype=np.uint8)[inverse.ravel()]
+        else:
+            codes = np.empty(0, dtype=np.uint8)
+        return cls(cols.times().astype('datetime64[ns]').astype(np.int64), codes,
+                   cols.column('price'), cols.column('size'), types)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + self.type.nbytes + self.price.nbytes + self.size.nbytes
+
+    def _slice(self, lo, hi):
+        return TickStore(self.time[lo:hi], self.type[lo:hi], self.price[lo:hi], self.size[lo:hi], self.types)
+
+    def between(self, start=None, end=None):
+        '''Ticks with start <= time < end, as views into this store.'''
+        lo = 0 if start is None else np.searchsorted(self.time, _ns(start), 'left')
+        hi = len(self.time) if end is None else np.searchsorted(self.time, _ns(end), 'left')
+        return self._slice(lo, max(lo, hi))
+
+    def of_type(self, name):
+        '''Ticks of one event type (e.g. 'TRADE'), in time order.  The first
+        call regroups the store by type once; every type is then a view.'''
+        if self._by_type is None:
+            order = np.argsort(self.type, kind='mergesort')
+            grouped = TickStore(self.time[order], self.type[order], self.price[order],
+                                self.size[order], self.types)
+            bounds = np.searchsorted(grouped.type, np.arange(len(self.types) + 1))
+            self._by_type = dict((t, grouped._slice(bounds[i], bounds[i + 1]))
+                                 for i, t in enumerate(self.types))
+        if name not in self._by_type:
+            return self._slice(0, 0)
+        return self._by_type[name]
+
+    def times(self, tz='UTC'):
+        '''DatetimeIndex of the ticks in `tz` (None for naive UTC).'''
+        index = pd.DatetimeIndex(self.time.view('datetime64[ns]'))
+        return index if tz is None else index.tz_localize('UTC').tz_convert(tz)
+
+    def frame(self, tz='UTC'):
+        '''DataFrame of size/price/type indexed by time, type categorical.'''
+        return pd.DataFrame({'size': self.size, 'price': self.price,
+                             'type': pd.Categorical.from_codes(self.type, self.types)},
+                            index=self.times(tz), columns=['size', 'price', 'type'])
+
+    def arrow(self, tz='UTC'):
+        '''pyarrow Table with a timestamp[ns] column and a dictionary-encoded type.'''
+        import pyarrow as pa
+        return pa.Table.from_arrays(
+            [pa.array(self.time, type=pa.int64()).cast(pa.timestamp('ns', tz=tz)),
+             pa.DictionaryArray.from_arrays(pa.array(self.type), pa.array(self.types)),
+             pa.array(self.price), pa.array(self.size)],
+            names=['time', 'type', 'price', 'size'])
@@ -0,0 +1,152 @@
+'''Volume-curve maths over already fetched bars.
+
+All securities are concatenated once and bucketed by integer minute of day
+taken straight from the datetime64 index; bucket sums come from a single
+bincount over (bucket, security) pairs, so the cost is linear in the number
+of bars rather than quadratic in the number of names.
+'''
+import blpcalendar
+import blplazy
+
+np = blplazy.module('numpy')
+pd = blplazy.module('pandas')
+
+
+def jp_calendar(years):
+    '''CustomBusinessDay over the JP holidays of `years`; the Tokyo
+    exchange's cached calendar (blpcalendar).'''
+    return blpcalendar.EXCHANGES['JT'].calendar(years)
+
+
+def minute_of_day(index):
+    '''Integer minute of day (0-1439) for every timestamp in a DatetimeIndex.'''
+    return np.asarray(index.values.astype('datetime64[m]').astype(np.int64) % 1440)
+
+
+def bucket_labels(buckets):
+    return pd.Index(['%02d:%02d:00' % divmod(int(m), 60) for m in buckets], name='bucket')
+
+
+def bucket_sums(bars, field='VOLUME'):
+    '''Sum `field` per minute-of-day bucket and security.
+
+    bars is {security: DataFrame} as returned by get_Bars_many.  Returns
+    (buckets, securities, sums) with sums a float64 array of shape
+    (len(buckets), len(securities)).'''
+    secs = list(bars)
+    if not secs:
+        return np.empty(0, dtype=np.int64), secs, np.zeros((0, 0))
+    minutes = np.concatenate([minute_of_day(bars[s].index) for s in secs])
+    values = np.concatenate([np.asarray(bars[s][field], dtype=np.float64) for s in secs])
+    sec_idx = np.repeat(np.arange(len(secs)), [len(bars[s]) for s in secs])
+    buckets, sums = bucket_sums_arrays(minutes, values, sec_idx, len(secs))
+    return buckets, secs, sums
+
+
+def bucket_sums_arrays(minutes, values, sec_idx, nsecs):
+    '''bucket_sums over flat arrays: minute of day, value and security number
+    of every bar.  Returns (buckets, sums of shape (len(buckets), nsecs)).'''
+    buckets, bucket_idx = np.unique(minutes, return_inverse=True)
+    sums = np.bincount(bucket_idx.ravel() * nsecs + sec_idx, weights=np.asarray(values, dtype=np.float64),
+                       minlength=len(buckets) * nsecs)
+    return buckets, sums.reshape(len(buckets), nsecs)
+
+
+def curves(sums, ndays):
+    '''(adv, cumulative curves) from bucket sums; a security with no volume
+    at all gets a NaN curve.'''
+    total = sums.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cumulative = np.cumsum(sums, axis=0) / total
+    return total / ndays, cumulative
+
+
+def volume_curve(bars, ndays, field='VOLUME'):
+    '''ADV, per-bucket sums and cumulative volume curves for `bars` spanning
+    `ndays` trading days.  Returns (adv Series, sums DataFrame, curves
+    DataFrame) with one column per security, indexed by 'HH:MM:SS' bucket.'''
+    buckets, secs, sums = bucket_sums(bars, field)
+    adv, cumulative = curves(sums, ndays)
+    labels = bucket_labels(buckets)
+    return (pd.Series(adv, index=secs),
+            pd.DataFrame(sums, index=labels, columns=secs),
+            pd.DataFrame(cumulative, index=labels, columns=secs))
+
+
+class VolumeCurve(object):
+    '''Rolling `ndays` volume curve updated one day at a time.
+
+    Keeps running per-bucket sums per security plus each day's own
+    contribution, so add_day() only adds the new day and subtracts the
+    oldest: O(buckets x names) instead of a re-fetch and regroup of the
+    whole window.
+
+        curve = VolumeCurve.from_bars(get_Bars_many(secs, ...), 20)
+        curve.add_day(get_Bars_many(secs, <today>, ...))
+        adv, sums, curves = curve.result()
+
+    `label` maps security names to output column names.
+    '''
+
+    def __init__(self, ndays, field='VOLUME', label=None):
+        self.ndays = ndays
+        self.field = field
+        self.label = label
+        self.secs = []
+        self._col = {}
+        self.sums = np.zeros((1440, 0))
+        self.present = np.zeros(1440, dtype=np.int64)
+        self.days = []      # [(date, buckets, columns, block)], oldest first
+
+    @classmethod
+    def from_bars(cls, bars, ndays, field='VOLUME', label=None):
+        '''Build from multi-day bars ({security: DataFrame}), one day at a time.'''
+        curve = cls(ndays, field, label)
+        dates = sorted(set(d for df in bars.values() for d in df.index.normalize().unique()))
+        for day in dates:
+            curve.add_day(dict((s, df[df.index.normalize() == day]) for s, df in bars.items()), day)
+        return curve
+
+    def _columns(self, secs):
+        new = [s for s in secs if s not in self._col]
+        if new:
+            for s in new:
+                self._col[s] = len(self.secs)
+                self.secs.append(s)
+            self.sums = np.hstack([self.sums, np.zeros((1440, len(new)))])
+        return np.array([self._col[s] for s in secs], dtype=np.intp)
+
+    def _apply(self, entry, sign):
+        day, buckets, columns, block = entry
+        self.sums[np.ix_(buckets, columns)] += sign * block
+        self.present[buckets] += sign
+
+    def add_day(self, bars, day=None):
+        '''Add one day of bars ({security: DataFrame}); a day already held is
+        replaced, and the oldest day is dropped once more than ndays are held.'''
+        if day is None:
+            day = max(df.index.max() for df in bars.values() if len(df))
+        day = pd.Timestamp(day).normalize()
+        buckets, secs, block = bucket_sums(bars, self.field)
+        entry = (day, buckets, self._columns(secs), block)
+        for i, held in enumerate(self.days):
+            if held[0] == day:
+                self._apply(held, -1)
+                del self.days[i]
+                break
+        self._apply(entry, 1)
+        self.days.append(entry)
+        self.days.sort(key=lambda e: e[0])
+        while len(self.days) > self.ndays:
+            self._apply(self.days.pop(0), -1)
+
+    def result(self):
+        '''(adv, bucket sums, cumulative curves) in the format of volume_curve.'''
+        buckets = np.flatnonzero(self.present)
+        sums = self.sums[buckets]
+        adv, cumulative = curves(sums, max(len(self.days), 1))
+        labels = bucket_labels(buckets)
+        columns = [self.label(s) for s in self.secs] if self.label else list(self.secs)
+        return (pd.Series(adv, index=columns),
+                pd.DataFrame(sums, index=labels, columns=columns),
+                pd.DataFrame(cumulative, index=labels, columns=columns))
@@ -0,0 +1,873 @@
+'''Minimal in-process stand-in for the blpapi module.
+
+Implements just enough of Session/Service/Request/Event/Message/Element to
+drive blpfunctions offline.  Responses are synthetic and deterministic per
+security, so the same request always returns the same data, or with REPLAY
+set are read back from files saved by blprecord.  Handshake and round-trip
+latencies are simulated from the LATENCY table so the cost of session
+start / openService can be measured without a terminal.
+
+Usage:
+    BLP_BACKEND=fake python job.py
+    BLP_BACKEND=replay:/data/blp python job.py
+or
+    import blpbackend
+    blpbackend.use('fake')
+    import blpfunctions
+'''
+import collections
+import datetime as dt
+import heapq
+import itertools
+import math
+import random
+import threading
+import time as _time
+import zlib
+
+import blprecord
+
+'''Simulated latencies in seconds'''
+LATENCY = {'start': 0.05,
+           'openService': 0.02,
+           'request': 0.005}
+
+'''Synthetic data sizes'''
+CONFIG = {'chunk': 1000,            # elements per PARTIAL_RESPONSE message
+          'ticks_per_minute': 30,
+          'hours': (0, 24),         # UTC hours that contain data
+          'mktdata_burst': 0,       # updates per topic, 0 = stream until unsubscribed
+          'mktdata_interval': 0.1}  # seconds between streamed updates
+
+'''Throttling injected into every session, all off by default: at most
+`rate` requests a second (bursts of `burst`) and `max_in_flight` requests
+outstanding across sessions.  Requests over either limit, and an `errors`
+share of the rest, get a lone RESPONSE carrying a responseError of
+`category`/`subcategory` instead of data.'''
+THROTTLE = {'rate': None,
+            'burst': 1,
+            'max_in_flight': None,
+            'errors': 0.0,
+            'category': 'LIMIT',
+            'subcategory': 'TOO_MANY_REQUESTS'}
+
+'''Recorded sessions (see blprecord): a directory to answer requests from,
+and whether a request missing from it is an error instead of synthesized'''
+REPLAY = None
+REPLAY_STRICT = False
+
+'''Counters for benchmarks'''
+STATS = collections.Counter()
+
+
+class Name(object):
+    def __init__(self, s):
+        self._s = str(s)
+
+    def __str__(self):
+        return self._s
+
+    def __repr__(self):
+        return 'Name(%r)' % self._s
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._s)
+
+
+class SessionOptions(object):
+    def __init__(self):
+        self._host = 'localhost'
+        self._port = 8194
+
+    def setServerHost(self, host):
+        self._host = host
+
+    def setServerPort(self, port):
+        self._port = port
+
+    def serverHost(self):
+        return self._host
+
+    def serverPort(self):
+        return self._port
+
+
+class CorrelationId(object):
+    _ids = itertools.count(1)
+
+    def __init__(self, value=None):
+        self._value = next(CorrelationId._ids) if value is None else value
+
+    def value(self):
+        return self._value
+
+    def __eq__(self, other):
+        return isinstance(other, CorrelationId) and self._value == other._value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __repr__(self):
+        return 'CorrelationId(%r)' % (self._value,)
+
+
+class Element(object):
+    def __init__(self, name, value=None, children=None, array=None):
+        self._name = Name(name)
+        self._value = value
+        self._children = collections.OrderedDict()
+        for c in children or []:
+            self._children[str(c._name)] = c
+        self._array = array
+
+    # structure
+    def name(self):
+        return self._name
+
+    def isArray(self):
+        return self._array is not None
+
+    def isComplexType(self):
+        return bool(self._children)
+
+    def numValues(self):
+        if self._array is not None:
+            return len(self._array)
+        return 0 if self._value is None and not self._children else 1
+
+    def numElements(self):
+        return len(self._children)
+
+    def hasElement(self, name, excludeNullElements=False):
+        return str(name) in self._children
+
+    def getElement(self, name):
+        try:
+            return self._children[str(name)]
+        except KeyError:
+            raise NotFoundException('Element %s not found in %s' % (name, self._name))
+
+    def elements(self):
+        return iter(self._children.values())
+
+    def values(self):
+        if self._array is not None:
+            return iter(self._array)
+        return iter([self._value])
+
+    def getValue(self, index=0):
+        if self._array is not None:
+            return self._array[index]
+        return self._value
+
+    def getValueAsString(self, index=0):
+        return _as_string(self.getValue(index))
+
+    def getValueAsFloat(self, index=0):
+        return float(self.getValue(index))
+
+    def getValueAsInteger(self, index=0):
+        return int(self.getValue(index))
+
+    def getValueAsDatetime(self, index=0):
+        return self.getValue(index)
+
+    def getElementValue(self, name):
+        return self.getElement(name).getValue()
+
+    def getElementAsString(self, name):
+        return _as_string(self.getElement(name).getValue())
+
+    def getElementAsFloat(self, name):
+        return float(self.getElement(name).getValue())
+
+    def getElementAsInteger(self, name):
+        return int(self.getElement(name).getValue())
+
+    def getElementAsDatetime(self, name):
+        return self.getElement(name).getValue()
+
+    # request building
+    def setElement(self, name, value):
+        self._child(name)._value = value
+
+    def appendValue(self, value):
+        if self._array is None:
+            self._array = []
+        self._array.append(value)
+
+    def appendElement(self):
+        e = Element('')
+        self.appendValue(e)
+        return e
+
+    def _child(self, name):
+        key = str(name)
+        if key not in self._children:
+            self._children[key] = Element(key)
+        return self._children[key]
+
+    def toPy(self):
+        if self._array is not None:
+            return [v.toPy() if isinstance(v, Element) else v for v in self._array]
+        if self._children:
+            return dict((k, c.toPy()) for k, c in self._children.items())
+        return self._value
+
+    def __str__(self):
+        return '%s = %r' % (self._name, self.toPy())
+
+
+class NotFoundException(Exception):
+    pass
+
+
+def _as_string(value):
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _Row(Element):
+    '''Sequence element of scalar fields; children are only materialised
+    when asked for, which keeps large synthetic responses cheap to build.'''
+
+    def __init__(self, name, values):
+        Element.__init__(self, name)
+        self._fields = values
+
+    def _materialise(self):
+        if len(self._children) != len(self._fields):
+            for k, v in self._fields.items():
+                self._children[k] = Element(k, v)
+
+    def isComplexType(self):
+        return True
+
+    def numValues(self):
+        return 1
+
+    def numElements(self):
+        return len(self._fields)
+
+    def hasElement(self, name, excludeNullElements=False):
+        return str(name) in self._fields
+
+    def getElement(self, name):
+        self._materialise()
+        return Element.getElement(self, name)
+
+    def elements(self):
+        self._materialise()
+        return Element.elements(self)
+
+    def getElementValue(self, name):
+        return self._fields[str(name)]
+
+    def getElementAsString(self, name):
+        return _as_string(self._fields[str(name)])
+
+    def getElementAsFloat(self, name):
+        return float(self._fields[str(name)])
+
+    def getElementAsInteger(self, name):
+        return int(self._fields[str(name)])
+
+    def getElementAsDatetime(self, name):
+        return self._fields[str(name)]
+
+    def toPy(self):
+        return dict(self._fields)
+
+
+def _scalars(name, **values):
+    return _Row(name, values)
+
+
+class Request(object):
+    def __init__(self, service, operation):
+        self._service = service
+        self._operation = operation
+        self._root = Element(operation)
+
+    def operation(self):
+        return self._operation
+
+    def set(self, name, value):
+        self._root.setElement(name, value)
+
+    def append(self, name, value):
+        self._root._child(name).appendValue(value)
+
+    def getElement(self, name):
+        return self._root._child(name)
+
+    def asElement(self):
+        return self._root
+
+    def params(self):
+        return self._root.toPy()
+
+    def __str__(self):
+        return '%s %r' % (self._operation, self.params())
+
+
+class Service(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def createRequest(self, operation):
+        return Request(self, operation)
+
+
+class Message(object):
+    def __init__(self, messageType, element=None, correlationId=None):
+        self._type = Name(messageType)
+        self._element = element if element is not None else Element(messageType)
+        self._cids = [correlationId] if correlationId is not None else []
+
+    def messageType(self):
+        return self._type
+
+    def correlationIds(self):
+        return list(self._cids)
+
+    def correlationId(self, index=0):
+        return self._cids[index]
+
+    def asElement(self):
+        return self._element
+
+    def hasElement(self, name, excludeNullElements=False):
+        return self._element.hasElement(name)
+
+    def getElement(self, name):
+        return self._element.getElement(name)
+
+    def getElementAsString(self, name):
+        return self._element.getElementAsString(name)
+
+    def getElementAsFloat(self, name):
+        return self._element.getElementAsFloat(name)
+
+    def getElementAsInteger(self, name):
+        return self._element.getElementAsInteger(name)
+
+    def getElementAsDatetime(self, name):
+        return self._element.getElementAsDatetime(name)
+
+    def numElements(self):
+        return self._element.numElements()
+
+    def __str__(self):
+        return '%s %s' % (self._type, self._element)
+
+
+class Event(object):
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+    AUTHORIZATION_STATUS = 11
+    RESOLUTION_STATUS = 12
+    TOPIC_STATUS = 13
+    TOKEN_STATUS = 14
+    REQUEST = 15
+    UNKNOWN = -1
+
+    def __init__(self, eventType, messages=()):
+        self._type = eventType
+        self._messages = list(messages)
+
+    def eventType(self):
+        return self._type
+
+    def __iter__(self):
+        return iter(self._messages)
+
+
+class SubscriptionList(object):
+    def __init__(self):
+        self._entries = []
+
+    def add(self, topic, fields=None, options=None, correlationId=None):
+        if isinstance(fields, (list, tuple)):
+            fields = ','.join(fields)
+        self._entries.append((topic, fields, correlationId or CorrelationId()))
+        return 0
+
+    def size(self):
+        return len(self._entries)
+
+    def topicStringAt(self, index):
+        return self._entries[index][0]
+
+    def correlationIdAt(self, index):
+        return self._entries[index][2]
+
+
+class Session(object):
+    '''Synchronous (nextEvent) session, or with an eventHandler an
+    asynchronous one whose events are delivered on a dispatcher thread.'''
+
+    def __init__(self, options=None, eventHandler=None):
+        self._options = options or SessionOptions()
+        self._handler = eventHandler
+        self._services = {}
+        self._started = False
+        self._queue = collections.deque()
+        self._pending = []          # heap of (ready time, seq, cid, events)
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self._threads = []
+        self._topics = {}           # correlation id value -> (topic, fields)
+        STATS['sessions'] += 1
+
+    def start(self):
+        _time.sleep(LATENCY['start'])
+        return self.startAsync()
+
+    def startAsync(self):
+        STATS['starts'] += 1
+        self._started = True
+        self._queue.append(Event(Event.SESSION_STATUS, [Message('SessionStarted')]))
+        if self._handler is not None:
+            self._spawn(self._dispatch)
+        return True
+
+    def stop(self):
+        STATS['stops'] += 1
+        self._started = False
+        self._services.clear()
+        self._topics.clear()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        return True
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def openService(self, name):
+        if not self._started:
+            return False
+        _time.sleep(LATENCY['openService'])
+        STATS['openService'] += 1
+        self._services[name] = Service(name)
+        self._queue.append(Event(Event.SERVICE_STATUS, [Message('ServiceOpened')]))
+        return True
+
+    def getService(self, name):
+        try:
+            return self._services[name]
+        except KeyError:
+            raise NotFoundException('Service %s not opened' % name)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None,
+                    requestLabel=''):
+        if correlationId is None:
+            correlationId = CorrelationId()
+        STATS['requests'] += 1
+        if _throttled():
+            STATS['throttled'] += 1
+            events = _error_events(correlationId)
+        else:
+            events = _counted(respond(request, correlationId))
+        ready = _time.time() + LATENCY['request']
+        with self._lock:
+            heapq.heappush(self._pending, (ready, next(self._seq), correlationId, events))
+        return correlationId
+
+    def subscribe(self, subscriptionList, identity=None, requestLabel=''):
+        started = []
+        for i in range(subscriptionList.size()):
+            topic, fields, cid = subscriptionList._entries[i]
+            self._topics[cid.value()] = (topic, fields)
+            started.append(Message('SubscriptionStarted', correlationId=cid))
+            self._spawn(_mktdata_source, self, topic, cid)
+        self._queue.append(Event(Event.SUBSCRIPTION_STATUS, started))
+
+    def unsubscribe(self, subscriptionList):
+        for i in range(subscriptionList.size()):
+            self._topics.pop(subscriptionList.correlationIdAt(i).value(), None)
+
+    def terminate(self):
+        '''Simulate the terminal dropping the connection.'''
+        self._started = False
+        with self._lock:
+            self._pending = []
+        self._queue.append(Event(Event.SESSION_STATUS, [Message('SessionTerminated')]))
+
+    def tryNextEvent(self):
+        with self._lock:
+            if self._queue:
+                return self._queue.popleft()
+            if self._pending and self._pending[0][0] <= _time.time():
+                return self._next_pending()
+        return None
+
+    def nextEvent(self, timeout=0):
+        deadline = _time.time() + timeout / 1000.0 if timeout else None
+        while True:
+            with self._lock:
+                if self._queue:
+                    return self._queue.popleft()
+                wait = self._pending[0][0] - _time.time() if self._pending else None
+                if wait is not None and wait <= 0:
+                    return self._next_pending()
+            if wait is None and self._handler is None:
+                return Event(Event.TIMEOUT)
+            if deadline is not None:
+                left = deadline - _time.time()
+                if left <= 0:
+                    return Event(Event.TIMEOUT)
+                wait = left if wait is None else min(wait, left)
+            _time.sleep(min(wait if wait is not None else 0.001, 0.001)
+                        if self._handler is not None else wait)
+
+    def _dispatch(self):
+        while self._started or self._queue:
+            ev = self.tryNextEvent()
+            if ev is None:
+                _time.sleep(0.0005)
+                continue
+            self._handler(ev, self)
+
+    def _next_pending(self):
+        # Interleave outstanding requests: hand out one event of the earliest
+        # ready request and requeue the rest behind any other ready requests.
+        ready, _, cid, events = heapq.heappop(self._pending)
+        ev = next(events)
+        if ev.eventType() != Event.RESPONSE:
+            heapq.heappush(self._pending, (ready, next(self._seq), cid, events))
+        STATS['events'] += 1
+        return ev
+
+
+def _mktdata_source(session, topic, cid):
+    # Publishes MarketDataEvents for one topic: CONFIG['mktdata_burst'] updates
+    # as fast as the dispatcher keeps up, or (burst 0) one update every
+    # CONFIG['mktdata_interval'] seconds until unsubscribed.
+    rng = _rng('mktdata', topic)
+    base = 100 + rng.random() * 900
+    pool = []
+    for i in range(256):
+        px = round(base * (1 + rng.gauss(0, 0.001)), 2)
+        values = {'LAST_PRICE': px, 'SIZE_LAST_TRADE': rng.randint(1, 50) * 100,
+                  'BID': px - 0.01, 'ASK': px + 0.01}
+        if i % 4:
+            del values['SIZE_LAST_TRADE'], values['LAST_PRICE']     # quote-only update
+        pool.append(Event(Event.SUBSCRIPTION_DATA,
+                          [Message('MarketDataEvents', _Row('MarketDataEvents', values), cid)]))
+    burst = CONFIG['mktdata_burst']
+    n = 0
+    while session._started and cid.value() in session._topics and (not burst or n < burst):
+        if len(session._queue) > 10000:
+            _time.sleep(0.0001)
+            continue
+        session._queue.append(pool[n % len(pool)])
+        STATS['mktdata'] += 1
+        n += 1
+        if not burst:
+            _time.sleep(CONFIG['mktdata_interval'])
+
+
+_throttle_lock = threading.Lock()
+_throttle = {'tokens': None, 'at': 0.0, 'in_flight': 0}
+_throttle_rng = random.Random(0)
+
+
+def _throttled():
+    # whether THROTTLE rejects a request sent now; an accepted one counts as
+    # outstanding until its RESPONSE is handed out (see _counted)
+    with _throttle_lock:
+        limit, rate = THROTTLE['max_in_flight'], THROTTLE['rate']
+        if limit is not None and _throttle['in_flight'] >= limit:
+            return True
+        if rate is not None:
+            now = _time.time()
+            tokens = THROTTLE['burst'] if _throttle['tokens'] is None else _throttle['tokens']
+            tokens = min(THROTTLE['burst'], tokens + (now - _throttle['at']) * rate)
+            _throttle['at'] = now
+            if tokens < 1:
+                _throttle['tokens'] = tokens
+                return True
+            _throttle['tokens'] = tokens - 1
+        if THROTTLE['errors'] and _throttle_rng.random() < THROTTLE['errors']:
+            return True
+        _throttle['in_flight'] += 1
+        return False
+
+
+def _counted(events):
+    outstanding = True
+    try:
+        for ev in events:
+            if ev.eventType() == Event.RESPONSE:
+                outstanding = _finished()
+            yield ev
+    finally:
+        if outstanding:
+            _finished()
+
+
+def _finished():
+    with _throttle_lock:
+        _throttle['in_flight'] -= 1
+    return False
+
+
+def _error_events(cid):
+    error = _scalars('responseError', source='fake', code=-1, category=THROTTLE['category'],
+                     subcategory=THROTTLE['subcategory'], message='Request throttled')
+    yield Event(Event.RESPONSE, [Message('Response', Element('', children=[error]), cid)])
+
+
+'''Synthetic responses'''
+
+def respond(request, cid):
+    if REPLAY is not None:
+        recorded = blprecord.load(REPLAY, request)
+        if recorded is not None:
+            STATS['replayed'] += 1
+            return iter([Event(getattr(Event, evtype), [Message(msgtype, _build(node), cid)
+                                                        for msgtype, node in messages])
+                         for evtype, messages in recorded])
+        if REPLAY_STRICT:
+            raise NotFoundException('No recording of %s in %s' % (request, REPLAY))
+    op = request.operation()
+    params = request.params()
+    try:
+        handler = RESPONDERS[op]
+    except KeyError:
+        raise NotFoundException('Unsupported request %s' % op)
+    messages = handler(params, cid)
+    return _chunked_events(messages)
+
+
+def _build(node):
+    # Element tree from a blprecord node
+    if 'a' in node:
+        return Element(node['n'], array=[_build(item) if 'n' in item else blprecord.scalar(item['v'])
+                                         for item in node['a']])
+    if 'c' in node:
+        return Element(node['n'], children=[_build(c) for c in node['c']])
+    return Element(node['n'], blprecord.scalar(node.get('v')))
+
+
+def _chunked_events(messages):
+    messages = list(messages)
+    for i, msg in enumerate(messages):
+        last = i == len(messages) - 1
+        yield Event(Event.RESPONSE if last else Event.PARTIAL_RESPONSE, [msg])
+
+
+def _rng(*key):
+    return random.Random(zlib.crc32('|'.join(str(k) for k in key).encode()))
+
+
+def _minutes(start, end, step=1):
+    # bar/minute starts in [start, end), aligned to multiples of step after midnight
+    lo, hi = CONFIG['hours']
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = (start - day).total_seconds() / 60.0
+    t = day + dt.timedelta(minutes=step * int(math.ceil(offset / step)))
+    while t < end:
+        if t.weekday() < 5 and lo <= t.hour < hi:
+            yield t
+        t += dt.timedelta(minutes=step)
+
+
+_BASE = {}
+
+
+def _level(sec, t):
+    # smooth deterministic price path, so overlapping requests agree
+    if sec not in _BASE:
+        _BASE[sec] = 100 + _rng('level', sec).random() * 900
+    base = _BASE[sec]
+    days = (t - dt.datetime(2000, 1, 1)).total_seconds() / 86400.0
+    return base * (1 + 0.1 * math.sin(days / 15.0) + 0.01 * math.sin(days * 40.0))
+
+
+def _chunks(items, n):
+    for i in range(0, max(len(items), 1), n):
+        yield items[i:i + n]
+
+
+def _list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _hist_response(params, cid):
+    start = dt.datetime.strptime(params['startDate'], '%Y%m%d')
+    end = dt.datetime.strptime(params['endDate'], '%Y%m%d')
+    fields = _list(params.get('fields'))
+    for seq, sec in enumerate(_list(params.get('securities'))):
+        rows = []
+        d = start
+        while d <= end:
+            if d.weekday() < 5:
+                px = _level(sec, d) * (1 + _rng('hist', sec, d).gauss(0, 0.005))
+                values = {'date': d.date()}
+                for i, f in enumerate(fields):
+                    values[f] = round(px * (1 + 0.001 * i), 4)
+                rows.append(_scalars('', **values))
+            d += dt.timedelta(days=1)
+        data = Element('securityData', children=[
+            Element('security', sec),
+            Element('sequenceNumber', seq),
+            Element('fieldData', array=rows)])
+        yield Message('HistoricalDataResponse', Element('', children=[data]), cid)
+
+
+INDEX_MEMBERS = {}
+
+
+def _members(index, asof=None):
+    # current members, or with asof ('YYYYMMDD') the members on that date:
+    # two names are swapped out at every quarterly rebalance after it
+    if index not in INDEX_MEMBERS:
+        rng = _rng('members', index)
+        codes = sorted(rng.sample(range(1300, 9999), 225))
+        INDEX_MEMBERS[index] = ['%d JT' % c for c in codes]
+    members = list(INDEX_MEMBERS[index])
+    if asof is not None:
+        year, month = int(asof[:4]), int(asof[4:6])
+        quarter = year * 4 + (month - 1) // 3
+        today = dt.date.today()
+        for q in range(today.year * 4 + (today.month - 1) // 3, quarter, -1):
+            rng = _rng('rebalance', index, q)
+            for i in rng.sample(range(len(members)), 2):
+                members[i] = '%d JT' % rng.randint(1300, 9999)
+        members.sort()
+    return members
+
+
+def _overrides(params):
+    return dict((o['fieldId'], o['value']) for o in _list(params.get('overrides')))
+
+
+SECTORS = ['Industrials', 'Consumer Discretionary', 'Information Technology', 'Financials',
+           'Materials', 'Health Care', 'Consumer Staples', 'Communication Services']
+
+# static fields: name -> value(security, rng); anything else is a random float
+STATIC = {'CRNCY': lambda sec, rng: 'JPY',
+          'PX_ROUND_LOT_SIZE': lambda sec, rng: 100,
+          'GICS_SECTOR_NAME': lambda sec, rng: rng.choice(SECTORS),
+          'EQY_SH_OUT': lambda sec, rng: round(rng.uniform(10, 5000), 3),
+          'DVD_HIST_ALL': lambda sec, rng: [
+              _scalars('', **{'Declared Date': dt.date(2015 - i, 5, 10), 'Dividend Amount': round(rng.uniform(5, 50), 1)})
+              for i in range(4)]}
+
+
+def _ref_response(params, cid):
+    fields = _list(params.get('fields'))
+    overrides = _overrides(params)
+    securities = []
+    for seq, sec in enumerate(_list(params.get('securities'))):
+        rng = _rng('ref', sec)
+        if sec.startswith('BAD'):
+            securities.append(Element('', children=[
+                Element('security', sec),
+                Element('sequenceNumber', seq),
+                Element('securityError', children=[Element('message', 'Unknown/Invalid security')])]))
+            continue
+        values = []
+        for f in fields:
+            if f.lower() == 'indx_members':
+                rows = [_scalars('', **{'Member Ticker and Exchange Code': m})
+                        for m in ['Member Ticker and Exchange Code'] + _members(sec)]
+                values.append(Element(f, array=rows))
+            elif f.upper() == 'INDX_MWEIGHT_HIST':
+                members = _members(sec, overrides.get('END_DATE_OVERRIDE'))
+                rows = [_scalars('', **{'Index Member': m, 'Percent Weight': round(100.0 / len(members), 6)})
+                        for m in members]
+                values.append(Element(f, array=rows))
+            elif f.upper() in STATIC:
+                value = STATIC[f.upper()](sec, _rng('ref', sec, f.upper()))
+                values.append(Element(f, array=value) if isinstance(value, list) else Element(f, value))
+            else:
+                values.append(Element(f, round(rng.random() * 1000, 2)))
+        securities.append(Element('', children=[
+            Element('security', sec),
+            Element('sequenceNumber', seq),
+            Element('fieldData', children=values)]))
+    for part in _chunks(securities, 100):
+        yield Message('ReferenceDataResponse',
+                      Element('', children=[Element('securityData', array=part)]), cid)
+
+
+def _tick_response(params, cid):
+    sec = params['security']
+    start, end = params['startDateTime'], params['endDateTime']
+    events = _list(params.get('eventTypes')) or ['TRADE']
+    per_minute = CONFIG['ticks_per_minute']
+    rows = []
+    for minute in _minutes(start - dt.timedelta(minutes=1), end):
+        rng = _rng('ticks', sec, minute)
+        px = _level(sec, minute)
+        for i in range(per_minute):
+            t = minute + dt.timedelta(seconds=60.0 * i / per_minute)
+            px *= 1 + rng.gauss(0, 0.0005)
+            size = rng.randint(1, 50) * 100
+            if start <= t < end:
+                rows.append(_scalars('', time=t, type=events[i % len(events)],
+                                     value=round(px, 2), size=size))
+    for part in _chunks(rows, CONFIG['chunk']):
+        inner = Element('tickData', array=part)
+        yield Message('IntradayTickResponse',
+                      Element('', children=[Element('tickData', children=[inner])]), cid)
+
+
+def _bar_response(params, cid):
+    sec = params['security']
+    interval = int(params.get('interval', 1))
+    rows = []
+    for minute in _minutes(params['startDateTime'], params['endDateTime'], interval):
+        rng = _rng('bars', sec, minute, interval)
+        o = _level(sec, minute)
+        px = o * (1 + rng.gauss(0, 0.002))
+        high = max(o, px) * (1 + rng.random() * 0.001)
+        low = min(o, px) * (1 - rng.random() * 0.001)
+        volume = rng.randint(0, 500) * 100 * interval
+        rows.append(_scalars('',
+                             time=minute,
+                             open=round(o, 2), high=round(high, 2),
+                             low=round(low, 2), close=round(px, 2),
+                             volume=volume,
+                             numEvents=volume // 300,
+                             value=round(volume * px, 2)))
+    for part in _chunks(rows, CONFIG['chunk']):
+        inner = Element('barTickData', array=part)
+        yield Message('IntradayBarResponse',
+                      Element('', children=[Element('barData', children=[inner])]), cid)
+
+
+RESPONDERS = {'HistoricalDataRequest': _hist_response,
+              'ReferenceDataRequest': _ref_response,
+              'IntradayTickRequest': _tick_response,
+              'IntradayBarRequest': _bar_response}